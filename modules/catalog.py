@@ -0,0 +1,92 @@
+"""Shared, versioned cache of catalog responses, with ETags for conditional GETs.
+
+Cached bodies are the same for every viewer, so they are stored with is_enrolled False. It is set per viewer,
+along with the modules' enrolment counters, which change without bumping the catalog version, with one query
+for the modules in the body when a cached response is served. Counters are stored as 0, so that they don't
+change a body's digest.
+"""
+
+import hashlib
+import json
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags, quote_etag
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import Module
+
+CATALOG_VERSION_KEY = 'catalog-version'
+# Fields of modules that are read from the database whenever they are served, and their values in cached bodies
+LIVE_DEFAULTS = {'is_enrolled': False, **dict.fromkeys(Module.ENROLMENT_COUNT_FIELDS.values(), 0)}
+LIVE_FIELDS = list(LIVE_DEFAULTS)
+
+def get_catalog_version():
+    return cache.get_or_set(CATALOG_VERSION_KEY, time.time_ns, timeout=None)
+
+def bump_catalog_version():
+    """Makes every cached catalog response and search index stale. Called whenever modules are created, changed or
+    deleted. Bumped again once the transaction commits, as other workers may build responses and indexes from the
+    catalog before the change until then."""
+
+    cache.set(CATALOG_VERSION_KEY, time.time_ns(), timeout=None)
+    transaction.on_commit(lambda: cache.set(CATALOG_VERSION_KEY, time.time_ns(), timeout=None))
+
+def get_modules(data):
+    """Returns the modules in a catalog response body."""
+
+    if isinstance(data, dict) and 'results' in data:
+        return data['results']
+    if isinstance(data, dict):
+        return [data]
+    return data
+
+def catalog_response(request, build):
+    """Returns the catalog response to request, from the cache if possible.
+
+    build(catalog_version) is called on a cache miss, and returns the response data as serialized for request.user,
+    along with the ids of the modules in it, in order. For a single module, data is the module itself,
+    otherwise the modules are data or data['results']. Search results must come from an index at catalog_version,
+    the version the response is cached under.
+    """
+
+    catalog_version = get_catalog_version()
+    key = f'catalog:{catalog_version}:{hashlib.md5(request.build_absolute_uri().encode()).hexdigest()}'
+    entry = cache.get(key) if settings.CATALOG_CACHE_TIMEOUT else None
+    if entry is None:
+        data, module_ids = build(catalog_version)
+        live = {module_id: tuple(module[field] for field in LIVE_FIELDS) for module, module_id in zip(get_modules(data), module_ids)}
+        for module in get_modules(data):
+            module.update(LIVE_DEFAULTS)
+        entry = {
+            'data': data,
+            'module_ids': module_ids,
+            'digest': hashlib.md5(json.dumps(data, cls=DjangoJSONEncoder, sort_keys=True).encode()).hexdigest(),
+        }
+        if settings.CATALOG_CACHE_TIMEOUT:
+            cache.set(key, entry, settings.CATALOG_CACHE_TIMEOUT)
+    elif entry['module_ids']:
+        modules = Module.objects.filter(id__in=entry['module_ids']).with_is_enrolled(request.user)
+        live = {module_id: (bool(is_enrolled), *counts) for module_id, is_enrolled, *counts in modules.values_list('id', *LIVE_FIELDS)}
+    else:
+        live = {}
+
+    etag = quote_etag(hashlib.md5(f'{entry["digest"]}:{sorted(live.items())}'.encode()).hexdigest())
+    if etag in parse_etags(request.headers.get('If-None-Match', '')):
+        response = Response(status=status.HTTP_304_NOT_MODIFIED)
+    else:
+        for module, module_id in zip(get_modules(entry['data']), entry['module_ids']):
+            if module_id in live:
+                module.update(zip(LIVE_FIELDS, live[module_id]))
+        response = Response(entry['data'])
+
+    response['ETag'] = etag
+    response['Cache-Control'] = 'private, no-cache'
+    patch_vary_headers(response, ['Authorization'])
+    response['Access-Control-Allow-Origin'] = '*'
+    return response
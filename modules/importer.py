@@ -0,0 +1,96 @@
+import time
+
+import requests
+from django.db import transaction
+
+from .catalog import bump_catalog_version
+from .models import Module
+from .search import module_search_index
+
+NUSMODS_MODULE_LIST_URL = 'https://www.api.nusmods.com/v2/{academic_year}/moduleList.json'
+BATCH_SIZE = 500
+
+class ImportReport:
+    """Counts and timings of a catalog import."""
+
+    def __init__(self):
+        self.received = 0
+        self.created = 0
+        self.updated = 0
+        self.deleted = 0
+        self.unchanged = 0
+        self.timings = {}
+
+    def as_dict(self):
+        return {
+            'received': self.received,
+            'created': self.created,
+            'updated': self.updated,
+            'deleted': self.deleted,
+            'unchanged': self.unchanged,
+            'timings_ms': {step: round(duration * 1000, 1) for step, duration in self.timings.items()},
+        }
+
+def fetch_module_list(academic_year):
+    """Fetches the module list of an academic year (e.g. 2022-2023) from NUSMods."""
+
+    r = requests.get(NUSMODS_MODULE_LIST_URL.format(academic_year=academic_year), timeout=30)
+    r.raise_for_status()
+    return r.json()
+
+def import_modules(data, prune=False):
+    """Brings the module catalog in line with data, a list of NUSMods {moduleCode, title} dicts.
+
+    The incoming list is diffed against the existing modules in memory, and the resulting inserts
+    and updates are written in batches within one transaction. If prune is True, modules
+    missing from data are deleted, along with their enrolments and connections.
+    """
+
+    report = ImportReport()
+    start = time.perf_counter()
+
+    # Module codes are unique regardless of case.
+    incoming = {}
+    for module in data:
+        incoming[module['moduleCode'].upper()] = (module['moduleCode'], module['title'])
+    report.received = len(incoming)
+
+    existing = {}
+    for module in Module.objects.order_by('id').only('id', 'module_code', 'title'):
+        existing.setdefault(module.module_code.upper(), module)
+
+    to_create = []
+    to_update = []
+    for key, (module_code, title) in incoming.items():
+        module = existing.get(key)
+        if module is None:
+            to_create.append(Module(module_code=module_code, title=title))
+        elif module.module_code != module_code or module.title != title:
+            module.module_code = module_code
+            module.title = title
+            to_update.append(module)
+    to_delete = [module.id for key, module in existing.items() if key not in incoming] if prune else []
+    report.timings['diff'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    with transaction.atomic():
+        Module.objects.bulk_create(to_create, batch_size=BATCH_SIZE)
+        Module.objects.bulk_update(to_update, ['module_code', 'title'], batch_size=BATCH_SIZE)
+        for i in range(0, len(to_delete), BATCH_SIZE):
+            Module.objects.filter(id__in=to_delete[i:i + BATCH_SIZE]).delete()
+    report.timings['write'] = time.perf_counter() - start
+
+    report.created = len(to_create)
+    report.updated = len(to_update)
+    report.deleted = len(to_delete)
+    report.unchanged = report.received - report.created - report.updated
+
+    # Bulk writes don't send model signals, so the catalog version is bumped here, which makes every worker rebuild
+    # its search index. This one rebuilds it now.
+    start = time.perf_counter()
+    bump_catalog_version()
+    module_search_index.build()
+    report.timings['index'] = time.perf_counter() - start
+    report.timings['total'] = sum(report.timings.values())
+
+    return report
@@ -0,0 +1,54 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+
+from modules.models import Module
+from modules.search import module_search_index
+from modwithme.benchmark import percentile, seed, time_calls
+
+DEFAULT_QUERIES = ['c', 'cs', 'cs2', 'cs2030', 'ma1', 'data', 'prog', 'intro', 'engineering', 'zzz']
+
+class Rollback(Exception):
+    pass
+
+class Command(BaseCommand):
+    help = 'Compares module search latency of the in-memory index against the ORM icontains query.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('queries', nargs='*', default=DEFAULT_QUERIES)
+        parser.add_argument('--repeat', type=int, default=20, help='Number of timed runs per query.')
+        parser.add_argument('--seed', type=int, default=0,
+                            help='Number of synthetic modules to add to an empty catalog for the run. '
+                                 'They are rolled back afterwards.')
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                if options['seed']:
+                    seed(modules=options['seed'], users=0, enrolments=0, connections=0)
+                self.benchmark(options['queries'], options['repeat'])
+                raise Rollback()
+        except Rollback:
+            pass
+        module_search_index.invalidate()
+
+    def benchmark(self, queries, repeat):
+        start = time.perf_counter()
+        module_search_index.build()
+        self.stdout.write(f'Indexed {Module.objects.count()} modules in {(time.perf_counter() - start) * 1000:.1f} ms')
+        self.stdout.write(f'{"query":<15}{"results":>8}{"index p50":>12}{"index p95":>12}{"orm p50":>12}{"orm p95":>12}')
+
+        for query in queries:
+            index_times = time_calls(lambda: module_search_index.search(query), repeat)
+            orm_times = time_calls(lambda: list(
+                Module.objects.filter(Q(title__icontains=query) | Q(module_code__icontains=query))
+                .order_by('module_code', 'title').values_list('id', flat=True)
+            ), repeat)
+            results = len(module_search_index.search(query))
+            self.stdout.write(
+                f'{query:<15}{results:>8}'
+                f'{percentile(index_times, 50):>10.3f}ms{percentile(index_times, 95):>10.3f}ms'
+                f'{percentile(orm_times, 50):>10.3f}ms{percentile(orm_times, 95):>10.3f}ms'
+            )
@@ -0,0 +1,28 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from modules.importer import fetch_module_list, import_modules
+
+class Command(BaseCommand):
+    help = 'Imports the NUSMods module list of an academic year (e.g. 2022-2023) into the module catalog.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('academic_year')
+        parser.add_argument('--file', help='Path to a moduleList.json to import instead of fetching it from NUSMods.')
+        parser.add_argument('--prune', action='store_true',
+                            help='Delete modules missing from the list, along with their enrolments and connections.')
+
+    def handle(self, *args, **options):
+        if options['file']:
+            with open(options['file']) as f:
+                data = json.load(f)
+        else:
+            data = fetch_module_list(options['academic_year'])
+
+        try:
+            report = import_modules(data, prune=options['prune'])
+        except (KeyError, TypeError) as e:
+            raise CommandError(f'Invalid module list: {e!r}')
+
+        self.stdout.write(json.dumps(report.as_dict(), indent=2))
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from users.models import find_drifted_enrolment_counts, rebuild_enrolment_counts
+
+class Command(BaseCommand):
+    help = ("Checks every module's enrolment counters against its enrolments, and recounts those that have drifted. "
+            'With --all, recounts every module without checking first.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true', help='Only report drifted counters, and fail if there are any.')
+        parser.add_argument('--all', action='store_true', help='Recount every module.')
+
+    def handle(self, *args, **options):
+        if options['all']:
+            updated = rebuild_enrolment_counts()
+            self.stdout.write(f'Recounted the enrolments of {updated} modules')
+            return
+
+        drifted = find_drifted_enrolment_counts()
+        if not drifted:
+            self.stdout.write('No enrolment counters have drifted')
+            return
+        if options['check']:
+            raise CommandError(f'The enrolment counters of {len(drifted)} modules have drifted: {drifted[:20]}')
+
+        rebuild_enrolment_counts(drifted)
+        self.stdout.write(f'Recounted the enrolments of {len(drifted)} modules whose counters had drifted')
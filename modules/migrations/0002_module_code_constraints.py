@@ -0,0 +1,24 @@
+# Generated by Django 4.1.1 on 2026-10-18 18:59
+
+from django.db import migrations, models
+import django.db.models.functions.text
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('modules', '0001_initial'),
+        # Duplicate module codes are merged there first.
+        ('users', '0011_remove_duplicates'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='module',
+            index=models.Index(fields=['module_code', 'id'], name='module_code_id_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='module',
+            constraint=models.UniqueConstraint(django.db.models.functions.text.Upper('module_code'), name='unique_module_code'),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 4.1.1 on 2026-10-18 19:22
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_enrolments(apps, schema_editor):
+    """Counts the enrolments made before modules had counters."""
+
+    Module = apps.get_model('modules', 'Module')
+    Enrolment = apps.get_model('users', 'Enrolment')
+    counts = {}
+    for status, field in [('LF', 'looking_count'), ('WH', 'willing_count'), ('NL', 'not_looking_count')]:
+        enrolments = Enrolment.objects.filter(module=OuterRef('pk'), status=status).order_by().values('module')
+        counts[field] = Coalesce(Subquery(enrolments.annotate(count=Count('id')).values('count')), 0)
+    Module.objects.update(**counts)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('modules', '0002_module_code_constraints'),
+        ('users', '0014_outboxemail'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='module',
+            name='looking_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='module',
+            name='not_looking_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='module',
+            name='willing_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(count_enrolments, migrations.RunPython.noop),
+    ]
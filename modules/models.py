@@ -1,8 +1,57 @@
+from django.apps import apps
 from django.db import models
+from django.db.models.functions import Upper
+
+class ModuleQuerySet(models.QuerySet):
+    def with_code(self, module_code):
+        """Filters to the module with the given module code, ignoring case.
+
+        Unlike module_code__iexact, this can use the unique_module_code index on every database.
+        """
+
+        return self.alias(upper_module_code=Upper('module_code')).filter(upper_module_code=module_code.upper())
+
+    def with_codes(self, module_codes):
+        """Filters to the modules with any of the given module codes, ignoring case, like with_code()."""
+
+        upper_module_codes = [module_code.upper() for module_code in module_codes]
+        return self.alias(upper_module_code=Upper('module_code')).filter(upper_module_code__in=upper_module_codes)
+
+    def with_is_enrolled(self, user):
+        """Annotates each module with whether the given user is enrolled in it, within the same query."""
+
+        if user is None or not user.is_authenticated:
+            return self.annotate(is_enrolled=models.Value(False, output_field=models.BooleanField()))
+
+        Enrolment = apps.get_model('users', 'Enrolment')
+        enrolments = Enrolment.objects.filter(user=user, module=models.OuterRef('pk'))
+        return self.annotate(is_enrolled=models.Exists(enrolments))
 
 class Module(models.Model):
     title = models.CharField(max_length=200)
     module_code = models.CharField(max_length=10)
+    # Numbers of enrolments by status, kept up to date as enrolments change. See users.models.update_enrolment_counts
+    looking_count = models.IntegerField(default=0, editable=False)
+    willing_count = models.IntegerField(default=0, editable=False)
+    not_looking_count = models.IntegerField(default=0, editable=False)
+
+    # Counter field of each enrolment status
+    ENROLMENT_COUNT_FIELDS = {
+        'LF': 'looking_count',
+        'WH': 'willing_count',
+        'NL': 'not_looking_count',
+    }
+
+    objects = ModuleQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            # Also indexes lookups with Module.objects.with_code().
+            models.UniqueConstraint(Upper('module_code'), name='unique_module_code'),
+        ]
+        indexes = [
+            models.Index(fields=['module_code', 'id'], name='module_code_id_idx'),
+        ]
 
     def __str__(self) -> str:
         return self.module_code + " " + self.title
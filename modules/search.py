@@ -0,0 +1,136 @@
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+
+from .catalog import get_catalog_version
+from .models import Module
+
+# Match tiers, best first.
+EXACT_CODE = 0
+CODE_PREFIX = 1
+TITLE_WORD_PREFIX = 2
+CODE_SUBSTRING = 3
+TITLE_SUBSTRING = 4
+
+NGRAM_SIZE = 3
+
+def normalize(text):
+    return ' '.join(text.casefold().split())
+
+def ngrams(text):
+    return {text[i:i + NGRAM_SIZE] for i in range(len(text) - NGRAM_SIZE + 1)}
+
+class ModuleSearchIndex:
+    """An in-memory trigram index over module codes and titles.
+
+    Matches the same modules as a case-insensitive substring search on module_code or title,
+    ranked with exact and prefix module code matches first.
+
+    Each worker has its own index, built at a catalog version. Saving, deleting or importing modules in any worker
+    bumps the version (see catalog.py), so every worker rebuilds its index on its next search. Without a shared cache,
+    versions only reach one worker, so other workers also rebuild after MODULE_SEARCH_INDEX_MAX_AGE seconds.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._entries = {}  # module id -> (normalized module code, normalized title, module code)
+        self._postings = defaultdict(set)  # trigram -> module ids
+        self._order = None  # module ids in (module_code, title) order, recomputed lazily
+        self._positions = {}
+        self._built_at = None
+        self._catalog_version = None
+
+    def build(self, catalog_version=None):
+        """(Re)builds the index from every module in the database, at the current catalog version."""
+
+        # Read before the modules, so that a change in between makes the index out of date, not the version.
+        if catalog_version is None:
+            catalog_version = get_catalog_version()
+        entries = {}
+        postings = defaultdict(set)
+        for module_id, module_code, title in Module.objects.values_list('id', 'module_code', 'title'):
+            entries[module_id] = (normalize(module_code), normalize(title), module_code)
+            for ngram in ngrams(entries[module_id][0]) | ngrams(entries[module_id][1]):
+                postings[ngram].add(module_id)
+
+        with self._lock:
+            self._entries = entries
+            self._postings = postings
+            self._order = None
+            self._built_at = time.monotonic()
+            self._catalog_version = catalog_version
+
+    def invalidate(self):
+        """Discards the index, so that it is rebuilt on the next search."""
+
+        with self._lock:
+            self._built_at = None
+
+    def search(self, query, within=None, catalog_version=None):
+        """Returns the ids of modules matching query, best match first.
+
+        If within is given, only modules whose ids are in it are returned. catalog_version is the current
+        catalog version, if the caller has already read it.
+        """
+
+        self._ensure_built(catalog_version)
+        query = normalize(query)
+
+        with self._lock:
+            order = self._sorted_ids()
+            if len(query) < NGRAM_SIZE:
+                candidates = order
+            else:
+                postings = sorted((self._postings.get(ngram, set()) for ngram in ngrams(query)), key=len)
+                candidates = sorted(set.intersection(*postings), key=self._positions.__getitem__)
+
+            # Candidates are already in (module_code, title) order, so bucketing them by tier ranks them.
+            tiers = [[] for _ in range(TITLE_SUBSTRING + 1)]
+            for module_id in candidates:
+                if within is not None and module_id not in within:
+                    continue
+                code, title, _ = self._entries[module_id]
+                tier = self._rank(query, code, title)
+                if tier is not None:
+                    tiers[tier].append(module_id)
+
+        return [module_id for tier in tiers for module_id in tier]
+
+    def _ensure_built(self, catalog_version=None):
+        if catalog_version is None:
+            catalog_version = get_catalog_version()
+        built_at = self._built_at
+        if (built_at is None or catalog_version != self._catalog_version
+                or time.monotonic() - built_at > settings.MODULE_SEARCH_INDEX_MAX_AGE):
+            self.build(catalog_version)
+
+    def _sorted_ids(self):
+        if self._order is None:
+            self._order = sorted(self._entries, key=lambda module_id: (self._entries[module_id][2], self._entries[module_id][1]))
+            self._positions = {module_id: position for position, module_id in enumerate(self._order)}
+        return self._order
+
+    @staticmethod
+    def _rank(query, code, title):
+        if code == query:
+            return EXACT_CODE
+        if code.startswith(query):
+            return CODE_PREFIX
+        if title.startswith(query) or f' {query}' in title:
+            return TITLE_WORD_PREFIX
+        if query in code:
+            return CODE_SUBSTRING
+        if query in title:
+            return TITLE_SUBSTRING
+        return None
+
+module_search_index = ModuleSearchIndex()
+
+def search_modules(queryset, query, paginator, request, within=None, catalog_version=None):
+    """Returns the requested page of modules in queryset that match query, best match first."""
+
+    module_ids = paginator.paginate_queryset(module_search_index.search(query, within, catalog_version), request)
+    modules = queryset.in_bulk(module_ids)
+    return [modules[module_id] for module_id in module_ids if module_id in modules]
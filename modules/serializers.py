@@ -8,8 +8,19 @@ class ModuleSerializer(serializers.ModelSerializer):
     is_enrolled = serializers.SerializerMethodField()
 
     def get_is_enrolled(self, obj):
+        # Annotated by Module.objects.with_is_enrolled()
+        if hasattr(obj, 'is_enrolled'):
+            return obj.is_enrolled
+
+        # Precomputed by the view, e.g. for modules nested in connections
+        enrolled_module_ids = self.context.get('enrolled_module_ids')
+        if enrolled_module_ids is not None:
+            return obj.id in enrolled_module_ids
+
         user = self.context.get('user')
+        if user is None or not user.is_authenticated:
+            return False
         return Enrolment.objects.filter(user=user, module=obj).exists()
     class Meta:
         model = Module
-        fields = ('title', 'module_code', 'is_enrolled')
\ No newline at end of file
+        fields = ('title', 'module_code', 'is_enrolled', 'looking_count', 'willing_count', 'not_looking_count')
\ No newline at end of file
@@ -1,3 +1,520 @@
-from django.test import TestCase
+import asyncio
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.serializers import BaseSerializer
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from modwithme.metrics import RequestMetricsMiddleware, instrument_serializers, registry
+from users.models import Connection, Connection_Status, Enrolment, User, User_Status
+from users.recommendations import (
+    ENROLMENT_CHANGES_KEY, CoEnrolmentIndex, co_enrolment_index, enrolment_change_key, record_enrolment_changes,
+)
+
+from .catalog import bump_catalog_version, get_catalog_version
+from .importer import import_modules
+from .models import Module
+from .search import module_search_index
+
+class ModulesViewTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('e0000001@u.nus.edu', 'password', name='Alice')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def create_modules(self, count, enrol=True):
+        start = Module.objects.count()
+        for i in range(start, start + count):
+            module = Module.objects.create(module_code=f'CS{1000 + i}', title=f'Module {i}')
+            if enrol and i % 2 == 0:
+                Enrolment.objects.create(user=self.user, module=module)
+
+    def test_is_enrolled(self):
+        self.create_modules(4)
+        response = self.client.get('/modules')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([m['is_enrolled'] for m in response.data], [True, False, True, False])
+
+    def test_query_count_does_not_grow_with_page_size(self):
+        self.create_modules(2)
+        with self.assertNumQueries(2):
+            self.client.get('/modules')
+
+        self.create_modules(18)
+        with self.assertNumQueries(2):
+            self.client.get('/modules')
+
+    def test_cursor_pagination(self):
+        self.create_modules(45)
+        codes = []
+        response = self.client.get('/modules', {'cursor': '', 'count': 'exact'})
+        self.assertEqual(response.data['count'], 45)
+        self.assertIsNone(response.data['previous'])
+        while True:
+            codes += [m['module_code'] for m in response.data['results']]
+            if response.data['next'] is None:
+                break
+            with self.assertNumQueries(1):
+                response = self.client.get(response.data['next'])
+        self.assertEqual(codes, [f'CS{1000 + i}' for i in range(45)])
+
+        response = self.client.get(response.data['previous'])
+        self.assertEqual(response.data['results'][0]['module_code'], 'CS1020')
+        self.assertNotIn('count', response.data)
+
+        response = self.client.get('/modules', {'page': 3})
+        self.assertEqual([m['module_code'] for m in response.data], [f'CS{1000 + i}' for i in range(40, 45)])
+
+class ModuleUsersViewTest(TestCase):
+    def setUp(self):
+        self.module = Module.objects.create(module_code='CS1010', title='Programming Methodology')
+        self.user = User.objects.create_user('e0000001@u.nus.edu', 'password', name='Alice')
+        Enrolment.objects.create(user=self.user, module=self.module, status=Enrolment.LOOKING)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def create_classmates(self, count, status=Enrolment.LOOKING):
+        start = User.objects.count()
+        classmates = []
+        for i in range(start, start + count):
+            classmate = User.objects.create_user(f'e{i + 1:07d}@u.nus.edu', 'password', name=f'Student {i}')
+            Enrolment.objects.create(user=classmate, module=self.module, status=status)
+            classmates.append(classmate)
+        return classmates
+
+    def test_statuses(self):
+        looking, willing = self.create_classmates(2)
+        Enrolment.objects.filter(user=willing).update(status=Enrolment.WILLING)
+        self.create_classmates(1, status=Enrolment.NOT_LOOKING)
+        Connection.objects.create(requester=self.user, accepter=willing, module=self.module, status=Connection.ACCEPTED)
+
+        response = self.client.get('/modules/cs1010/users')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [(u['id'], u['user_status'], u['connection_status']) for u in response.data],
+            [(looking.id, User_Status.LF.value, 0), (willing.id, User_Status.WH.value, Connection_Status.AC.value)],
+        )
+
+        response = self.client.get('/modules/cs1010/users', {'connection_status': Connection_Status.AC.value})
+        self.assertEqual([u['id'] for u in response.data], [willing.id])
+
+    def test_query_count_does_not_grow_with_roster(self):
+        self.create_classmates(2)
+        with self.assertNumQueries(2):
+            self.client.get('/modules/cs1010/users')
+
+        self.create_classmates(18)
+        with self.assertNumQueries(2):
+            response = self.client.get('/modules/cs1010/users')
+        self.assertEqual(len(response.data), 20)
+
+    def test_cursor_pagination(self):
+        classmates = self.create_classmates(25)
+        response = self.client.get('/modules/cs1010/users', {'cursor': ''})
+        self.assertEqual([u['id'] for u in response.data['results']], [c.id for c in classmates[:20]])
+        response = self.client.get(response.data['next'])
+        self.assertEqual([u['id'] for u in response.data['results']], [c.id for c in classmates[20:]])
+        self.assertIsNone(response.data['next'])
+
+        response = self.client.get('/modules/cs1010/users', {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_name_search(self):
+        names = ['Tan Wei Jie', 'Wei Ling Ng', 'Chloé  Weiss', 'Marcus Lee', 'Lee Hwei']
+        classmates = self.create_classmates(len(names))
+        for classmate, name in zip(classmates, names):
+            classmate.name = name
+            classmate.save()
+
+        response = self.client.get('/modules/cs1010/users', {'name': 'wei'})
+        # Name prefixes first, then word prefixes, then other matches
+        self.assertEqual([u['name'] for u in response.data], ['Wei Ling Ng', 'Tan Wei Jie', 'Chloé  Weiss', 'Lee Hwei'])
+        response = self.client.get('/modules/cs1010/users', {'name': 'chloe WEI'})
+        self.assertEqual([u['name'] for u in response.data], ['Chloé  Weiss'])
+        response = self.client.get('/modules/cs1010/users', {'name': 'lee', 'cursor': ''})
+        self.assertEqual([u['name'] for u in response.data['results']], ['Marcus Lee', 'Lee Hwei'])
+
+        Connection.objects.create(requester=classmates[0], accepter=self.user, module=self.module)
+        Connection.objects.create(requester=self.user, accepter=classmates[3], module=self.module)
+        response = self.client.get('/user/connections', {'q': 'WEI J'})
+        self.assertEqual([c['other_user']['name'] for c in response.data], ['Tan Wei Jie'])
+
+    def test_name_search_with_expanding_name(self):
+        classmate = self.create_classmates(1)[0]
+        classmate.name = 'ß' * 50
+        classmate.save()
+        # A length limit on search_name would fail this, as it would fail the save on PostgreSQL
+        classmate.clean_fields(exclude=['major'])
+        self.assertEqual(User.objects.get(id=classmate.id).search_name, 'ss' * 50)
+
+        response = self.client.get('/modules/cs1010/users', {'name': 'SSS'})
+        self.assertEqual([u['id'] for u in response.data], [classmate.id])
+
+class ModuleRecommendationsViewTest(TestCase):
+    def setUp(self):
+        co_enrolment_index.invalidate()
+        self.modules = [Module.objects.create(module_code=f'CS{1010 + i}', title=f'Module {i}') for i in range(4)]
+        self.user = User.objects.create_user('e0000001@u.nus.edu', name='Alice')
+        for module in self.modules:
+            Enrolment.objects.create(user=self.user, module=module, status=Enrolment.LOOKING)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def create_classmate(self, shared, status=Enrolment.LOOKING):
+        classmate = User.objects.create_user(f'e{User.objects.count() + 1:07d}@u.nus.edu', name='Student')
+        Enrolment.objects.create(user=classmate, module=self.modules[0], status=status)
+        for module in self.modules[1:shared + 1]:
+            Enrolment.objects.create(user=classmate, module=module)
+        return classmate
+
+    def test_ranks_by_shared_modules(self):
+        one, three, none = self.create_classmate(1), self.create_classmate(3), self.create_classmate(0)
+        self.create_classmate(3, status=Enrolment.NOT_LOOKING)
+        connected = self.create_classmate(3)
+        Connection.objects.create(requester=connected, accepter=self.user, module=self.modules[0])
+
+        response = self.client.get('/modules/cs1010/recommendations')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([(u['id'], u['shared_modules']) for u in response.data], [(three.id, 3), (one.id, 1), (none.id, 0)])
+
+        # Enrolments made after the index is built are picked up
+        with self.captureOnCommitCallbacks(execute=True):
+            Enrolment.objects.create(user=none, module=self.modules[1])
+            Enrolment.objects.create(user=none, module=self.modules[2])
+            Enrolment.objects.filter(user=three, module=self.modules[3]).delete()
+        response = self.client.get('/modules/cs1010/recommendations')
+        self.assertEqual([(u['id'], u['shared_modules']) for u in response.data], [(three.id, 2), (none.id, 2), (one.id, 1)])
+
+    def test_unknown_module(self):
+        self.assertEqual(self.client.get('/modules/xx0000/recommendations').status_code, 404)
+
+    def test_other_workers_follow_enrolment_changes(self):
+        classmate = self.create_classmate(1)
+        # Another worker's matrix
+        index = CoEnrolmentIndex()
+        self.assertEqual(index.rank([m.id for m in self.modules], [classmate.id]), [(classmate.id, 2)])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Enrolment.objects.create(user=classmate, module=self.modules[2])
+            Enrolment.objects.bulk_create([Enrolment(user=classmate, module=self.modules[3])])
+            record_enrolment_changes([(classmate.id, self.modules[3].id, True)])
+        with mock.patch.object(index, 'build') as build:
+            self.assertEqual(index.rank([m.id for m in self.modules], [classmate.id]), [(classmate.id, 4)])
+        build.assert_not_called()
+
+        # Changes that are no longer in the cache are read from the database.
+        with self.captureOnCommitCallbacks(execute=True):
+            Enrolment.objects.filter(user=classmate, module=self.modules[3]).delete()
+        cache.delete(enrolment_change_key(cache.get(ENROLMENT_CHANGES_KEY)))
+        self.assertEqual(index.rank([m.id for m in self.modules], [classmate.id]), [(classmate.id, 3)])
+
+class ModuleSearchTest(TestCase):
+    def setUp(self):
+        module_search_index.invalidate()
+        for module_code, title in [
+            ('MA1521', 'Calculus for Computing'),
+            ('CS2030S', 'Programming Methodology II'),
+            ('CS1010', 'Programming Methodology'),
+            ('CS2030', 'Programming Methodology II'),
+            ('GEA1000', 'Quantitative Reasoning with Data'),
+        ]:
+            Module.objects.create(module_code=module_code, title=title)
+        self.client = APIClient()
+
+    def test_code_prefix_matches_first(self):
+        response = self.client.get('/modules', {'q': 'cs2030'})
+        self.assertEqual([m['module_code'] for m in response.data], ['CS2030', 'CS2030S'])
+
+        response = self.client.get('/modules', {'q': 'comp'})
+        self.assertEqual([m['module_code'] for m in response.data], ['MA1521'])
+
+        response = self.client.get('/modules', {'q': 'methodology ii'})
+        self.assertEqual([m['module_code'] for m in response.data], ['CS2030', 'CS2030S'])
+
+    def test_cursor_pagination(self):
+        response = self.client.get('/modules', {'q': 'cs2030', 'cursor': '', 'count': 'exact'})
+        self.assertEqual(response.data['count'], 2)
+        self.assertEqual([m['module_code'] for m in response.data['results']], ['CS2030', 'CS2030S'])
+        self.assertIsNone(response.data['next'])
+
+    def test_index_follows_catalog_changes(self):
+        self.client.get('/modules', {'q': 'data'})
+        Module.objects.create(module_code='DSA1101', title='Introduction to Data Science')
+        Module.objects.filter(module_code='GEA1000').get().delete()
+
+        response = self.client.get('/modules', {'q': 'data'})
+        self.assertEqual([m['module_code'] for m in response.data], ['DSA1101'])
+
+    def test_index_follows_other_workers_changes(self):
+        self.client.get('/modules', {'q': 'data'})
+        # As another worker would, without this one's signals
+        Module.objects.bulk_create([Module(module_code='DSA1101', title='Introduction to Data Science')])
+        bump_catalog_version()
+
+        response = self.client.get('/modules', {'q': 'data'})
+        self.assertEqual([m['module_code'] for m in response.data], ['DSA1101', 'GEA1000'])
+
+@override_settings(CATALOG_CACHE_TIMEOUT=60)
+class CatalogCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.module = Module.objects.create(module_code='CS1010', title='Programming Methodology')
+        Module.objects.create(module_code='CS2030', title='Programming Methodology II')
+        self.user = User.objects.create_user('e0000001@u.nus.edu', name='Alice')
+        Enrolment.objects.create(user=self.user, module=self.module)
+        self.other_user = User.objects.create_user('e0000002@u.nus.edu', name='Bob')
+        self.client = APIClient()
+
+    def test_cached_per_catalog_version(self):
+        self.client.force_authenticate(self.user)
+        response = self.client.get('/modules')
+        self.assertEqual([m['is_enrolled'] for m in response.data], [True, False])
+
+        # Served from the cache, with is_enrolled set for each viewer
+        self.client.force_authenticate(self.other_user)
+        with self.assertNumQueries(1):
+            response = self.client.get('/modules')
+        self.assertEqual([m['is_enrolled'] for m in response.data], [False, False])
+        self.client.force_authenticate(None)
+        self.client.get('/modules/cs2030')
+        with self.assertNumQueries(1):
+            response = self.client.get('/modules/cs2030')
+        self.assertEqual(response.data['title'], 'Programming Methodology II')
+
+        # Enrolment counters are served live, without a new catalog version
+        Enrolment.objects.create(user=self.other_user, module=self.module, status=Enrolment.WILLING)
+        response = self.client.get('/modules')
+        self.assertEqual([(m['looking_count'], m['willing_count']) for m in response.data], [(1, 1), (0, 0)])
+
+        self.client.force_authenticate(None)
+        Module.objects.create(module_code='CS1231', title='Discrete Structures')
+        response = self.client.get('/modules')
+        self.assertEqual([m['module_code'] for m in response.data], ['CS1010', 'CS1231', 'CS2030'])
+
+    def test_search_cached_from_current_index(self):
+        module_search_index.invalidate()
+        self.client.get('/modules', {'q': 'discrete'})
+        # As another worker would, importing a module
+        Module.objects.bulk_create([Module(module_code='CS1231', title='Discrete Structures')])
+        bump_catalog_version()
+
+        # Built from a rebuilt index, rather than this worker's old one, before it is cached for every worker
+        self.assertEqual([m['module_code'] for m in self.client.get('/modules', {'q': 'discrete'}).data], ['CS1231'])
+        # Served from the cache, with only the live fields read
+        with self.assertNumQueries(1):
+            response = self.client.get('/modules', {'q': 'discrete'})
+        self.assertEqual([m['module_code'] for m in response.data], ['CS1231'])
+
+    def test_conditional_get(self):
+        self.client.force_authenticate(self.user)
+        etag = self.client.get('/modules/cs1010')['ETag']
+        self.assertEqual(self.client.get('/modules/cs1010', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        # The ETag changes with the viewer's enrolments, as well as with the catalog
+        Enrolment.objects.filter(user=self.user).delete()
+        response = self.client.get('/modules/cs1010', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.data['is_enrolled'])
+        etag = response['ETag']
+
+        # A new catalog version with the same module doesn't change it
+        version = get_catalog_version()
+        import_modules([])
+        self.assertNotEqual(get_catalog_version(), version)
+        self.assertEqual(self.client.get('/modules/cs1010', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        self.module.title = 'Programming Methodology I'
+        self.module.save()
+        response = self.client.get('/modules/cs1010', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.data['title'], 'Programming Methodology I')
+
+class EnrolmentCountsTest(TestCase):
+    def setUp(self):
+        self.module = Module.objects.create(module_code='CS1010', title='Programming Methodology')
+        self.other_module = Module.objects.create(module_code='CS2030', title='Programming Methodology II')
+        self.user = User.objects.create_user('e0000001@u.nus.edu', name='Alice')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def counts(self, module):
+        module.refresh_from_db()
+        return module.looking_count, module.willing_count, module.not_looking_count
+
+    def test_counters_follow_enrolments(self):
+        classmate = User.objects.create_user('e0000002@u.nus.edu', name='Bob')
+        Enrolment.objects.create(user=classmate, module=self.module, status=Enrolment.WILLING)
+        self.client.post('/user/modules/enroll', {'module_code': 'CS1010'})
+        self.assertEqual(self.counts(self.module), (0, 1, 1))
+
+        self.client.put('/user/modules/status/CS1010', {'status': User_Status.LF.value}, format='json')
+        self.assertEqual(self.counts(self.module), (1, 1, 0))
+
+        self.client.post('/user/modules/enroll/batch', {'add': ['CS2030'], 'remove': ['CS1010']}, format='json')
+        self.assertEqual(self.counts(self.module), (0, 1, 0))
+        self.assertEqual(self.counts(self.other_module), (0, 0, 1))
+
+        classmate.delete()
+        self.assertEqual(self.counts(self.module), (0, 0, 0))
+
+    def test_rebuild_command(self):
+        Enrolment.objects.create(user=self.user, module=self.module, status=Enrolment.LOOKING)
+        Module.objects.filter(id=self.module.id).update(looking_count=5, willing_count=2)
+
+        with self.assertRaises(CommandError):
+            call_command('rebuild_enrolment_counts', '--check', stdout=StringIO())
+        call_command('rebuild_enrolment_counts', stdout=StringIO())
+        self.assertEqual(self.counts(self.module), (1, 0, 0))
+        call_command('rebuild_enrolment_counts', '--check', stdout=StringIO())
+
+class AsyncViewsTest(TestCase):
+    """The async views return the same as their sync counterparts."""
+
+    def setUp(self):
+        self.module = Module.objects.create(module_code='CS1010', title='Programming Methodology')
+        Module.objects.create(module_code='CS2030', title='Programming Methodology II')
+        self.user = User.objects.create_user('e0000001@u.nus.edu', name='Alice')
+        Enrolment.objects.create(user=self.user, module=self.module, status=Enrolment.LOOKING)
+        for i in range(3):
+            classmate = User.objects.create_user(f'e{i + 2:07d}@u.nus.edu', name=f'Student {i}')
+            Enrolment.objects.create(user=classmate, module=self.module, status=Enrolment.WILLING)
+            Connection.objects.create(requester=classmate, accepter=self.user, module=self.module)
+        self.authorization = f'Bearer {RefreshToken.for_user(self.user).access_token}'
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=self.authorization)
+
+    async def test_same_as_sync(self):
+        paths = [
+            ('modules', {}), ('modules', {'q': 'cs'}), ('modules', {'cursor': ''}), ('modules/cs1010', {}),
+            ('modules/cs1010/users', {}), ('modules/cs1010/users', {'user_status': User_Status.WH.value}),
+            ('user/connections', {}), ('user/connections', {'type': 0}), (f'user/{self.user.id + 1}', {}),
+        ]
+        for path, params in paths:
+            response = await self.async_client.get(f'/async/{path}', params, authorization=self.authorization)
+            expected = await sync_to_async(self.client.get)(f'/{path}', params)
+            self.assertEqual(response.status_code, expected.status_code, path)
+            self.assertEqual(response.json(), expected.json(), path)
+
+    async def test_profile_cards_not_read_on_event_loop(self):
+        get_many, set_many = cache.get_many, cache.set_many
+
+        def off_event_loop(method):
+            def call(*args, **kwargs):
+                with self.assertRaises(RuntimeError):
+                    asyncio.get_running_loop()
+                return method(*args, **kwargs)
+            return call
+
+        with mock.patch.object(cache, 'get_many', off_event_loop(get_many)), mock.patch.object(cache, 'set_many', off_event_loop(set_many)):
+            for path in ['modules/cs1010/users', 'user/connections', 'user/connections?cursor=', f'user/{self.user.id}', f'user/{self.user.id + 1}']:
+                response = await self.async_client.get(f'/async/{path}', authorization=self.authorization)
+                self.assertEqual(response.status_code, 200, path)
+
+    async def test_authentication(self):
+        response = await self.async_client.get('/async/user/connections')
+        self.assertEqual(response.status_code, 401)
+        response = await self.async_client.get('/async/user/connections', authorization='Bearer invalid')
+        self.assertEqual(response.status_code, 401)
+        response = await self.async_client.get('/async/modules/xx0000')
+        self.assertEqual(response.status_code, 404)
+
+class ModuleManualUpdateViewTest(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser('admin@u.nus.edu', 'password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+        Module.objects.create(module_code='CS1010', title='Programming Methodology')
+        Module.objects.create(module_code='CS1101S', title='Programming Methodology')
+
+    def test_import(self):
+        data = [
+            {'moduleCode': 'CS1010', 'title': 'Programming Methodology'},
+            {'moduleCode': 'CS1101S', 'title': 'Programming Methodology I'},
+            {'moduleCode': 'CS2030', 'title': 'Programming Methodology II'},
+        ]
+        with self.assertNumQueries(6):
+            response = self.client.post('/modules/update/manual/2022-2023', data, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            {key: response.data[key] for key in ('created', 'updated', 'unchanged', 'deleted')},
+            {'created': 1, 'updated': 1, 'unchanged': 1, 'deleted': 0},
+        )
+        self.assertEqual(
+            list(Module.objects.order_by('module_code').values_list('module_code', 'title')),
+            [(m['moduleCode'], m['title']) for m in data],
+        )
+
+        response = self.client.post('/modules/update/manual/2022-2023?prune=true', data[1:], format='json')
+        self.assertEqual(response.data['deleted'], 1)
+        self.assertFalse(Module.objects.filter(module_code='CS1010').exists())
+
+    def test_invalid_data(self):
+        response = self.client.post('/modules/update/manual/2022-2023', [{'title': 'No module code'}], format='json')
+        self.assertEqual(response.status_code, 400)
+
+@override_settings(REQUEST_METRICS_ENABLED=True)
+class RequestMetricsTest(TestCase):
+    def setUp(self):
+        registry.reset()
+        self.module = Module.objects.create(module_code='CS1010', title='Programming Methodology')
+        self.user = User.objects.create_user('e0000001@u.nus.edu', name='Alice')
+        Enrolment.objects.create(user=self.user, module=self.module)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_server_timing(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/modules/CS1010/users')
+        self.assertEqual(response.status_code, 200)
+        timings = dict(entry.split(';', 1) for entry in response['Server-Timing'].split(', '))
+        self.assertEqual(list(timings), ['db', 'view', 'serializer', 'total'])
+        self.assertIn(f'desc="{len(queries)} queries"', timings['db'])
+        self.assertTrue(all(timing.startswith('dur=') for timing in timings.values()))
+
+    def test_histograms_grouped_by_url_name(self):
+        self.client.get('/modules/CS1010/users')
+        self.client.get('/modules/CS1010/users/')
+        self.client.get('/modules')
+
+        endpoints = registry.snapshot()
+        self.assertEqual(endpoints['get-module-users']['total_ms']['count'], 2)
+        self.assertEqual(endpoints['get-modules']['queries']['count'], 1)
+        self.assertEqual(sum(endpoints['get-modules']['response_bytes']['buckets'].values()), 1)
+
+    def test_metrics_view_is_admin_only(self):
+        self.client.get('/modules')
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+
+        self.user.is_staff = True
+        self.user.save()
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['enabled'])
+        self.assertIn('get-modules', response.data['endpoints'])
+
+    @override_settings(REQUEST_METRICS_ENABLED=False)
+    def test_disabled(self):
+        serializer_data = BaseSerializer.data
+        with self.assertRaises(MiddlewareNotUsed):
+            RequestMetricsMiddleware(lambda request: None)
+        # Serializers are only instrumented by an enabled middleware, and otherwise untimed.
+        self.assertIs(BaseSerializer.data, serializer_data)
+
+        response = APIClient().get('/modules')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('Server-Timing', response)
+
+        # As if an enabled middleware had instrumented serializers earlier in the process
+        instrument_serializers()
+        instrumented_response = APIClient().get('/modules')
+        self.assertEqual(instrumented_response.data, response.data)
+        self.assertNotIn('Server-Timing', instrumented_response)
+        self.assertEqual(registry.snapshot(), {})
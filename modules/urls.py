@@ -6,6 +6,14 @@ urlpatterns = [
     re_path(r'modules/?$', views.ModulesView.as_view(), name='get-modules'),
     re_path(r'modules/(?P<module_code>\w+)/?$', views.ModuleView.as_view(), name='get-module'),
     re_path(r'modules/(?P<module_code>\w+)/users/?$', views.ModuleUsersView.as_view(), name='get-module-users'),
+    re_path(r'modules/(?P<module_code>\w+)/recommendations/?$', views.ModuleRecommendationsView.as_view(), name='get-module-recommendations'),
     re_path(r'modules/update/(?P<academic_year>[\w-]+)/?$', views.ModuleUpdateView.as_view(), name='update-modules'),
     re_path(r'modules/update/manual/(?P<academic_year>[\w-]+)/?$', views.ModuleManualUpdateView.as_view(), name='update-modules'),
 ]
+
+# Served by ASGI workers under /async/
+async_urlpatterns = [
+    re_path(r'modules/?$', views.AsyncModulesView.as_view(), name='async-get-modules'),
+    re_path(r'modules/(?P<module_code>\w+)/?$', views.AsyncModuleView.as_view(), name='async-get-module'),
+    re_path(r'modules/(?P<module_code>\w+)/users/?$', views.AsyncModuleUsersView.as_view(), name='async-get-module-users'),
+]
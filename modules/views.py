@@ -1,19 +1,26 @@
 from enum import Enum
 from multiprocessing import context
 from urllib import request
-from django.db.models import Q
+from django.db.models import Exists, OuterRef, Q
 from django.shortcuts import render
 from rest_framework import viewsets, permissions, status
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.pagination import PageNumberPagination
 
-import requests
-
+from asgiref.sync import sync_to_async
+from modwithme.asyncapi import AsyncAPIView, api_response, get_page, get_page_data
+from modwithme.pagination import ListCursorPagination, ModuleCursorPagination, UserCursorPagination, is_cursor_request
+from .catalog import catalog_response
+from .importer import fetch_module_list, import_modules
+from .search import module_search_index, search_modules
 from .serializers import ModuleSerializer
+from users.cards import aget_profile_cards
 from users.serializers import SimpleUserSerializer
 from .models import Module
 from users.models import Connection_Status, User, Enrolment, Connection, User_Status
+from users.recommendations import co_enrolment_index
+from users.search import name_matches, rank_name_matches
 
 from modules import serializers
 
@@ -26,65 +33,155 @@ class ModuleViewSet(viewsets.ReadOnlyModelViewSet):
         return context
     
     def get_queryset(self):
-        queryset = Module.objects.all().order_by('module_code')
+        queryset = Module.objects.with_is_enrolled(self.request.user).order_by('module_code')
         search_query = self.request.query_params.get('q')
         paginator = PageNumberPagination()
         if search_query:
-            queryset = queryset.filter(Q(title__icontains=search_query) | Q(module_code__icontains=search_query)).order_by('module_code', 'title')
+            return search_modules(queryset, search_query, paginator, self.request)
         queryset = paginator.paginate_queryset(queryset, self.request)
         return queryset
 
 class ModulesView(APIView):
 
     def get(self, request):
-        queryset = Module.objects.all().order_by('module_code')
+        return catalog_response(request, lambda catalog_version: self.get_catalog(request, catalog_version))
+
+    def get_catalog(self, request, catalog_version):
+        queryset = Module.objects.with_is_enrolled(request.user).order_by('module_code')
         search_query = self.request.query_params.get('q')
-        paginator = PageNumberPagination()
+        cursor = is_cursor_request(request)
         if search_query:
-            queryset = queryset.filter(Q(title__icontains=search_query) | Q(module_code__icontains=search_query)).order_by('module_code', 'title')
-        queryset = paginator.paginate_queryset(queryset, self.request)
-        serializer = ModuleSerializer(queryset, many=True, context={'user': self.request.user})
-        response = Response(serializer.data)
+            paginator = ListCursorPagination() if cursor else PageNumberPagination()
+            queryset = search_modules(queryset, search_query, paginator, self.request, catalog_version=catalog_version)
+        else:
+            paginator = ModuleCursorPagination() if cursor else PageNumberPagination()
+            queryset = paginator.paginate_queryset(queryset, self.request)
+        serializer = ModuleSerializer(queryset, many=True, context={'user': request.user})
+        data = paginator.get_paginated_response(serializer.data).data if cursor else serializer.data
+        return data, [module.id for module in queryset]
+
+
+
+def module_users_queryset(user, module_code, params):
+    """Returns the users in a module who are looking for partners, other than user, filtered by the request's params."""
+
+    name_filter = params.get('name')
+    user_status_filter = params.get('user_status')
+    connection_status_filter = params.get('connection_status')
+
+    # Enrolment and connection statuses are read from annotated columns, so that
+    # a page of users is fetched in a single query.
+    queryset = User.objects.enrolled_in(module_code).with_connection_status(user).exclude(id=user.id)
+
+    if name_filter:
+        queryset = queryset.filter(name_matches(name_filter))
+    if user_status_filter:
+        status = User_Status(int(user_status_filter)).name
+        queryset = queryset.filter(module_enrolment_status=status)
+    # Don't include users not looking for matches.
+    queryset = queryset.filter(module_enrolment_status__in=[Enrolment.LOOKING, Enrolment.WILLING])
+
+    if connection_status_filter:
+        # users with a connection to user, for target module_code, and target connection_status
+        status = Connection_Status(int(connection_status_filter)).name
+        connections = Connection.objects.filter(
+            Q(requester=user, accepter=OuterRef('pk')) | Q(requester=OuterRef('pk'), accepter=user),
+            module__in=Module.objects.with_code(module_code),
+            status=status,
+        )
+        queryset = queryset.filter(Exists(connections))
+
+    if name_filter:
+        # Best name matches first. Cursor pages are in id order, as cursor paginators set their own ordering.
+        return rank_name_matches(queryset, name_filter).order_by('name_rank', 'id')
+    return queryset.order_by('id')
+
+class ModuleUsersView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, module_code):
+        cursor = is_cursor_request(request)
+        paginator = UserCursorPagination() if cursor else PageNumberPagination()
+
+        # all users who are in the module, with filters
+        queryset = paginator.paginate_queryset(module_users_queryset(request.user, module_code, request.query_params), request)
+        serializer = SimpleUserSerializer(queryset, many=True, context={'user': request.user, 'module_code': module_code})
+        response = paginator.get_paginated_response(serializer.data) if cursor else Response(serializer.data)
         response['Access-Control-Allow-Origin'] = '*'
         return response
 
+class AsyncModulesView(AsyncAPIView):
+    """ModulesView for ASGI servers, without the response cache."""
 
+    async def get(self, request):
+        queryset = Module.objects.with_is_enrolled(request.user).order_by('module_code')
+        search_query = request.GET.get('q')
+        if search_query:
+            paginator = ListCursorPagination()
+            module_ids = await get_page(await sync_to_async(module_search_index.search)(search_query), request, paginator)
+            modules = {module.id: module async for module in queryset.filter(id__in=module_ids)}
+            modules = [modules[module_id] for module_id in module_ids if module_id in modules]
+        else:
+            paginator = ModuleCursorPagination()
+            modules = await get_page(queryset, request, paginator)
+        serializer = ModuleSerializer(modules, many=True, context={'user': request.user})
+        return api_response(get_page_data(serializer.data, request, paginator))
+
+class AsyncModuleView(AsyncAPIView):
+
+    async def get(self, request, module_code):
+        module = await Module.objects.with_is_enrolled(request.user).with_code(module_code).afirst()
+        if module is None:
+            return api_response("Module not found.", status=status.HTTP_404_NOT_FOUND)
+        return api_response(ModuleSerializer(module, context={'user': request.user}).data)
+
+class AsyncModuleUsersView(AsyncAPIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    async def get(self, request, module_code):
+        paginator = UserCursorPagination()
+        users = await get_page(module_users_queryset(request.user, module_code, request.GET), request, paginator)
+        profile_cards = await aget_profile_cards(SimpleUserSerializer(), users)
+        serializer = SimpleUserSerializer(users, many=True, context={'user': request.user, 'module_code': module_code, 'profile_cards': profile_cards})
+        return api_response(get_page_data(serializer.data, request, paginator))
+
+class ModuleRecommendationsView(APIView):
+    """Lists users in a module looking for partners, who aren't connected with request.user yet,
+    ranked by the number of other modules they share with request.user."""
 
-class ModuleUsersView(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def get(self, request, module_code):
-        name_filter = request.query_params.get('name')
-        user_status_filter = request.query_params.get('user_status')
-        connection_status_filter = request.query_params.get('connection_status')
-        page_filter = request.query_params.get('page')
-        paginator = PageNumberPagination()
-        enrolments = Enrolment.objects.all().filter(Q(module__module_code__iexact=module_code), ~Q(user__exact=request.user)).order_by('user')
-
-        if name_filter:
-            enrolments = enrolments.filter(Q(user__first_name__icontains=name_filter) | Q(user__last_name__icontains=name_filter))
-        if user_status_filter:
-            status = User_Status(int(user_status_filter)).name
-            enrolments = enrolments.filter(status__iexact=status)
-        # Don't include enrolments of users not looking for matches.
-        enrolments = enrolments.exclude(status__iexact='NL')
-
-        
-        if connection_status_filter:
-            # all connections where request.user is involved in, for target module_code, and target connection_status
-            connections = Connection.objects.filter(Q(requester=request.user) | Q(accepter=request.user), module__module_code__iexact=module_code)
-            status = Connection_Status(int(connection_status_filter)).name
-            connections = connections.filter(status__iexact=status)
-            users = connections.values_list('requester', flat=True).union(connections.values_list('accepter', flat=True))
-            enrolments = enrolments.filter(user__in=users)
-
-        queryset = User.objects.filter(id__in=enrolments.values_list('user', flat=True).distinct()).order_by('id')
+        user = request.user
+        try:
+            module = Module.objects.with_code(module_code).get()
+        except Module.DoesNotExist:
+            response = Response("Module not found.", status=status.HTTP_404_NOT_FOUND)
+            response['Access-Control-Allow-Origin'] = '*'
+            return response
+
+        connected_user_ids = Connection.objects.filter(Q(requester=user) | Q(accepter=user)).values_list('requester_id', 'accepter_id')
+        excluded_user_ids = {user.id}
+        for requester_id, accepter_id in connected_user_ids:
+            excluded_user_ids.update((requester_id, accepter_id))
+        candidate_ids = [
+            candidate_id for candidate_id in Enrolment.objects.filter(
+                module=module, status__in=[Enrolment.LOOKING, Enrolment.WILLING]).values_list('user_id', flat=True)
+            if candidate_id not in excluded_user_ids
+        ]
+        module_ids = Enrolment.objects.filter(user=user).values_list('module_id', flat=True)
+        ranking = co_enrolment_index.rank(module_ids, candidate_ids, exclude_module_id=module.id)
 
-        # all users who are in the module, with filters
-        if page_filter:
-            queryset = paginator.paginate_queryset(queryset, request)
-        serializer = SimpleUserSerializer(queryset, many=True, context={'user': request.user, 'module_code': module_code})
-        response = Response(serializer.data)
+        paginator = PageNumberPagination()
+        ranking = paginator.paginate_queryset(ranking, request)
+        users = User.objects.enrolled_in(module_code).with_connection_status(user).in_bulk([user_id for user_id, _ in ranking])
+        ranking = [(users[user_id], shared) for user_id, shared in ranking if user_id in users]
+
+        serializer = SimpleUserSerializer([candidate for candidate, _ in ranking], many=True, context={'user': user, 'module_code': module_code})
+        data = serializer.data
+        for candidate, (_, shared) in zip(data, ranking):
+            candidate['shared_modules'] = shared
+        response = Response(data)
         response['Access-Control-Allow-Origin'] = '*'
         return response
 
@@ -92,16 +189,9 @@ class ModuleUpdateView(APIView):
     permission_classes = [permissions.IsAdminUser]
 
     def post(self, request, academic_year):
-        url = 'https://www.api.nusmods.com/v2/' + academic_year + '/moduleList.json'
-        r = requests.get(url)
-        data = r.json()
-
-        for module in data:
-            new_module_code = module["moduleCode"]
-            new_title = module["title"]
-            new_module, created = Module.objects.get_or_create(title=new_title, module_code=new_module_code)
-            new_module.save()
-        response = Response(data)
+        data = fetch_module_list(academic_year)
+        report = import_modules(data, prune=request.query_params.get('prune') == 'true')
+        response = Response(report.as_dict())
         response['Access-Control-Allow-Origin'] = '*'
         return response
 
@@ -111,12 +201,8 @@ class ModuleManualUpdateView(APIView):
     def post(self, request, academic_year):
         data = request.data
         try:
-            for m in data:
-                module_code = m["moduleCode"]
-                title = m["title"]
-                new_module, created = Module.objects.get_or_create(title=title, module_code=module_code)
-                new_module.save()
-            response = Response(data)
+            report = import_modules(data, prune=request.query_params.get('prune') == 'true')
+            response = Response(report.as_dict())
         except Exception as e:
             print(e)
             response = Response("Invalid request", status=status.HTTP_400_BAD_REQUEST)
@@ -126,13 +212,13 @@ class ModuleManualUpdateView(APIView):
 class ModuleView(APIView):
 
     def get(self, request, module_code):
-        user = request.user
         try:
-            module = Module.objects.get(module_code__iexact=module_code)
-            serializer = ModuleSerializer(module, context={'user': user})
-            response = Response(serializer.data)
-        except:
+            response = catalog_response(request, lambda catalog_version: self.get_catalog(request, module_code))
+        except Module.DoesNotExist:
             response = Response("Module not found.", status=status.HTTP_404_NOT_FOUND)
-        
-        response['Access-Control-Allow-Origin'] = '*'
-        return response
\ No newline at end of file
+            response['Access-Control-Allow-Origin'] = '*'
+        return response
+
+    def get_catalog(self, request, module_code):
+        module = Module.objects.with_is_enrolled(request.user).with_code(module_code).get()
+        return ModuleSerializer(module, context={'user': request.user}).data, [module.id]
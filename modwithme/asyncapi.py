@@ -0,0 +1,112 @@
+"""Async counterparts of the DRF plumbing, for the async views served under /async/ by an ASGI server.
+
+DRF's APIView is sync only, so AsyncAPIView is a plain Django view that authenticates JWTs with the async ORM,
+maps DRF's API exceptions to responses and renders JSON the way DRF does. Views built on it must load everything
+they serialize up front (with select_related and annotations), as serializers run without database access.
+"""
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.db.models import QuerySet
+from django.http import HttpResponse
+from django.views import View
+from rest_framework import status
+from rest_framework.exceptions import APIException, AuthenticationFailed, NotAuthenticated, NotFound
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+
+from users.authentication import acache_user, aget_cached_user
+
+from .pagination import is_cursor_request
+
+jwt_authentication = JWTAuthentication()
+
+async def authenticate(request):
+    """Returns the user of the request's JWT, or AnonymousUser if there is none, like CachedJWTAuthentication.
+    Token validation is CPU only, so only the user lookup goes through the (async) ORM."""
+
+    header = jwt_authentication.get_header(request)
+    if header is None:
+        return AnonymousUser()
+    raw_token = jwt_authentication.get_raw_token(header)
+    if raw_token is None:
+        return AnonymousUser()
+
+    token = jwt_authentication.get_validated_token(raw_token)
+    try:
+        user_id = token[jwt_settings.USER_ID_CLAIM]
+    except KeyError:
+        raise InvalidToken('Token contained no recognizable user identification')
+
+    timeout = settings.AUTHENTICATED_USER_CACHE_TIMEOUT
+    user, generation = await aget_cached_user(user_id) if timeout else (None, None)
+    if user is not None:
+        return user
+
+    user = await get_user_model().objects.filter(**{jwt_settings.USER_ID_FIELD: user_id}).afirst()
+    if user is None:
+        raise AuthenticationFailed('User not found', code='user_not_found')
+    if not user.is_active:
+        raise AuthenticationFailed('User is inactive', code='user_inactive')
+    if timeout:
+        await acache_user(user, generation)
+    return user
+
+def api_response(data, status=status.HTTP_200_OK):
+    response = HttpResponse(JSONRenderer().render(data), content_type='application/json', status=status)
+    response['Access-Control-Allow-Origin'] = '*'
+    return response
+
+class AsyncAPIView(View):
+    permission_classes = []  # only IsAuthenticated is supported
+
+    async def dispatch(self, request, *args, **kwargs):
+        try:
+            request.user = await authenticate(request)
+            if self.permission_classes and not request.user.is_authenticated:
+                raise NotAuthenticated()
+            return await super().dispatch(request, *args, **kwargs)
+        except (InvalidToken, TokenError) as e:
+            return api_response({'detail': str(e)}, status=status.HTTP_401_UNAUTHORIZED)
+        except APIException as e:
+            return api_response({'detail': e.detail}, status=e.status_code)
+
+async def paginate(items, request):
+    """Returns the requested ?page= of a queryset or list, like PageNumberPagination."""
+
+    page_size = api_settings.PAGE_SIZE
+    try:
+        page = int(request.GET.get('page', 1))
+    except ValueError:
+        raise NotFound('Invalid page.')
+
+    count = await items.acount() if isinstance(items, QuerySet) else len(items)
+    if page < 1 or (page > 1 and (page - 1) * page_size >= count):
+        raise NotFound('Invalid page.')
+
+    items = items[(page - 1) * page_size:page * page_size]
+    if isinstance(items, QuerySet):
+        return [item async for item in items]
+    return items
+
+async def get_page(items, request, cursor_paginator):
+    """Returns the requested page of a queryset or list, with cursor_paginator (one of the cursor paginators in
+    modwithme.pagination) if the request has a cursor, or by ?page= otherwise. DRF paginators are sync only,
+    so cursor pages are fetched in a worker thread."""
+
+    if is_cursor_request(Request(request)):
+        return await sync_to_async(cursor_paginator.paginate_queryset)(items, Request(request))
+    return await paginate(items, request)
+
+def get_page_data(data, request, cursor_paginator):
+    """Returns the response data for a page returned by get_page()."""
+
+    if is_cursor_request(Request(request)):
+        return cursor_paginator.get_paginated_response(data).data
+    return data
@@ -0,0 +1,50 @@
+import logging
+import queue
+import threading
+
+from django.conf import settings
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+class BackgroundQueue:
+    """A queue of tasks that are run one at a time on a daemon worker thread, off the request path.
+
+    With BACKGROUND_TASKS_EAGER set, tasks are run immediately in the calling thread instead, e.g. for tests.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def enqueue(self, func, *args, **kwargs):
+        if settings.BACKGROUND_TASKS_EAGER:
+            func(*args, **kwargs)
+            return
+
+        self._ensure_worker()
+        self._queue.put((func, args, kwargs))
+
+    def join(self):
+        """Blocks until every queued task has been run."""
+
+        self._queue.join()
+
+    def _ensure_worker(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._work, name=f'background-{self.name}', daemon=True)
+                self._thread.start()
+
+    def _work(self):
+        while True:
+            func, args, kwargs = self._queue.get()
+            try:
+                func(*args, **kwargs)
+            except Exception:
+                logger.exception('Background task %s failed', getattr(func, '__name__', func))
+            finally:
+                close_old_connections()
+                self._queue.task_done()
@@ -0,0 +1,129 @@
+"""Helpers to seed synthetic data in bulk and time code, for the benchmark management commands."""
+
+import random
+import statistics
+import time
+
+from modules.models import Module
+from users.models import Connection, Enrolment, User, rebuild_enrolment_counts
+from users.search import normalize_name
+
+SUBJECTS = ['CS', 'MA', 'ST', 'EE', 'GEA', 'LSM', 'IS', 'BT', 'PC', 'CM', 'EC', 'HSA', 'GESS', 'DSA', 'PL']
+TITLE_WORDS = [
+    'Introduction', 'Programming', 'Methodology', 'Data', 'Structures', 'Algorithms', 'Calculus', 'Linear',
+    'Algebra', 'Statistics', 'Design', 'Systems', 'Networks', 'Chemistry', 'Biology', 'Economics', 'Society',
+    'Computing', 'Engineering', 'Advanced', 'Topics', 'Foundations', 'Analysis', 'Security', 'Learning',
+]
+FIRST_NAMES = ['Wei Jie', 'Hui Min', 'Aditya', 'Nur', 'Jun Hao', 'Priya', 'Marcus', 'Xin Yi', 'Ahmad', 'Chloe']
+LAST_NAMES = ['Tan', 'Lim', 'Lee', 'Ng', 'Wong', 'Kumar', 'Abdullah', 'Goh', 'Chua', 'Ong', 'Teo', 'Koh']
+MAJORS = ['Computer Science', 'Mathematics', 'Economics', 'Business', 'Engineering', 'Life Sciences']
+BATCH_SIZE = 5000
+
+def seed(modules, users, enrolments, connections, stdout=None, seed=0):
+    """Bulk inserts synthetic modules, users, enrolments and connections into the current database.
+
+    Module popularity is skewed, so that a few modules have rosters of thousands of students.
+    Returns the timings of each step, in seconds.
+    """
+
+    rng = random.Random(seed)
+    timings = {}
+
+    def log(message):
+        if stdout is not None:
+            stdout.write(message)
+
+    start = time.perf_counter()
+    Module.objects.bulk_create([
+        Module(
+            module_code=f'{SUBJECTS[i % len(SUBJECTS)]}{1000 + i // len(SUBJECTS)}',
+            title=' '.join(rng.sample(TITLE_WORDS, rng.randint(2, 5))),
+        )
+        for i in range(modules)
+    ], batch_size=BATCH_SIZE)
+    timings['modules'] = time.perf_counter() - start
+    log(f'Seeded {modules} modules in {timings["modules"]:.1f}s')
+
+    start = time.perf_counter()
+    def make_user(i):
+        name = f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}'
+        return User(
+            nus_email=f'e{i:07d}@u.nus.edu',
+            password='!',
+            name=name,
+            # bulk_create() doesn't call save(), which sets it
+            search_name=normalize_name(name),
+            is_verified=True,
+            year=rng.randint(1, 5),
+            major=rng.choice(MAJORS),
+        )
+
+    for offset in range(0, users, BATCH_SIZE):
+        User.objects.bulk_create([make_user(i) for i in range(offset, min(offset + BATCH_SIZE, users))])
+    timings['users'] = time.perf_counter() - start
+    log(f'Seeded {users} users in {timings["users"]:.1f}s')
+
+    module_ids = list(Module.objects.order_by('id').values_list('id', flat=True))
+    user_ids = list(User.objects.order_by('id').values_list('id', flat=True))
+    popularity = [1 / (rank + 1) ** 0.8 for rank in range(len(module_ids))]
+
+    start = time.perf_counter()
+    per_user = max(1, enrolments // max(1, len(user_ids)))
+    enrolled = {}
+    batch = []
+    for user_id in user_ids:
+        user_module_ids = set(rng.choices(module_ids, weights=popularity, k=per_user * 2))
+        enrolled[user_id] = list(user_module_ids)[:per_user]
+        for module_id in enrolled[user_id]:
+            status = rng.choices([Enrolment.LOOKING, Enrolment.WILLING, Enrolment.NOT_LOOKING], weights=[5, 3, 2])[0]
+            batch.append(Enrolment(user_id=user_id, module_id=module_id, status=status))
+        if len(batch) >= BATCH_SIZE:
+            Enrolment.objects.bulk_create(batch)
+            batch = []
+    Enrolment.objects.bulk_create(batch)
+    # bulk_create() leaves the modules' enrolment counters behind
+    rebuild_enrolment_counts()
+    timings['enrolments'] = time.perf_counter() - start
+    log(f'Seeded {Enrolment.objects.count()} enrolments in {timings["enrolments"]:.1f}s')
+
+    start = time.perf_counter()
+    pairs = set()
+    batch = []
+    while len(pairs) < min(connections, len(user_ids) * (len(user_ids) - 1) // 2):
+        requester_id, accepter_id = rng.sample(user_ids, 2)
+        pair = (min(requester_id, accepter_id), max(requester_id, accepter_id))
+        if pair in pairs:
+            continue
+        pairs.add(pair)
+        status = rng.choices([Connection.ACCEPTED, Connection.PENDING], weights=[2, 1])[0]
+        batch.append(Connection(requester_id=requester_id, accepter_id=accepter_id, module_id=rng.choice(enrolled[requester_id]), status=status))
+        if len(batch) >= BATCH_SIZE:
+            Connection.objects.bulk_create(batch)
+            batch = []
+    Connection.objects.bulk_create(batch)
+    timings['connections'] = time.perf_counter() - start
+    log(f'Seeded {len(pairs)} connections in {timings["connections"]:.1f}s')
+
+    return timings
+
+def time_calls(func, repeat):
+    """Returns the durations of repeat calls to func, in milliseconds."""
+
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        durations.append((time.perf_counter() - start) * 1000)
+    return durations
+
+def percentile(values, percent):
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method='inclusive')[percent - 1]
+
+def summarize(durations):
+    return {
+        'p50_ms': round(percentile(durations, 50), 3),
+        'p95_ms': round(percentile(durations, 95), 3),
+        'mean_ms': round(statistics.fmean(durations), 3),
+    }
@@ -0,0 +1,131 @@
+"""Publish/subscribe of events between the code that changes data and clients waiting for it to change.
+
+Events carry no data. They only wake listeners, which then read what changed from the database, so a missed or
+duplicate event costs at most one extra read. Listeners are futures on the event loop of an ASGI worker, so
+waiting clients hold no thread or database connection.
+
+The backend is chosen with EVENT_BROKER_BACKEND. LocalEventBroker only reaches listeners in the same process.
+RedisEventBroker relays events through Redis pub/sub, so that they reach listeners in every worker.
+"""
+
+import asyncio
+import logging
+import threading
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+class Listener:
+    """Receives the events published to a channel from when it is created until it is closed."""
+
+    def __init__(self, broker, channel):
+        self.broker = broker
+        self.channel = channel
+        self.loop = asyncio.get_running_loop()
+        self.event = asyncio.Event()
+
+    async def wait(self, timeout):
+        """Waits up to timeout seconds for an event. Returns whether there was one."""
+
+        try:
+            await asyncio.wait_for(self.event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        return self.event.is_set()
+
+    def notify(self):
+        self.loop.call_soon_threadsafe(self.event.set)
+
+    def close(self):
+        self.broker.remove(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class LocalEventBroker:
+    """Delivers events to the listeners in this process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._listeners = {}
+
+    def listen(self, channel):
+        """Returns a Listener for channel. Must be called from a coroutine, on the loop that will wait for it."""
+
+        listener = Listener(self, channel)
+        with self._lock:
+            self._listeners.setdefault(channel, set()).add(listener)
+        return listener
+
+    def remove(self, listener):
+        with self._lock:
+            listeners = self._listeners.get(listener.channel)
+            if listeners is not None:
+                listeners.discard(listener)
+                if not listeners:
+                    del self._listeners[listener.channel]
+
+    def publish(self, channel):
+        self.deliver(channel)
+
+    def deliver(self, channel):
+        with self._lock:
+            listeners = list(self._listeners.get(channel, ()))
+        for listener in listeners:
+            try:
+                listener.notify()
+            except RuntimeError:
+                # Its event loop has closed
+                self.remove(listener)
+
+class RedisEventBroker(LocalEventBroker):
+    """Relays events through Redis pub/sub, so that they reach the listeners in every process using REDIS_URL.
+    Each process subscribes with one connection, on a daemon thread started by its first listener."""
+
+    PREFIX = 'events:'
+
+    def __init__(self):
+        super().__init__()
+        import redis
+
+        self._redis = redis.Redis.from_url(settings.REDIS_URL)
+        self._thread = None
+
+    def listen(self, channel):
+        self._ensure_subscriber()
+        return super().listen(channel)
+
+    def publish(self, channel):
+        try:
+            self._redis.publish(f'{self.PREFIX}{channel}', '')
+        except Exception:
+            logger.exception('Publishing event on %s failed', channel)
+
+    def _ensure_subscriber(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._subscribe, name='event-subscriber', daemon=True)
+                self._thread.start()
+
+    def _subscribe(self):
+        pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+        pubsub.psubscribe(f'{self.PREFIX}*')
+        for message in pubsub.listen():
+            channel = message['channel'].decode()[len(self.PREFIX):]
+            self.deliver(channel)
+
+event_broker = import_string(settings.EVENT_BROKER_BACKEND)()
+
+def publish_on_commit(*channels):
+    """Publishes an event on each channel once the current transaction commits, so that listeners read the change."""
+
+    def publish():
+        for channel in channels:
+            event_broker.publish(channel)
+    transaction.on_commit(publish)
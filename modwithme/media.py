@@ -0,0 +1,130 @@
+"""Serves uploaded media with validators, byte ranges and long-lived cache headers.
+
+Uploads are stored under names with a random token (see versioned_upload_name), so a name never refers to
+different content and can be cached as immutable. With MEDIA_SENDFILE_HEADER set, the file itself is sent by the
+web server in front of Django (Apache/lighttpd X-Sendfile, or nginx X-Accel-Redirect), which also handles ranges.
+Otherwise it is streamed with FileResponse, which WSGI servers like gunicorn send with sendfile().
+"""
+
+import mimetypes
+import os
+import re
+import secrets
+from urllib.parse import quote
+
+from django.conf import settings
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_etags
+from django.views.decorators.http import require_safe
+
+VERSIONED_NAME = re.compile(r'-[0-9a-f]{16}(_thumb)?\.\w+$')
+RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+CHUNK_SIZE = 64 * 1024
+
+def versioned_upload_name(filename):
+    """Returns filename with a random token added to its stem, e.g. me-1a2b3c4d5e6f7a8b.png."""
+
+    stem, extension = os.path.splitext(os.path.basename(filename))
+    return f'{stem}-{secrets.token_hex(8)}{extension}'
+
+def cache_control(path):
+    if VERSIONED_NAME.search(path):
+        return f'public, max-age={settings.MEDIA_CACHE_MAX_AGE}, immutable'
+    # Files uploaded before names were versioned may be replaced under the same name.
+    return 'public, max-age=0, must-revalidate'
+
+@require_safe
+def serve_media(request, path):
+    try:
+        fullpath = safe_join(settings.MEDIA_ROOT, path)
+        stat = os.stat(fullpath)
+    except OSError:
+        raise Http404('File not found')
+    if not os.path.isfile(fullpath):
+        raise Http404('File not found')
+
+    etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+    headers = {
+        'ETag': etag,
+        'Last-Modified': http_date(stat.st_mtime),
+        'Cache-Control': cache_control(path),
+        'Accept-Ranges': 'bytes',
+        'Access-Control-Allow-Origin': '*',
+    }
+
+    response = get_conditional_response(request, etag=etag, last_modified=int(stat.st_mtime))
+    if response is None:
+        content_type, encoding = mimetypes.guess_type(fullpath)
+        content_type = content_type or 'application/octet-stream'
+        if settings.MEDIA_SENDFILE_HEADER:
+            response = sendfile_response(fullpath, path, content_type)
+        else:
+            response = file_response(request, fullpath, stat.st_size, etag, content_type)
+        if encoding:
+            response['Content-Encoding'] = encoding
+
+    for header, value in headers.items():
+        response[header] = value
+    return response
+
+def sendfile_response(fullpath, path, content_type):
+    response = HttpResponse(content_type=content_type)
+    if settings.MEDIA_SENDFILE_HEADER == 'X-Accel-Redirect':
+        # A URI, which nginx decodes, so that names with spaces, '?', '%' or non-ASCII characters resolve to their file.
+        response['X-Accel-Redirect'] = settings.MEDIA_ACCEL_REDIRECT_LOCATION.rstrip('/') + '/' + quote(path.lstrip('/'))
+    else:
+        response[settings.MEDIA_SENDFILE_HEADER] = fullpath
+    return response
+
+def file_response(request, fullpath, size, etag, content_type):
+    byte_range = parse_range(request, size, etag)
+    if byte_range is None:
+        response = FileResponse(open(fullpath, 'rb'), content_type=content_type)
+        response['Content-Length'] = size
+        return response
+    if byte_range is False:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+
+    start, end = byte_range
+    response = StreamingHttpResponse(read_range(fullpath, start, end), status=206, content_type=content_type)
+    response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    response['Content-Length'] = end - start + 1
+    return response
+
+def parse_range(request, size, etag):
+    """Returns the (first, last) byte of a single byte Range request, None to send the whole file,
+    or False if the range can't be satisfied. Multiple ranges aren't supported, and get the whole file."""
+
+    match = RANGE.match(request.headers.get('Range', '').strip())
+    if match is None:
+        return None
+    if_range = request.headers.get('If-Range')
+    if if_range and etag not in parse_etags(if_range):
+        return None
+
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # The last n bytes
+        start, end = max(0, size - int(last)), size - 1
+    else:
+        start, end = int(first), min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        return False
+    return start, end
+
+def read_range(fullpath, start, end):
+    with open(fullpath, 'rb') as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = f.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
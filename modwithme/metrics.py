@@ -0,0 +1,189 @@
+"""Opt-in, in-memory request metrics per URL name.
+
+With REQUEST_METRICS_ENABLED, RequestMetricsMiddleware records the SQL query count, DB time, view time,
+serializer time and response size of every request into histograms, adds a Server-Timing header to the
+response, and MetricsView serves the histograms to admins. Otherwise the middleware removes itself.
+"""
+
+import bisect
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+from rest_framework import permissions
+from rest_framework.response import Response
+from rest_framework.serializers import BaseSerializer
+from rest_framework.views import APIView
+
+DURATION_BUCKETS_MS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, math.inf)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200, math.inf)
+SIZE_BUCKETS_BYTES = (256, 1024, 4096, 16384, 65536, 262144, 1048576, math.inf)
+
+METRICS = {
+    'queries': QUERY_BUCKETS,
+    'db_ms': DURATION_BUCKETS_MS,
+    'view_ms': DURATION_BUCKETS_MS,
+    'serializer_ms': DURATION_BUCKETS_MS,
+    'total_ms': DURATION_BUCKETS_MS,
+    'response_bytes': SIZE_BUCKETS_BYTES,
+}
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0
+        self.max = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def as_dict(self):
+        return {
+            'count': self.count,
+            'mean': round(self.sum / self.count, 3) if self.count else 0,
+            'max': round(self.max, 3),
+            'buckets': {('+Inf' if bound == math.inf else str(bound)): count for bound, count in zip(self.buckets, self.counts)},
+        }
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}  # url name -> metric name -> histogram
+
+    def observe(self, url_name, values):
+        with self._lock:
+            histograms = self._histograms.get(url_name)
+            if histograms is None:
+                histograms = self._histograms[url_name] = {metric: Histogram(buckets) for metric, buckets in METRICS.items()}
+            for metric, value in values.items():
+                histograms[metric].observe(value)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                url_name: {metric: histogram.as_dict() for metric, histogram in histograms.items()}
+                for url_name, histograms in self._histograms.items()
+            }
+
+    def reset(self):
+        with self._lock:
+            self._histograms = {}
+
+registry = MetricsRegistry()
+
+class RequestTimings:
+    def __init__(self):
+        self.queries = 0
+        self.db = 0
+        self.serializer = 0
+        self.serializing = False
+
+    def record_query(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db += time.perf_counter() - start
+            self.queries += 1
+
+_local = threading.local()
+
+def instrument_serializers():
+    """Times the outermost serializer .data access of each request, which includes any queries it triggers."""
+
+    if getattr(BaseSerializer.data.fget, 'instrumented', False):
+        return
+
+    get_data = BaseSerializer.data.fget
+
+    def data(self):
+        timings = getattr(_local, 'timings', None)
+        if timings is None or timings.serializing:
+            return get_data(self)
+
+        timings.serializing = True
+        start = time.perf_counter()
+        try:
+            return get_data(self)
+        finally:
+            timings.serializer += time.perf_counter() - start
+            timings.serializing = False
+
+    data.instrumented = True
+    BaseSerializer.data = property(data)
+
+class RequestMetricsMiddleware:
+    """Sync only, as timings are kept in a thread local. While it is enabled, Django adapts the /async/ views to
+    run synchronously behind it, so they lose their async benefits and their metrics include the adapter."""
+
+    sync_capable = True
+    async_capable = False
+
+    def __init__(self, get_response):
+        if not settings.REQUEST_METRICS_ENABLED:
+            raise MiddlewareNotUsed()
+
+        self.get_response = get_response
+        instrument_serializers()
+
+    def __call__(self, request):
+        timings = _local.timings = RequestTimings()
+        start = time.perf_counter()
+        try:
+            with connection.execute_wrapper(timings.record_query):
+                response = self.get_response(request)
+        finally:
+            _local.timings = None
+        total = time.perf_counter() - start
+
+        view = getattr(request, '_metrics_view_start', None)
+        view = total - (view - start) if view is not None else 0
+        if response.streaming:
+            response_bytes = int(response.get('Content-Length', 0))
+        else:
+            response_bytes = len(response.content)
+
+        match = request.resolver_match
+        registry.observe(match.url_name if match and match.url_name else '<unresolved>', {
+            'queries': timings.queries,
+            'db_ms': timings.db * 1000,
+            'view_ms': view * 1000,
+            'serializer_ms': timings.serializer * 1000,
+            'total_ms': total * 1000,
+            'response_bytes': response_bytes,
+        })
+
+        response['Server-Timing'] = ', '.join([
+            f'db;dur={timings.db * 1000:.1f};desc="{timings.queries} queries"',
+            f'view;dur={view * 1000:.1f}',
+            f'serializer;dur={timings.serializer * 1000:.1f}',
+            f'total;dur={total * 1000:.1f}',
+        ])
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request._metrics_view_start = time.perf_counter()
+
+class MetricsView(APIView):
+    """Returns the request metrics histograms per URL name. DELETE resets them."""
+
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        response = Response({'enabled': settings.REQUEST_METRICS_ENABLED, 'endpoints': registry.snapshot()})
+        response['Access-Control-Allow-Origin'] = '*'
+        return response
+
+    def delete(self, request):
+        registry.reset()
+        response = Response()
+        response['Access-Control-Allow-Origin'] = '*'
+        return response
@@ -0,0 +1,132 @@
+import json
+from base64 import b64decode, b64encode
+
+from django.db import connections
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound, ParseError
+from rest_framework.pagination import BasePagination, CursorPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+def is_cursor_request(request):
+    """Clients opt in to cursor pagination by passing a cursor, which is empty for the first page.
+    Requests without one keep the ?page= pagination that old clients rely on."""
+
+    return 'cursor' in request.query_params
+
+def encode_sync_token(timestamp):
+    return b64encode(timestamp.isoformat().encode('ascii')).decode('ascii')
+
+def decode_sync_token(value):
+    """Parses a ?since= value, which is either a sync token returned earlier or an ISO 8601 timestamp."""
+
+    try:
+        timestamp = parse_datetime(value) or parse_datetime(b64decode(value.encode('ascii'), validate=True).decode('ascii'))
+    except ValueError:
+        timestamp = None
+    if timestamp is None:
+        raise ParseError('Invalid since')
+    if timezone.is_naive(timestamp):
+        timestamp = timezone.make_aware(timestamp, timezone.utc)
+    return timestamp
+
+def estimate_count(queryset):
+    """Returns the planner's row estimate for queryset on PostgreSQL, or the exact count elsewhere."""
+
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return queryset.count()
+
+    sql, params = queryset.values('pk').query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan[0]['Plan']['Plan Rows']
+
+class CountMixin:
+    """Adds a count to paginated responses when asked for, with ?count=exact or the cheaper ?count=estimate.
+    The next and previous links leave the count out, so that it is only paid for once."""
+
+    count_query_param = 'count'
+
+    def get_count(self, queryset, request):
+        count = request.query_params.get(self.count_query_param)
+        if isinstance(queryset, list):
+            return len(queryset) if count in ('exact', 'estimate') else None
+        if count == 'exact':
+            return queryset.count()
+        if count == 'estimate':
+            return estimate_count(queryset)
+        return None
+
+    def get_paginated_response(self, data):
+        response = {'next': self.get_next_link(), 'previous': self.get_previous_link()}
+        if self.count is not None:
+            response['count'] = self.count
+        response['results'] = data
+        return Response(response)
+
+class KeysetPagination(CountMixin, CursorPagination):
+    """Cursor pagination that seeks on a unique ordering, so every page is fetched in constant time."""
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.count = self.get_count(queryset, request)
+        page = super().paginate_queryset(queryset, request, view)
+        self.base_url = remove_query_param(self.base_url, self.count_query_param)
+        return page
+
+class ModuleCursorPagination(KeysetPagination):
+    # module_code is unique, with the module_code_id_idx index to seek on.
+    ordering = ('module_code', 'id')
+
+class UserCursorPagination(KeysetPagination):
+    ordering = ('id',)
+
+class ConnectionCursorPagination(KeysetPagination):
+    # Ids increase with creation_time, which old clients get connections ordered by.
+    ordering = ('id',)
+
+class ListCursorPagination(CountMixin, BasePagination):
+    """Opaque cursors over an in-memory list, e.g. of ranked search results, where slicing is already cheap."""
+
+    cursor_query_param = 'cursor'
+    page_size = api_settings.PAGE_SIZE
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.base_url = remove_query_param(request.build_absolute_uri(), self.count_query_param)
+        self.count = self.get_count(queryset, request)
+        self.offset = self.decode_cursor(request)
+        self.has_next = self.offset + self.page_size < len(queryset)
+        return list(queryset[self.offset:self.offset + self.page_size])
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param, '')
+        if not encoded:
+            return 0
+        try:
+            offset = int(b64decode(encoded.encode('ascii')).decode('ascii'))
+        except (TypeError, ValueError):
+            raise NotFound('Invalid cursor')
+        if offset < 0:
+            raise NotFound('Invalid cursor')
+        return offset
+
+    def encode_cursor(self, offset):
+        return replace_query_param(self.base_url, self.cursor_query_param, b64encode(str(offset).encode('ascii')).decode('ascii'))
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        return self.encode_cursor(self.offset + self.page_size)
+
+    def get_previous_link(self):
+        if self.offset <= 0:
+            return None
+        previous_offset = max(0, self.offset - self.page_size)
+        if previous_offset == 0:
+            return replace_query_param(self.base_url, self.cursor_query_param, '')
+        return self.encode_cursor(previous_offset)
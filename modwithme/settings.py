@@ -33,6 +33,9 @@ DEBUG = os.getenv("DEBUG", "False") == "True"
 
 DEVELOPMENT_MODE = os.getenv("DEVELOPMENT_MODE", "False") == "True"
 
+# Per-endpoint SQL and timing metrics, see modwithme/metrics.py
+REQUEST_METRICS_ENABLED = os.getenv("REQUEST_METRICS_ENABLED", "False") == "True"
+
 ALLOWED_HOSTS = [
     '127.0.0.1',
     'localhost',
@@ -58,6 +61,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'modwithme.metrics.RequestMetricsMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -109,6 +113,32 @@ elif len(sys.argv) > 0 and sys.argv[1] != 'collectstatic':
     }
 
 
+# Cache
+# A shared cache lets workers invalidate each other's cached data. Without one, each worker gets its own
+# in-memory cache, and data that needs cross-worker invalidation is only cached within a request.
+
+REDIS_URL = os.getenv("REDIS_URL")
+
+if REDIS_URL:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        }
+    }
+
+SHARED_CACHE = REDIS_URL is not None
+
+# Events, for clients waiting on changes. Without Redis, events only reach clients of the worker that made the change
+EVENT_BROKER_BACKEND = 'modwithme.events.RedisEventBroker' if REDIS_URL else 'modwithme.events.LocalEventBroker'
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
 
@@ -164,7 +194,7 @@ SIMPLE_JWT = {
 # REST Framework
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'users.authentication.CachedJWTAuthentication',
         # 'rest_framework.authentication.SessionAuthentication', # For debugging in development
     ],
     'PAGE_SIZE': 20
@@ -180,18 +210,69 @@ EMAIL_HOST_USER = 'apikey'
 EMAIL_HOST_PASSWORD = SENDGRID_API_KEY
 EMAIL_PORT = 587
 EMAIL_USE_TLS = True
+EMAIL_TIMEOUT = 10
+
+# Authentication, in seconds that the user of a JWT is cached for. Changes to a user are only dropped from
+# other workers' caches through a shared cache, so without one users are only cached briefly, per process.
+AUTHENTICATED_USER_CACHE_TIMEOUT = 300 if SHARED_CACHE else 30
+
+# Email outbox, in seconds before the first retry of a failed email, doubled after each further failure
+EMAIL_OUTBOX_RETRY_DELAY = 30
+EMAIL_OUTBOX_MAX_ATTEMPTS = 6
+# Email outbox, in seconds that a worker has to send an email before another worker may retry it
+EMAIL_OUTBOX_LEASE = 120
+
+# Profile cards, in seconds that the viewer-independent parts of serialized users are cached for. Cards are
+# keyed by the version of the user they were serialized from, so they can't go stale, even per worker.
+PROFILE_CARD_CACHE_TIMEOUT = 3600
+
+# Connections, in seconds that a user's connection statuses are cached for
+CONNECTION_STATUS_CACHE_TIMEOUT = 300 if SHARED_CACHE else 0
+
+# Connections, the most users that can be sent requests in one call to user/connections/bulk
+BULK_CONNECTION_MAX_USERS = 50
+
+# Enrolments, the most modules that can be added and removed in one call to user/modules/enroll/batch
+BATCH_ENROLMENT_MAX_MODULES = 50
+
+# Connections, in seconds that deleted connections are remembered for clients syncing with ?since=
+CONNECTION_TOMBSTONE_MAX_AGE = 30 * 24 * 60 * 60
+
+# Connections, the most seconds that async/user/connections/events waits for a change before responding
+CONNECTION_EVENTS_TIMEOUT = 25
 
 # OTP
 OTP_EXPIRATION_DURATION = 300
 OTP_RESEND_DURATION = 60
+# Where codes are kept, 'cache' or 'database'. Codes must be visible to every worker, so the cache must be shared
+OTP_STORE = 'cache' if SHARED_CACHE else 'database'
 
 # Media, for user uploaded files
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media/')
+# In seconds that clients and CDNs may cache media under versioned names for
+MEDIA_CACHE_MAX_AGE = 365 * 24 * 60 * 60
+# Set to 'X-Sendfile' (Apache, lighttpd) or 'X-Accel-Redirect' (nginx) to have the web server send media files.
+# For nginx, MEDIA_ACCEL_REDIRECT_LOCATION must be an internal location aliased to MEDIA_ROOT
+MEDIA_SENDFILE_HEADER = os.getenv('MEDIA_SENDFILE_HEADER', '')
+MEDIA_ACCEL_REDIRECT_LOCATION = os.getenv('MEDIA_ACCEL_REDIRECT_LOCATION', '/protected-media/')
 
 # Thumbnails
 THUMBNAIL_SIZE = (100, 100)
 
+# Background tasks, run in the calling thread instead of a worker thread if eager
+BACKGROUND_TASKS_EAGER = False
+
+# Module search, in seconds before a worker rebuilds its in-memory index
+MODULE_SEARCH_INDEX_MAX_AGE = 3600
+
+# Module catalog, in seconds that catalog responses are cached for. Imports bump the catalog version
+# to invalidate them, which only reaches every worker through a shared cache.
+CATALOG_CACHE_TIMEOUT = 3600 if SHARED_CACHE else 0
+
+# Study partner recommendations, in seconds before a worker rebuilds its in-memory co-enrolment matrix
+RECOMMENDATION_INDEX_MAX_AGE = 3600
+
 CORS_ORIGIN_ALLOW_ALL = True
 CORS_ALLOW_ALL_ORIGINS = True
 CORS_ALLOW_CREDENTIALS = True
\ No newline at end of file
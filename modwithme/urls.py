@@ -13,20 +13,24 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
-from django.conf import settings
 from django.contrib import admin
 from django.urls import include, path, re_path
-from django.views.static import serve
+
+from modules.urls import async_urlpatterns as modules_async_urlpatterns
+from modwithme.media import serve_media
+from modwithme.metrics import MetricsView
+from users.urls import async_urlpatterns as users_async_urlpatterns
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+    re_path(r'^metrics/?$', MetricsView.as_view(), name='metrics'),
     path('', include('users.urls')),
     path('', include('modules.urls')),
     path('', include('rest_framework.urls')),
+    # Async versions of the hot read endpoints, for ASGI servers
+    path('async/', include(users_async_urlpatterns + modules_async_urlpatterns)),
 ] 
 
 urlpatterns += [
-    re_path(r'^media/(?P<path>.*)$', serve, {
-        'document_root': settings.MEDIA_ROOT,
-    }),
+    re_path(r'^media/(?P<path>.*)$', serve_media, name='media'),
 ]
\ No newline at end of file
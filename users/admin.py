@@ -1,11 +1,17 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as DjangoUserAdmin
 
-from .models import User, Enrolment, Connection
+from .models import User, Enrolment, Connection, OutboxEmail
 
 admin.site.register(Enrolment)
 admin.site.register(Connection)
 
+@admin.register(OutboxEmail)
+class OutboxEmailAdmin(admin.ModelAdmin):
+    list_display = ('to', 'subject', 'status', 'attempts', 'creation_time', 'sent_at')
+    list_filter = ('status',)
+    search_fields = ('to',)
+
 @admin.register(User)
 class UserAdmin(DjangoUserAdmin):
     """Custom UserAdmin for User model that uses nus_email instead of username."""
@@ -0,0 +1,95 @@
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import router
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+from .models import User
+
+# Every column of the user but their password, whose hash is never cached.
+CACHED_USER_FIELDS = [field.attname for field in User._meta.concrete_fields if field.attname != 'password']
+
+def authenticated_user_cache_key(user_id):
+    return f'authenticated-user:{user_id}'
+
+def authenticated_user_generation_key(user_id):
+    return f'authenticated-user-generation:{user_id}'
+
+def forget_authenticated_user(user_id):
+    """Drops a cached user, so that the next request authenticated as them reloads them.
+
+    Each cached user is stored with the generation of the user it was loaded in, and is only used while that is
+    still the user's generation. Starting a new one also stops requests that loaded the user before the change
+    from caching what they loaded.
+    """
+
+    cache.set(authenticated_user_generation_key(user_id), uuid.uuid4().hex, settings.AUTHENTICATED_USER_CACHE_TIMEOUT)
+    cache.delete(authenticated_user_cache_key(user_id))
+
+def get_cached_user(user_id):
+    """Returns the cached user with user_id, or None, and the generation to cache them with if they're loaded."""
+
+    keys = [authenticated_user_cache_key(user_id), authenticated_user_generation_key(user_id)]
+    cached = cache.get_many(keys)
+    return cached_user(cached.get(keys[0]), cached.get(keys[1]))
+
+async def aget_cached_user(user_id):
+    keys = [authenticated_user_cache_key(user_id), authenticated_user_generation_key(user_id)]
+    cached = await cache.aget_many(keys)
+    return cached_user(cached.get(keys[0]), cached.get(keys[1]))
+
+def cached_user(entry, generation):
+    """Returns the user rebuilt from a cache entry of the given generation, with their password deferred."""
+
+    if entry is not None and entry[0] == generation:
+        return User.from_db(router.db_for_read(User), CACHED_USER_FIELDS, entry[1]), generation
+    return None, generation
+
+def user_cache_entry(user, generation):
+    values = tuple(User._meta.get_field(field).get_prep_value(getattr(user, field)) for field in CACHED_USER_FIELDS)
+    return generation, values
+
+def cache_user(user, generation):
+    cache.set(authenticated_user_cache_key(user.id), user_cache_entry(user, generation), settings.AUTHENTICATED_USER_CACHE_TIMEOUT)
+
+async def acache_user(user, generation):
+    await cache.aset(authenticated_user_cache_key(user.id), user_cache_entry(user, generation), settings.AUTHENTICATED_USER_CACHE_TIMEOUT)
+
+def load_request_user(request):
+    """Returns request.user freshly loaded from the database.
+
+    request.user may be a cached copy from before the user's last change, which is fine for reading but would
+    write old values back over newer ones if saved. Views that save the user must save this instead.
+    """
+
+    return User.objects.get(id=request.user.id)
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """JWTAuthentication that caches the user of each token for AUTHENTICATED_USER_CACHE_TIMEOUT seconds,
+    saving a query on most authenticated requests.
+
+    Saving or deleting a user drops them from the cache (see signals.py), so that profile changes, new passwords
+    and deactivations apply to their next request. Without a shared cache, that only reaches this worker's cache,
+    so other workers may authenticate with an old copy for a while. Only the user's columns are cached, without
+    their password. The cached user is only for authenticating and reading: views that save the user load them
+    with load_request_user().
+    """
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken('Token contained no recognizable user identification')
+
+        timeout = settings.AUTHENTICATED_USER_CACHE_TIMEOUT
+        # The generation is read before the user is loaded, so that a change in between stops them being cached.
+        user, generation = get_cached_user(user_id) if timeout else (None, None)
+        if user is None:
+            # Raises AuthenticationFailed for unknown and inactive users, which are never cached.
+            user = super().get_user(validated_token)
+            if timeout:
+                cache_user(user, generation)
+        return user
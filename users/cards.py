@@ -0,0 +1,55 @@
+"""Cache of the parts of serialized users that are the same for every viewer, called profile cards.
+
+Each user serializer keeps its own cards, under its card_name, holding every field but its viewer_fields. Those,
+such as connection_status, are merged in for each viewer, so a user on many rosters and inboxes is only fully
+serialized when their cards aren't cached.
+
+Cards are keyed by User.card_version, which every save of the user changes, and which is loaded along with the rest
+of the user. A card is therefore only ever read for the row it was serialized from, whichever request cached it and
+however old the row it loaded, so cards are never dropped and need no shared cache. Old cards just expire after
+PROFILE_CARD_CACHE_TIMEOUT seconds.
+"""
+
+from django.conf import settings
+from django.core.cache import cache
+
+# Bumped whenever the fields of a card change, so that cards of the previous shape are never read.
+CARD_VERSION = 1
+
+def profile_card_key(card_name, user):
+    return f'profile-card:{CARD_VERSION}:{card_name}:{user.id}:{user.card_version.hex}'
+
+def get_profile_cards(serializer, users):
+    """Returns serializer's cards of users by id, serializing and caching those that aren't cached."""
+
+    timeout = settings.PROFILE_CARD_CACHE_TIMEOUT
+    keys = {user.id: profile_card_key(serializer.card_name, user) for user in users}
+    cached = cache.get_many(list(keys.values())) if timeout else {}
+    cards, missing = fill_profile_cards(serializer, users, keys, cached)
+    if timeout and missing:
+        cache.set_many(missing, timeout)
+    return cards
+
+async def aget_profile_cards(serializer, users):
+    """get_profile_cards() for async views, which pass the cards to serializers in their context as profile_cards,
+    so that serializing doesn't block the event loop on the cache."""
+
+    timeout = settings.PROFILE_CARD_CACHE_TIMEOUT
+    keys = {user.id: profile_card_key(serializer.card_name, user) for user in users}
+    cached = await cache.aget_many(list(keys.values())) if timeout else {}
+    cards, missing = fill_profile_cards(serializer, users, keys, cached)
+    if timeout and missing:
+        await cache.aset_many(missing, timeout)
+    return cards
+
+def fill_profile_cards(serializer, users, keys, cached):
+    """Returns the cards of users by id, and the cards serialized as they weren't cached, by key."""
+
+    cards = {}
+    missing = {}
+    for user in users:
+        card = cached.get(keys[user.id])
+        if card is None:
+            card = missing[keys[user.id]] = serializer.to_card(user)
+        cards[user.id] = card
+    return cards, missing
@@ -0,0 +1,96 @@
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count, Q
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from modules.models import Module
+from modwithme.benchmark import seed, summarize
+from users.models import Connection, User
+
+# Full scale dataset for --seed, multiplied by its value.
+DATASET = {
+    'modules': 10_000,
+    'users': 100_000,
+    'enrolments': 1_000_000,
+    'connections': 200_000,
+}
+
+class Command(BaseCommand):
+    help = ('Compares the concurrent throughput of the hot read endpoints on a WSGI deployment (e.g. gunicorn sync '
+            'workers) with their /async/ versions on an ASGI deployment (e.g. gunicorn -k uvicorn.workers.UvicornWorker) '
+            'of the same database, at increasing numbers of concurrent clients.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--wsgi', required=True, help='Base URL of the WSGI deployment, e.g. http://localhost:8000')
+        parser.add_argument('--asgi', required=True, help='Base URL of the ASGI deployment, e.g. http://localhost:8001')
+        parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32], help='Numbers of concurrent clients.')
+        parser.add_argument('--requests', type=int, default=200, help='Number of requests per endpoint and concurrency.')
+        parser.add_argument('--seed', type=float, help='Seed this fraction of the full synthetic dataset first. The database must be empty.')
+        parser.add_argument('--output', default='benchmark_concurrency.json', help='Path to write the results to, as JSON.')
+
+    def handle(self, *args, **options):
+        if options['seed']:
+            if Module.objects.exists() or User.objects.exists():
+                raise CommandError('--seed needs an empty database.')
+            seed(**{name: int(count * options['seed']) for name, count in DATASET.items()}, stdout=self.stdout)
+
+        module = Module.objects.annotate(enrolments=Count('enrolment')).order_by('-enrolments').first()
+        user = User.objects.annotate(connections=Count('incoming_connections')).order_by('-connections').first()
+        if module is None or user is None:
+            raise CommandError('The database has no modules or users to request.')
+        other_user = Connection.objects.filter(Q(requester=user) | Q(accepter=user)).first()
+        other_user_id = other_user.requester_id if other_user.accepter_id == user.id else other_user.accepter_id
+        token = str(RefreshToken.for_user(user).access_token)
+
+        paths = {
+            'get-modules': 'modules?page=2',
+            'get-module': f'modules/{module.module_code}',
+            'get-module-users': f'modules/{module.module_code}/users',
+            'user_connections': 'user/connections',
+            'student_detail': f'user/{other_user_id}',
+        }
+
+        results = {}
+        self.stdout.write(f'{"endpoint":<20}{"clients":>8}{"WSGI req/s":>12}{"ASGI req/s":>12}{"WSGI p95":>11}{"ASGI p95":>11}')
+        for name, path in paths.items():
+            results[name] = {}
+            for concurrency in options['concurrency']:
+                wsgi = self.measure(f'{options["wsgi"].rstrip("/")}/{path}', token, concurrency, options['requests'])
+                asgi = self.measure(f'{options["asgi"].rstrip("/")}/async/{path}', token, concurrency, options['requests'])
+                results[name][concurrency] = {'wsgi': wsgi, 'asgi': asgi}
+                self.stdout.write(f'{name:<20}{concurrency:>8}{wsgi["throughput"]:>12.1f}{asgi["throughput"]:>12.1f}'
+                                  f'{wsgi["p95_ms"]:>9.1f}ms{asgi["p95_ms"]:>9.1f}ms')
+
+        with open(options['output'], 'w') as f:
+            json.dump({'meta': {'wsgi': options['wsgi'], 'asgi': options['asgi'], 'requests': options['requests']},
+                       'endpoints': results}, f, indent=2)
+        self.stdout.write(f'Results written to {options["output"]}')
+
+    def measure(self, url, token, concurrency, count):
+        sessions = threading.local()
+        status_codes = {}
+
+        def request(_):
+            if not hasattr(sessions, 'session'):
+                sessions.session = requests.Session()
+                sessions.session.headers['Authorization'] = f'Bearer {token}'
+            start = time.perf_counter()
+            response = sessions.session.get(url, timeout=60)
+            duration = (time.perf_counter() - start) * 1000
+            status_codes[response.status_code] = status_codes.get(response.status_code, 0) + 1
+            return duration
+
+        with ThreadPoolExecutor(concurrency) as executor:
+            # Warm up connections and caches
+            list(executor.map(request, range(concurrency)))
+            status_codes.clear()
+            start = time.perf_counter()
+            durations = list(executor.map(request, range(count)))
+            elapsed = time.perf_counter() - start
+
+        return {'throughput': round(count / elapsed, 1), **summarize(durations), 'status_codes': status_codes}
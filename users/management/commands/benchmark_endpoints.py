@@ -0,0 +1,248 @@
+import json
+import shutil
+import statistics
+import tempfile
+import time
+from collections import Counter
+from datetime import timedelta
+from io import BytesIO
+from unittest import mock
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import Count, Q
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext, setup_test_environment, teardown_test_environment
+from django.utils import timezone
+from PIL import Image
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from modules.models import Module
+from modwithme.benchmark import seed, summarize
+from users.models import Connection, Enrolment, User, thumbnail_queue
+from users.otp import get_otp_store
+from users.outbox import email_queue
+
+# Full scale dataset, multiplied by --scale.
+DATASET = {
+    'modules': 10_000,
+    'users': 100_000,
+    'enrolments': 1_000_000,
+    'connections': 200_000,
+}
+PASSWORD = 'Benchmark-password-1'
+# Users requested, and modules added and removed, by each request to the bulk endpoints.
+BULK_SIZE = 5
+
+class Command(BaseCommand):
+    help = ('Seeds a throwaway database with synthetic data, drives every users and modules endpoint through '
+            'the Django test client, and reports p50/p95 latency, SQL query count and response size per endpoint.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', type=float, default=1.0,
+                            help='Fraction of the full dataset (10k modules, 100k users, 1M enrolments, 200k connections) to seed.')
+        parser.add_argument('--repeat', type=int, default=20, help='Number of timed requests per endpoint.')
+        parser.add_argument('--only', nargs='*', help='Only benchmark endpoints with these names.')
+        parser.add_argument('--output', default='benchmark_endpoints.json', help='Path to write the results to, as JSON.')
+        parser.add_argument('--compare', help='Path to the JSON results of an earlier run, to print the change against.')
+
+    def handle(self, *args, **options):
+        self.repeat = options['repeat']
+        dataset = {name: int(count * options['scale']) for name, count in DATASET.items()}
+
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        media_root = tempfile.mkdtemp()
+        try:
+            with override_settings(MEDIA_ROOT=media_root), \
+                    mock.patch('modules.views.fetch_module_list', side_effect=self.module_list):
+                seed(**dataset, stdout=self.stdout)
+                self.prepare()
+                endpoints = {}
+                for name, method, make_request in self.endpoints():
+                    if options['only'] and name not in options['only']:
+                        continue
+                    endpoints[name] = self.measure(method, make_request)
+                    self.stdout.write(f'{name:<28}{endpoints[name]["p50_ms"]:>10.2f}ms{endpoints[name]["queries"]:>8}q'
+                                      f'{endpoints[name]["bytes"]:>10}B  {endpoints[name]["status_codes"]}')
+                thumbnail_queue.join()
+                email_queue.join()
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+            shutil.rmtree(media_root, ignore_errors=True)
+
+        results = {
+            'meta': {'vendor': connection.vendor, 'dataset': dataset, 'repeat': self.repeat, 'time': time.strftime('%Y-%m-%dT%H:%M:%S')},
+            'endpoints': endpoints,
+        }
+        with open(options['output'], 'w') as f:
+            json.dump(results, f, indent=2)
+        self.stdout.write(f'Results written to {options["output"]}')
+
+        if options['compare']:
+            with open(options['compare']) as f:
+                self.compare(json.load(f), results)
+
+    def prepare(self):
+        """Picks the busiest module and user of the seeded data, and sets up what each endpoint's requests need."""
+
+        self.module = Module.objects.annotate(enrolments=Count('enrolment')).order_by('-enrolments').first()
+        self.user = User.objects.annotate(connections=Count('incoming_connections')).order_by('-connections').first()
+        self.user.set_password(PASSWORD)
+        self.user.save()
+        self.admin = User.objects.create_superuser('admin@u.nus.edu', PASSWORD)
+
+        enrolled_module_ids = Enrolment.objects.filter(user=self.user).values('module_id')
+        self.enrolled_module = Module.objects.filter(id__in=enrolled_module_ids).first()
+        free_modules = list(Module.objects.exclude(id__in=enrolled_module_ids).order_by('?')[:self.repeat * (BULK_SIZE + 1)])
+        self.free_modules = free_modules[:self.repeat]
+        # Each batch adds its own modules and removes those the previous batch added
+        self.batch_modules = [
+            [module.module_code for module in free_modules[self.repeat + i * BULK_SIZE:self.repeat + (i + 1) * BULK_SIZE]]
+            for i in range(self.repeat)
+        ]
+
+        connections = Connection.objects.filter(Q(requester=self.user) | Q(accepter=self.user))
+        self.connected_user = connections.filter(status=Connection.ACCEPTED).first()
+        self.connected_user = self.connected_user.requester if self.connected_user.accepter_id == self.user.id else self.connected_user.accepter
+        connected_user_ids = set(connections.values_list('requester_id', flat=True)) | set(connections.values_list('accepter_id', flat=True))
+        self.strangers = list(User.objects.exclude(id__in=connected_user_ids).order_by('?')[:self.repeat])
+
+        # Incoming requests for the user to accept
+        self.requesters = list(User.objects.exclude(id__in=connected_user_ids).exclude(
+            id__in=[stranger.id for stranger in self.strangers]).order_by('?')[:self.repeat])
+        self.pending = [
+            Connection.objects.create(requester=requester, accepter=self.user, module=self.enrolled_module)
+            for requester in self.requesters
+        ]
+
+        # Users for each bulk request to connect with
+        bulk_strangers = list(User.objects.exclude(id__in=connected_user_ids).exclude(
+            id__in=[user.id for user in self.strangers + self.requesters]).order_by('?')[:self.repeat * BULK_SIZE])
+        self.bulk_strangers = [
+            [user.id for user in bulk_strangers[i * BULK_SIZE:(i + 1) * BULK_SIZE]] for i in range(self.repeat)
+        ]
+
+        self.unverified = [User.objects.create_user(f'unverified{i}@u.nus.edu', PASSWORD) for i in range(self.repeat)]
+        self.pending_otp = []
+        for i in range(self.repeat):
+            user = User.objects.create_user(f'pending{i}@u.nus.edu', PASSWORD)
+            self.pending_otp.append((user, get_otp_store().issue(user)))
+
+        picture = BytesIO()
+        Image.new('RGB', (640, 640), 'orange').save(picture, 'JPEG')
+        self.picture = picture.getvalue()
+
+        self.tokens = {}
+
+    def module_list(self, academic_year):
+        return [{'moduleCode': code, 'title': title} for code, title in Module.objects.values_list('module_code', 'title')]
+
+    def access_token(self, user):
+        if user.id not in self.tokens:
+            self.tokens[user.id] = str(RefreshToken.for_user(user).access_token)
+        return self.tokens[user.id]
+
+    def endpoints(self):
+        """Returns (name, method, make_request) for every endpoint, where make_request(i) returns
+        the (path, data, user to authenticate as) of the i-th request."""
+
+        module_code = self.module.module_code
+        enrolled_code = self.enrolled_module.module_code
+        profile = {
+            'name': self.user.name, 'nus_email': self.user.nus_email, 'telegram_id': 'benchmark', 'phone_number': '',
+            'major': self.user.major, 'year': self.user.year, 'bio': 'Benchmarking',
+        }
+
+        return [
+            ('register', 'post', lambda i: ('/register', {'nus_email': f'register{i}@u.nus.edu', 'password': PASSWORD}, None)),
+            ('otp_send', 'post', lambda i: ('/otp/send', {'nus_email': self.unverified[i].nus_email}, None)),
+            ('otp_verify', 'post', lambda i: ('/otp/verify', {'nus_email': self.pending_otp[i][0].nus_email, 'otp': self.pending_otp[i][1]}, None)),
+            ('login', 'post', lambda i: ('/login', {'nus_email': self.user.nus_email, 'password': PASSWORD}, None)),
+            ('token_refresh', 'post', lambda i: ('/token/refresh', {'refresh': str(RefreshToken.for_user(self.user))}, None)),
+            ('token_verify', 'post', lambda i: ('/token/verify', {'token': self.access_token(self.user)}, None)),
+            ('logout', 'post', lambda i: ('/logout', {'refresh': str(RefreshToken.for_user(self.user))}, None)),
+            ('student_modules', 'get', lambda i: ('/user/modules', None, self.user)),
+            ('student_modules_search', 'get', lambda i: ('/user/modules', {'q': enrolled_code[:2]}, self.user)),
+            ('student_self', 'get', lambda i: ('/user', None, self.user)),
+            ('student_self_put', 'put', lambda i: ('/user', profile, self.user)),
+            ('profile_picture', 'get', lambda i: ('/user/picture', None, self.user)),
+            ('profile_picture_post', 'post', lambda i: ('/user/picture', {'profile_pic': self.upload(i)}, self.user)),
+            ('profile_picture_delete', 'delete', lambda i: ('/user/picture', None, self.user)),
+            ('student_detail', 'get', lambda i: (f'/user/{self.connected_user.id}', None, self.user)),
+            ('enroll_module', 'post', lambda i: ('/user/modules/enroll', {'module_code': self.free_modules[i].module_code}, self.user)),
+            ('enroll_module_delete', 'delete', lambda i: ('/user/modules/enroll', {'module_code': self.free_modules[i].module_code}, self.user)),
+            ('batch_enroll_modules', 'post', lambda i: ('/user/modules/enroll/batch', {
+                'add': self.batch_modules[i], 'remove': self.batch_modules[i - 1] if i else [],
+            }, self.user)),
+            ('update_module_status', 'get', lambda i: (f'/user/modules/status/{enrolled_code}', None, self.user)),
+            ('update_module_status_put', 'put', lambda i: (f'/user/modules/status/{enrolled_code}', {'status': i % 3}, self.user)),
+            ('user_connections', 'get', lambda i: ('/user/connections', None, self.user)),
+            ('user_connections_cursor', 'get', lambda i: ('/user/connections', {'cursor': ''}, self.user)),
+            ('user_connections_since', 'get', lambda i: ('/user/connections', {'since': (timezone.now() - timedelta(minutes=5)).isoformat()}, self.user)),
+            ('user_connections_post', 'post', lambda i: ('/user/connections', {'module_code': enrolled_code, 'other_user': self.strangers[i].id}, self.user)),
+            ('user_connections_put', 'put', lambda i: ('/user/connections', {'id': self.pending[i].id, 'status': 2}, self.user)),
+            ('bulk_connections', 'post', lambda i: ('/user/connections/bulk', {'module_code': enrolled_code, 'other_users': self.bulk_strangers[i]}, self.user)),
+            ('get-modules', 'get', lambda i: ('/modules', {'page': i % 5 + 1}, self.user)),
+            ('get-modules_cursor', 'get', lambda i: ('/modules', {'cursor': ''}, self.user)),
+            ('get-modules_search', 'get', lambda i: ('/modules', {'q': module_code[:i % len(module_code) + 1]}, self.user)),
+            ('get-module', 'get', lambda i: (f'/modules/{module_code}', None, self.user)),
+            ('get-module-users', 'get', lambda i: (f'/modules/{module_code}/users', {'page': i % 5 + 1}, self.user)),
+            ('get-module-users_cursor', 'get', lambda i: (f'/modules/{module_code}/users', {'cursor': ''}, self.user)),
+            ('get-module-recommendations', 'get', lambda i: (f'/modules/{module_code}/recommendations', None, self.user)),
+            ('update-modules', 'post', lambda i: ('/modules/update/2022-2023', None, self.admin)),
+            ('update-modules_manual', 'post', lambda i: ('/modules/update/manual/2022-2023', self.module_list(None), self.admin)),
+        ]
+
+    def upload(self, i):
+        picture = BytesIO(self.picture)
+        picture.name = f'benchmark{i}.jpg'
+        return picture
+
+    def measure(self, method, make_request):
+        client = Client(raise_request_exception=False)
+        durations = []
+        query_counts = []
+        sizes = []
+        status_codes = Counter()
+
+        for i in range(self.repeat):
+            path, data, user = make_request(i)
+            kwargs = {}
+            if user is not None:
+                kwargs['HTTP_AUTHORIZATION'] = f'Bearer {self.access_token(user)}'
+            if method == 'get':
+                kwargs['data'] = data
+            elif isinstance(data, dict) and any(hasattr(value, 'read') for value in data.values()):
+                kwargs['data'] = data
+            elif data is not None:
+                kwargs['data'] = json.dumps(data)
+                kwargs['content_type'] = 'application/json'
+
+            with CaptureQueriesContext(connection) as queries:
+                start = time.perf_counter()
+                response = getattr(client, method)(path, **kwargs)
+                durations.append((time.perf_counter() - start) * 1000)
+            query_counts.append(len(queries))
+            sizes.append(len(response.content))
+            status_codes[response.status_code] += 1
+
+        return {
+            'method': method.upper(),
+            'path': path,
+            **summarize(durations),
+            'queries': round(statistics.median(query_counts)),
+            'bytes': round(statistics.median(sizes)),
+            'status_codes': dict(status_codes),
+        }
+
+    def compare(self, before, after):
+        self.stdout.write(f'\n{"endpoint":<28}{"p50 before":>12}{"p50 after":>12}{"change":>9}{"queries":>12}')
+        for name, result in after['endpoints'].items():
+            previous = before['endpoints'].get(name)
+            if previous is None:
+                continue
+            change = (result['p50_ms'] - previous['p50_ms']) / previous['p50_ms'] * 100 if previous['p50_ms'] else 0
+            self.stdout.write(f'{name:<28}{previous["p50_ms"]:>10.2f}ms{result["p50_ms"]:>10.2f}ms{change:>8.0f}%'
+                              f'{previous["queries"]:>6} → {result["queries"]:<4}')
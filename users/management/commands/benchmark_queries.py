@@ -0,0 +1,103 @@
+import json
+
+from django.core.management.base import BaseCommand
+from django.db import connection, migrations
+from django.db.migrations.loader import MigrationLoader
+from django.db.models import Count, Q
+
+from modules.models import Module
+from modwithme.benchmark import seed, summarize, time_calls
+from users.models import Connection, Enrolment, User
+
+# The hot table indexes and constraints, which the "before" runs are measured without. The rest of the schema is
+# current, so that the current models can seed and query it.
+HOT_TABLE_INDEXES = [
+    ('modules', migrations.RemoveIndex('module', 'module_code_id_idx')),
+    ('modules', migrations.RemoveConstraint('module', 'unique_module_code')),
+    ('users', migrations.RemoveIndex('enrolment', 'enrolment_roster_idx')),
+    ('users', migrations.RemoveConstraint('enrolment', 'unique_enrolment')),
+    ('users', migrations.RemoveIndex('connection', 'connection_requester_idx')),
+    ('users', migrations.RemoveIndex('connection', 'connection_accepter_idx')),
+    ('users', migrations.RemoveConstraint('connection', 'unique_connection_pair')),
+]
+
+def remove_hot_table_indexes():
+    """Removes the hot table indexes and constraints from the fully migrated database, as migrations would.
+    Returns the states to restore them from, for restore_hot_table_indexes()."""
+
+    state = MigrationLoader(connection).project_state()
+    states = []
+    with connection.schema_editor() as schema_editor:
+        for app_label, operation in HOT_TABLE_INDEXES:
+            new_state = state.clone()
+            operation.state_forwards(app_label, new_state)
+            operation.database_forwards(app_label, schema_editor, state, new_state)
+            states.append((state, new_state))
+            state = new_state
+    return states
+
+def restore_hot_table_indexes(states):
+    with connection.schema_editor() as schema_editor:
+        for (app_label, operation), (state, new_state) in reversed(list(zip(HOT_TABLE_INDEXES, states))):
+            operation.database_backwards(app_label, schema_editor, new_state, state)
+
+class Command(BaseCommand):
+    help = ('Seeds a throwaway database and records the EXPLAIN plans and timings of the hot queries, '
+            'without and with the hot table indexes and constraints.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--modules', type=int, default=6000)
+        parser.add_argument('--users', type=int, default=20000)
+        parser.add_argument('--enrolments', type=int, default=120000)
+        parser.add_argument('--connections', type=int, default=40000)
+        parser.add_argument('--repeat', type=int, default=20, help='Number of timed runs per query.')
+        parser.add_argument('--output', default='benchmark_queries.json', help='Path to write the results to, as JSON.')
+
+    def handle(self, *args, **options):
+        # Migrated fully, then without the hot table indexes for the "before" runs
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            states = remove_hot_table_indexes()
+            seed(options['modules'], options['users'], options['enrolments'], options['connections'], stdout=self.stdout)
+            results = {'vendor': connection.vendor, 'before': self.run_queries(options['repeat'])}
+
+            restore_hot_table_indexes(states)
+            results['after'] = self.run_queries(options['repeat'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        with open(options['output'], 'w') as f:
+            json.dump(results, f, indent=2)
+
+        self.stdout.write(f'{"query":<24}{"before p50":>14}{"after p50":>14}')
+        for name in results['before']:
+            self.stdout.write(f'{name:<24}{results["before"][name]["p50_ms"]:>12.3f}ms{results["after"][name]["p50_ms"]:>12.3f}ms')
+        self.stdout.write(f'Plans and timings written to {options["output"]}')
+
+    def hot_queries(self):
+        """Returns the querysets of the hot views, for the busiest module and user."""
+
+        module = Module.objects.annotate(enrolments=Count('enrolment')).order_by('-enrolments').first()
+        user = User.objects.annotate(connections=Count('outgoing_connections')).order_by('-connections').first()
+        other_user = Connection.objects.filter(requester=user).first().accepter
+
+        return {
+            'module_by_code': Module.objects.with_code(module.module_code.lower()),
+            'enrolment_exists': Enrolment.objects.filter(user=user, module=module),
+            'module_roster': User.objects.enrolled_in(module.module_code).with_connection_status(user)
+                .exclude(id=user.id).filter(module_enrolment_status__in=[Enrolment.LOOKING, Enrolment.WILLING]).order_by('id')[:20],
+            'connection_pair': Connection.objects.filter(Q(requester=user, accepter=other_user) | Q(requester=other_user, accepter=user)),
+            'connection_inbox': Connection.objects.filter(Q(accepter=user) | Q(requester=user))
+                .select_related('requester', 'accepter', 'module').with_enrolment_statuses().order_by('creation_time'),
+            'pending_requests': Connection.objects.filter(accepter=user, status=Connection.PENDING),
+            'catalog_page': Module.objects.with_is_enrolled(user).order_by('module_code')[1000:1020],
+        }
+
+    def run_queries(self, repeat):
+        results = {}
+        for name, queryset in self.hot_queries().items():
+            results[name] = {
+                'plan': queryset.explain().splitlines(),
+                **summarize(time_calls(lambda: list(queryset.all()), repeat)),
+            }
+        return results
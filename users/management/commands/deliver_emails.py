@@ -0,0 +1,19 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from users.outbox import deliver_emails
+
+class Command(BaseCommand):
+    help = 'Sends the pending emails in the outbox that are due, e.g. those left behind by a restarted web worker.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', type=float, metavar='SECONDS', help='Keep delivering, waiting this long between runs.')
+
+    def handle(self, *args, **options):
+        while True:
+            sent = deliver_emails()
+            self.stdout.write(f'Sent {sent} emails')
+            if not options['loop']:
+                break
+            time.sleep(options['loop'])
@@ -0,0 +1,15 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from users.models import ConnectionTombstone
+
+class Command(BaseCommand):
+    help = 'Deletes connection tombstones older than CONNECTION_TOMBSTONE_MAX_AGE, which clients can no longer sync from.'
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(seconds=settings.CONNECTION_TOMBSTONE_MAX_AGE)
+        deleted, _ = ConnectionTombstone.objects.filter(deleted_at__lt=cutoff).delete()
+        self.stdout.write(f'Deleted {deleted} connection tombstones')
@@ -0,0 +1,16 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from users.models import VerificationCode
+
+class Command(BaseCommand):
+    help = ('Deletes verification codes older than OTP_EXPIRATION_DURATION, which can no longer be used. '
+            "Only needed with OTP_STORE set to 'database', as the cache expires codes itself.")
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(seconds=settings.OTP_EXPIRATION_DURATION)
+        deleted, _ = VerificationCode.objects.filter(creation_time__lt=cutoff).delete()
+        self.stdout.write(f'Deleted {deleted} expired verification codes')
@@ -0,0 +1,65 @@
+from django.db import migrations
+
+
+def remove_duplicate_modules(apps, schema_editor):
+    """Merges modules with the same case-insensitive module code into the one created first."""
+
+    Module = apps.get_model('modules', 'Module')
+    Enrolment = apps.get_model('users', 'Enrolment')
+    Connection = apps.get_model('users', 'Connection')
+
+    kept_ids = {}
+    for module_id, module_code in Module.objects.order_by('id').values_list('id', 'module_code'):
+        kept_id = kept_ids.setdefault(module_code.upper(), module_id)
+        if kept_id != module_id:
+            Enrolment.objects.filter(module_id=module_id).update(module_id=kept_id)
+            Connection.objects.filter(module_id=module_id).update(module_id=kept_id)
+            Module.objects.filter(id=module_id).delete()
+
+
+def remove_duplicate_enrolments(apps, schema_editor):
+    """Keeps the first enrolment of each user in each module."""
+
+    Enrolment = apps.get_model('users', 'Enrolment')
+
+    seen = set()
+    duplicate_ids = []
+    for enrolment_id, user_id, module_id in Enrolment.objects.order_by('id').values_list('id', 'user_id', 'module_id'):
+        if (user_id, module_id) in seen:
+            duplicate_ids.append(enrolment_id)
+        seen.add((user_id, module_id))
+    Enrolment.objects.filter(id__in=duplicate_ids).delete()
+
+
+def remove_duplicate_connections(apps, schema_editor):
+    """Keeps one connection between each pair of users, preferring an accepted one, then the first."""
+
+    Connection = apps.get_model('users', 'Connection')
+
+    kept = {}
+    duplicate_ids = []
+    connections = Connection.objects.order_by('id').values_list('id', 'requester_id', 'accepter_id', 'status')
+    for connection_id, requester_id, accepter_id, status in connections:
+        pair = (min(requester_id, accepter_id), max(requester_id, accepter_id))
+        if pair not in kept:
+            kept[pair] = (connection_id, status)
+        elif status == 'AC' and kept[pair][1] != 'AC':
+            duplicate_ids.append(kept[pair][0])
+            kept[pair] = (connection_id, status)
+        else:
+            duplicate_ids.append(connection_id)
+    Connection.objects.filter(id__in=duplicate_ids).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('modules', '0001_initial'),
+        ('users', '0010_alter_verificationcode_code'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_modules, migrations.RunPython.noop),
+        migrations.RunPython(remove_duplicate_enrolments, migrations.RunPython.noop),
+        migrations.RunPython(remove_duplicate_connections, migrations.RunPython.noop),
+    ]
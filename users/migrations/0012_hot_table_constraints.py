@@ -0,0 +1,34 @@
+# Generated by Django 4.1.1 on 2026-10-18 18:59
+
+from django.db import migrations, models
+import django.db.models.functions.comparison
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0011_remove_duplicates'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='connection',
+            index=models.Index(fields=['requester', 'status'], name='connection_requester_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='connection',
+            index=models.Index(fields=['accepter', 'status'], name='connection_accepter_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='enrolment',
+            index=models.Index(condition=models.Q(('status__in', ['LF', 'WH'])), fields=['module', 'user'], name='enrolment_roster_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='connection',
+            constraint=models.UniqueConstraint(django.db.models.functions.comparison.Least('requester', 'accepter'), django.db.models.functions.comparison.Greatest('requester', 'accepter'), name='unique_connection_pair'),
+        ),
+        migrations.AddConstraint(
+            model_name='enrolment',
+            constraint=models.UniqueConstraint(fields=('user', 'module'), name='unique_enrolment'),
+        ),
+    ]
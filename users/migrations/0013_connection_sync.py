@@ -0,0 +1,56 @@
+# Generated by Django 4.1.1 on 2026-10-18 19:06
+
+from django.db import migrations, models
+
+
+def backfill_updated_at(apps, schema_editor):
+    """Existing connections were last changed no earlier than they were created."""
+
+    Connection = apps.get_model('users', 'Connection')
+    Connection.objects.update(updated_at=models.F('creation_time'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0012_hot_table_constraints'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConnectionTombstone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('connection_id', models.IntegerField()),
+                ('requester_id', models.IntegerField()),
+                ('accepter_id', models.IntegerField()),
+                ('deleted_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='connection',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddIndex(
+            model_name='connection',
+            index=models.Index(fields=['requester', 'updated_at'], name='connection_requester_sync_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='connection',
+            index=models.Index(fields=['accepter', 'updated_at'], name='connection_accepter_sync_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='connectiontombstone',
+            index=models.Index(fields=['requester_id', 'deleted_at'], name='tombstone_requester_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='connectiontombstone',
+            index=models.Index(fields=['accepter_id', 'deleted_at'], name='tombstone_accepter_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='connectiontombstone',
+            index=models.Index(fields=['deleted_at'], name='tombstone_deleted_at_idx'),
+        ),
+        migrations.RunPython(backfill_updated_at, migrations.RunPython.noop),
+    ]
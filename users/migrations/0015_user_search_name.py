@@ -0,0 +1,47 @@
+# Generated by Django 4.1.1 on 2026-10-18 19:27
+
+import unicodedata
+
+from django.db import migrations, models
+
+
+def normalize_name(name):
+    # As users.search.normalize_name, copied so that this migration doesn't change with it.
+    decomposed = unicodedata.normalize('NFKD', name.casefold())
+    return ' '.join(''.join(c for c in decomposed if not unicodedata.combining(c)).split())
+
+
+def backfill_search_name(apps, schema_editor):
+    User = apps.get_model('users', 'User')
+    users = [User(id=user_id, search_name=normalize_name(name)) for user_id, name in User.objects.values_list('id', 'name')]
+    User.objects.bulk_update(users, ['search_name'], batch_size=1000)
+
+
+def create_trigram_index(apps, schema_editor):
+    """Indexes substring matches on search_name. Only PostgreSQL has trigram indexes."""
+
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        schema_editor.execute('CREATE INDEX IF NOT EXISTS user_search_name_trgm_idx ON users_user USING gin (search_name gin_trgm_ops)')
+
+
+def drop_trigram_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS user_search_name_trgm_idx')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0014_outboxemail'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='search_name',
+            field=models.TextField(default='', editable=False),
+        ),
+        migrations.RunPython(backfill_search_name, migrations.RunPython.noop),
+        migrations.RunPython(create_trigram_index, drop_trigram_index),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 4.1.1 on 2026-10-18 19:39
+
+from django.db import migrations, models
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0015_user_search_name'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='card_version',
+            field=models.UUIDField(default=uuid.uuid4, editable=False),
+        ),
+    ]
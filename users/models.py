@@ -1,20 +1,41 @@
 import math, random
 import os.path
+import uuid
 from enum import Enum
-from django.db import models
-from django.db.models import Q
+from django.db import models, transaction
+from django.db.models import Count, F, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce, Greatest, Least
 from django.conf import settings
 from django.contrib.auth.models import AbstractUser, BaseUserManager
+from django.core.cache import cache
 from django.core.files.base import ContentFile
-from django.core.mail import send_mail
 from django.utils import timezone
 from io import BytesIO
 from PIL import Image
 
 from modules.models import Module
+from modwithme.background import BackgroundQueue
+from modwithme.events import publish_on_commit
+from modwithme.media import VERSIONED_NAME, versioned_upload_name
 from modwithme.settings import THUMBNAIL_SIZE
 
-class UserManager(BaseUserManager):
+from .search import normalize_name
+
+class UserQuerySet(models.QuerySet):
+    def enrolled_in(self, module_code):
+        """Filters to users enrolled in the given module, annotated with their enrolment status in it."""
+
+        return self.filter(enrolment__module__in=Module.objects.with_code(module_code)).annotate(
+            module_enrolment_status=models.F('enrolment__status'))
+
+    def with_connection_status(self, user):
+        """Annotates each user with the status of their connection with the given user, within the same query."""
+
+        connections = Connection.objects.filter(
+            Q(requester=user, accepter=models.OuterRef('pk')) | Q(requester=models.OuterRef('pk'), accepter=user))
+        return self.annotate(viewer_connection_status=models.Subquery(connections.order_by('id').values('status')[:1]))
+
+class UserManager(BaseUserManager.from_queryset(UserQuerySet)):
     """A custom model manager for the custom User model that uses nus_email instead of username."""
 
     use_in_migrations = True
@@ -50,10 +71,18 @@ class UserManager(BaseUserManager):
 
 class User(AbstractUser):
     def profile_pic_image_path(instance, filename):
+        # Every upload gets a new name, so media can be cached as immutable. Thumbnails keep their picture's.
+        if not VERSIONED_NAME.search(filename):
+            filename = versioned_upload_name(filename)
         return f'user/{instance.id}/{filename}'
 
     username = None
     name = models.CharField(max_length=50)
+    # name as normalized by users.search.normalize_name, for searching by name. Set by save(). Unbounded, as
+    # normalizing can lengthen names ('ß' becomes 'ss')
+    search_name = models.TextField(editable=False, default='')
+    # Changed by every save(), to key the user's profile cards (see cards.py)
+    card_version = models.UUIDField(default=uuid.uuid4, editable=False)
     nus_email = models.EmailField(unique=True)
     is_verified = models.BooleanField(default=False)
     telegram_id = models.CharField(max_length=20, blank=True)
@@ -69,30 +98,66 @@ class User(AbstractUser):
 
     objects = UserManager()
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if 'profile_pic' in field_names:
+            instance._loaded_profile_pic = values[field_names.index('profile_pic')] or ''
+        return instance
+
     def save(self, *args, **kwargs):
-        self.create_thumbnail()
+        self.search_name = normalize_name(self.name)
+        self.card_version = uuid.uuid4()
+        update_fields = kwargs.get('update_fields')
+        if update_fields:
+            kwargs['update_fields'] = {*update_fields, 'card_version', *(['search_name'] if 'name' in update_fields else [])}
+
+        profile_pic_changed = self.has_profile_pic_changed()
+        if profile_pic_changed:
+            # The thumbnail is left empty until it is generated in the background.
+            self.thumbnail_pic = None
+            if self.profile_pic:
+                self.get_thumbnail_format()
 
         super(User, self).save(*args, **kwargs)
 
+        if profile_pic_changed:
+            self._loaded_profile_pic = self.profile_pic.name or ''
+            if self.profile_pic:
+                user_id, profile_pic_name = self.id, self.profile_pic.name
+                transaction.on_commit(lambda: thumbnail_queue.enqueue(generate_thumbnail, user_id, profile_pic_name))
+
+    def has_profile_pic_changed(self):
+        """Returns whether profile_pic differs from when the user was loaded, without any file I/O."""
+
+        if 'profile_pic' in self.get_deferred_fields():
+            return False
+        if self.profile_pic and not self.profile_pic._committed:
+            return True
+        return (self.profile_pic.name or '') != getattr(self, '_loaded_profile_pic', '')
+
+    def get_thumbnail_format(self):
+        thumbnail_extension = os.path.splitext(self.profile_pic.name)[1].lower()
+
+        if thumbnail_extension in ['.jpg', '.jpeg']:
+            return 'JPEG'
+        elif thumbnail_extension == '.gif':
+            return 'GIF'
+        elif thumbnail_extension == '.png':
+            return 'PNG'
+        else:
+            raise Exception('Unable to create thumbnail. Profile picture must be in JPEG, PNG or GIF format.')
+
     def create_thumbnail(self):
         if not self.profile_pic:
             self.thumbnail_pic = None
             return
 
+        FTYPE = self.get_thumbnail_format()
         image = Image.open(self.profile_pic)
         image.thumbnail(THUMBNAIL_SIZE, Image.ANTIALIAS)
         thumbnail_name, thumbnail_extension = os.path.splitext(self.profile_pic.name)
-        thumbnail_extension = thumbnail_extension.lower()
-        thumbnail_filename = f'{thumbnail_name}_thumb{thumbnail_extension}'
-
-        if thumbnail_extension in ['.jpg', '.jpeg']:
-            FTYPE = 'JPEG'
-        elif thumbnail_extension == '.gif':
-            FTYPE = 'GIF'
-        elif thumbnail_extension == '.png':
-            FTYPE = 'PNG'
-        else:
-            raise Exception('Unable to create thumbnail. Profile picture must be in JPEG, PNG or GIF format.')
+        thumbnail_filename = f'{os.path.basename(thumbnail_name)}_thumb{thumbnail_extension.lower()}'
 
         # Save thumbnail to in-memory file as StringIO
         temp_thumbnail = BytesIO()
@@ -107,11 +172,69 @@ class User(AbstractUser):
         return self.get_connection_status_with(other_user) == 2
     
     def get_connection_status_with(self, other_user):
-        connection = Connection.objects.filter(Q(requester=self, accepter=other_user) | Q(requester=other_user, accepter=self)).first()
-        if connection is None:
-            return 0
-        
-        return Connection_Status[connection.status].value
+        return self.get_connection_statuses().get(other_user.id, 0)
+
+    def get_connection_statuses(self):
+        """Returns a map of other user id to the status of their connection with this user.
+
+        The map is loaded in one query, then kept on this instance and in the cache until a connection
+        involving this user changes.
+        """
+
+        connection_statuses = getattr(self, '_connection_statuses', None)
+        if connection_statuses is not None:
+            return connection_statuses
+
+        cache_key = connection_statuses_cache_key(self.id)
+        connection_statuses = cache.get(cache_key)
+        if connection_statuses is None:
+            connection_statuses = {}
+            connections = Connection.objects.filter(Q(requester=self) | Q(accepter=self)).order_by('id')
+            for requester_id, accepter_id, status in connections.values_list('requester_id', 'accepter_id', 'status'):
+                other_user_id = accepter_id if requester_id == self.id else requester_id
+                connection_statuses.setdefault(other_user_id, Connection_Status[status].value)
+            cache.set(cache_key, connection_statuses, settings.CONNECTION_STATUS_CACHE_TIMEOUT)
+
+        self._connection_statuses = connection_statuses
+        return connection_statuses
+
+    def forget_connection_statuses(self):
+        self._connection_statuses = None
+
+def connection_statuses_cache_key(user_id):
+    return f'connection-statuses:{user_id}'
+
+def invalidate_connection_statuses(*user_ids):
+    """Drops the cached connection status maps of the given users. Call after changing their connections in bulk.
+
+    They are dropped now, for the rest of this transaction, and again once it commits, as other requests may cache
+    the maps from before the change until then.
+    """
+
+    keys = [connection_statuses_cache_key(user_id) for user_id in user_ids]
+    cache.delete_many(keys)
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+def connection_events_channel(user_id):
+    return f'connections:{user_id}'
+
+def notify_connection_changes(*user_ids):
+    """Wakes the given users' clients waiting for their connections to change, once the transaction commits.
+    Connections saved or deleted one at a time notify through signals, so this only needs calling after bulk changes."""
+
+    publish_on_commit(*[connection_events_channel(user_id) for user_id in user_ids])
+
+thumbnail_queue = BackgroundQueue('thumbnails')
+
+def generate_thumbnail(user_id, profile_pic_name):
+    """Generates the thumbnail of a user's profile picture, unless the picture has been changed since."""
+
+    user = User.objects.filter(id=user_id).first()
+    if user is None or user.profile_pic.name != profile_pic_name:
+        return
+
+    user.create_thumbnail()
+    user.save(update_fields=['thumbnail_pic'])
 
 class Enrolment(models.Model):
     LOOKING = 'LF'
@@ -132,6 +255,77 @@ class Enrolment(models.Model):
         default=LOOKING,
     )
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'module'], name='unique_enrolment'),
+        ]
+        indexes = [
+            # Module rosters only list users looking for a friend or willing to help.
+            models.Index(fields=['module', 'user'], condition=Q(status__in=['LF', 'WH']), name='enrolment_roster_idx'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        enrolment = super().from_db(db, field_names, values)
+        # Remembered so that a change of status can be counted when the enrolment is saved.
+        enrolment._loaded_status = enrolment.__dict__.get('status')
+        return enrolment
+
+def update_enrolment_counts(changes):
+    """Applies changes, a Counter of (module id, status) to the change in its number of enrolments, to the
+    modules' enrolment counters. Enrolments created, saved and deleted one at a time are counted by signals,
+    so this only needs calling after bulk_create() or update()."""
+
+    changes_by_module = {}
+    for (module_id, status), change in changes.items():
+        if change:
+            changes_by_module.setdefault(module_id, {})[Module.ENROLMENT_COUNT_FIELDS[status]] = change
+
+    # Modules with the same changes, like those of a batch of new enrolments, are updated together.
+    module_ids_by_changes = {}
+    for module_id, module_changes in changes_by_module.items():
+        module_ids_by_changes.setdefault(tuple(sorted(module_changes.items())), []).append(module_id)
+    for module_changes, module_ids in module_ids_by_changes.items():
+        Module.objects.filter(id__in=module_ids).update(**{field: F(field) + change for field, change in module_changes})
+
+def find_drifted_enrolment_counts():
+    """Returns the ids of the modules whose enrolment counters don't match their enrolments."""
+
+    counts = {}
+    for module_id, status, count in Enrolment.objects.values_list('module_id', 'status').annotate(count=Count('id')).order_by():
+        counts.setdefault(module_id, {})[Module.ENROLMENT_COUNT_FIELDS[status]] = count
+
+    fields = list(Module.ENROLMENT_COUNT_FIELDS.values())
+    drifted = []
+    for module_id, *values in Module.objects.values_list('id', *fields).order_by('id').iterator():
+        actual = counts.get(module_id, {})
+        if any(value != actual.get(field, 0) for field, value in zip(fields, values)):
+            drifted.append(module_id)
+    return drifted
+
+def rebuild_enrolment_counts(module_ids=None):
+    """Recounts the enrolment counters of the given modules, or of every module, from their enrolments."""
+
+    counts = {}
+    for status, field in Module.ENROLMENT_COUNT_FIELDS.items():
+        enrolments = Enrolment.objects.filter(module=OuterRef('pk'), status=status).order_by().values('module')
+        counts[field] = Coalesce(Subquery(enrolments.annotate(count=Count('id')).values('count')), 0)
+    modules = Module.objects.all() if module_ids is None else Module.objects.filter(id__in=module_ids)
+    return modules.update(**counts)
+
+class ConnectionQuerySet(models.QuerySet):
+    def with_enrolment_statuses(self):
+        """Annotates each connection with the requester's and accepter's enrolment status in its module."""
+
+        def enrolment_status(user_field):
+            enrolments = Enrolment.objects.filter(user=models.OuterRef(user_field), module=models.OuterRef('module'))
+            return models.Subquery(enrolments.values('status')[:1])
+
+        return self.annotate(
+            requester_enrolment_status=enrolment_status('requester'),
+            accepter_enrolment_status=enrolment_status('accepter'),
+        )
+
 class Connection(models.Model):
     ACCEPTED = 'AC'
     PENDING = 'PD'
@@ -148,12 +342,46 @@ class Connection(models.Model):
     accepter = models.ForeignKey(User, on_delete=models.CASCADE, related_name='incoming_connections')
     module = models.ForeignKey(Module, on_delete=models.CASCADE)
     creation_time = models.DateTimeField(auto_now_add=True)
+    # Set on every change, so that clients can sync only what changed. update() must set it explicitly.
+    updated_at = models.DateTimeField(auto_now=True)
     status = models.CharField(
         max_length=2,
         choices=CONNECTION_STATUS,
         default=PENDING,
     )
 
+    objects = ConnectionQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            # At most one connection between any 2 users, whichever of them requested it.
+            models.UniqueConstraint(Least('requester', 'accepter'), Greatest('requester', 'accepter'), name='unique_connection_pair'),
+        ]
+        indexes = [
+            models.Index(fields=['requester', 'status'], name='connection_requester_idx'),
+            models.Index(fields=['accepter', 'status'], name='connection_accepter_idx'),
+            models.Index(fields=['requester', 'updated_at'], name='connection_requester_sync_idx'),
+            models.Index(fields=['accepter', 'updated_at'], name='connection_accepter_sync_idx'),
+        ]
+
+class ConnectionTombstone(models.Model):
+    """Records a deleted (or rejected) connection, so that clients syncing connections can drop it.
+
+    The users are plain ids rather than foreign keys, as tombstones outlive connections deleted along with a user.
+    """
+
+    connection_id = models.IntegerField()
+    requester_id = models.IntegerField()
+    accepter_id = models.IntegerField()
+    deleted_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['requester_id', 'deleted_at'], name='tombstone_requester_idx'),
+            models.Index(fields=['accepter_id', 'deleted_at'], name='tombstone_accepter_idx'),
+            models.Index(fields=['deleted_at'], name='tombstone_deleted_at_idx'),
+        ]
+
 class User_Status(Enum):
     NL = 0
     LF = 1
@@ -184,13 +412,8 @@ class VerificationCode(models.Model):
     creation_time = models.DateTimeField(auto_now_add=True)
 
     def send(self):
-        send_mail(
-            'Your verification code for Mod With Me',
-            f'Your verification code is: {self.code}',
-            'reply.no@engineer.com',
-            [self.user.nus_email],
-            fail_silently=False,
-        )
+        from .otp import send_code
+        send_code(self.user, self.code)
 
     def elapsed_time(self):
         time_delta = timezone.now() - self.creation_time
@@ -205,4 +428,35 @@ class VerificationCode(models.Model):
     def remaining_time_to_resend(self):
         return settings.OTP_RESEND_DURATION - self.elapsed_time()
 
-    objects = VerificationCodeManager()
\ No newline at end of file
+    objects = VerificationCodeManager()
+
+
+class OutboxEmail(models.Model):
+    """An email waiting to be, or already, delivered by the outbox worker."""
+
+    PENDING = 'PD'
+    SENT = 'ST'
+    FAILED = 'FL'
+
+    DELIVERY_STATUS = [
+        (PENDING, 'Pending'),
+        (SENT, 'Sent'),
+        (FAILED, 'Failed'),
+    ]
+
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    from_email = models.EmailField()
+    to = models.EmailField()
+    status = models.CharField(max_length=2, choices=DELIVERY_STATUS, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    creation_time = models.DateTimeField(auto_now_add=True)
+    # When the email is next due to be (re)tried, pushed forward while a worker is sending it.
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='outbox_due_idx'),
+        ]
@@ -0,0 +1,103 @@
+"""Stores of the one-time passwords that verify users' NUS emails.
+
+With OTP_STORE set to 'cache', codes live in the cache, which expires them after OTP_EXPIRATION_DURATION,
+and the resend cooldown is a key that expires after OTP_RESEND_DURATION. The cache must be shared by every
+worker, so without one OTP_STORE is 'database', which keeps codes in the VerificationCode table.
+"""
+
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.crypto import constant_time_compare
+
+from .models import VerificationCode, VerificationCodeManager
+
+VERIFIED = 'verified'
+WRONG = 'wrong'
+EXPIRED = 'expired'
+
+def send_code(user, code):
+    # Delivered by a background worker, so that requests don't wait on SMTP.
+    from .outbox import queue_email
+    queue_email(
+        'Your verification code for Mod With Me',
+        f'Your verification code is: {code}',
+        'reply.no@engineer.com',
+        user.nus_email,
+    )
+
+class CacheOTPStore:
+    def code_key(self, user):
+        return f'otp:{user.id}'
+
+    def resend_key(self, user):
+        return f'otp-resend:{user.id}'
+
+    def issue(self, user):
+        """Returns a new code for user, replacing any previous one, or None if one was issued too recently."""
+
+        resend_at = time.time() + settings.OTP_RESEND_DURATION
+        # add() only succeeds if there is no cooldown, so concurrent requests can't both issue a code.
+        if not cache.add(self.resend_key(user), resend_at, settings.OTP_RESEND_DURATION):
+            return None
+        code = VerificationCodeManager.generate_code()
+        cache.set(self.code_key(user), code, settings.OTP_EXPIRATION_DURATION)
+        return code
+
+    def remaining_time_to_resend(self, user):
+        resend_at = cache.get(self.resend_key(user))
+        return max(0, resend_at - time.time()) if resend_at else 0
+
+    def verify(self, user, code):
+        """Returns VERIFIED and uses up the code if it is user's, WRONG if it isn't, or EXPIRED if user has none.
+        Expired codes have been evicted, so can't be told apart from wrong ones for users without a live code."""
+
+        stored_code = cache.get(self.code_key(user))
+        if stored_code is None:
+            return EXPIRED
+        if not constant_time_compare(stored_code, str(code)):
+            return WRONG
+        # Only one of any concurrent verifications deletes the code, so only one can use it up.
+        if not cache.delete(self.code_key(user)):
+            return EXPIRED
+        cache.delete(self.resend_key(user))
+        return VERIFIED
+
+class DatabaseOTPStore:
+    def issue(self, user):
+        """Returns a new code for user, replacing any previous one, or None if one was issued too recently."""
+
+        with transaction.atomic():
+            verification_code = VerificationCode.objects.select_for_update().filter(user=user).first()
+            if verification_code is not None:
+                if not verification_code.can_resend():
+                    return None
+                verification_code.delete()
+            return VerificationCode.objects.create(user=user).code
+
+    def remaining_time_to_resend(self, user):
+        verification_code = VerificationCode.objects.filter(user=user).first()
+        if verification_code is None:
+            return 0
+        return max(0, verification_code.remaining_time_to_resend())
+
+    def verify(self, user, code):
+        """Returns VERIFIED and uses up the code if it is user's, WRONG if it isn't, or EXPIRED if it has expired."""
+
+        verification_code = VerificationCode.objects.filter(user=user, code=code).first()
+        if verification_code is None:
+            return WRONG
+        if verification_code.is_expired():
+            return EXPIRED
+        verification_code.delete()
+        return VERIFIED
+
+otp_stores = {
+    'cache': CacheOTPStore(),
+    'database': DatabaseOTPStore(),
+}
+
+def get_otp_store():
+    return otp_stores[settings.OTP_STORE]
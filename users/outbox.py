@@ -0,0 +1,115 @@
+"""A persistent outbox of emails, delivered off the request path.
+
+queue_email() stores an email and wakes the in-process worker once the transaction commits. The worker sends
+every due email over one SMTP connection, and retries failures with exponential backoff. Emails left behind
+by a restart are picked up by the deliver_emails management command.
+"""
+
+import logging
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.utils import timezone
+
+from modwithme.background import BackgroundQueue
+
+from .models import OutboxEmail
+
+logger = logging.getLogger(__name__)
+
+email_queue = BackgroundQueue('emails')
+BATCH_SIZE = 100
+
+def queue_email(subject, body, from_email, to):
+    email = OutboxEmail.objects.create(subject=subject, body=body, from_email=from_email, to=to)
+    transaction.on_commit(lambda: email_queue.enqueue(deliver_emails))
+    return email
+
+def retry_delay(attempts):
+    """Returns how long to wait before the next attempt, after the given number of failed ones."""
+
+    return timedelta(seconds=settings.EMAIL_OUTBOX_RETRY_DELAY * 2 ** (attempts - 1))
+
+def claim(email):
+    """Marks email as being sent by this worker for EMAIL_OUTBOX_LEASE seconds, unless another worker has claimed it."""
+
+    lease_until = timezone.now() + timedelta(seconds=settings.EMAIL_OUTBOX_LEASE)
+    claimed = OutboxEmail.objects.filter(
+        id=email.id, status=OutboxEmail.PENDING, next_attempt_at=email.next_attempt_at,
+    ).update(next_attempt_at=lease_until)
+    return claimed == 1
+
+def deliver_emails():
+    """Sends every pending email that is due, reusing one SMTP connection across them. Returns the number sent."""
+
+    sent = 0
+    connection = None
+    try:
+        while True:
+            emails = list(OutboxEmail.objects.filter(
+                status=OutboxEmail.PENDING, next_attempt_at__lte=timezone.now()).order_by('next_attempt_at')[:BATCH_SIZE])
+            emails = [email for email in emails if claim(email)]
+            if not emails:
+                break
+
+            for email in emails:
+                email.attempts += 1
+                try:
+                    if connection is None:
+                        connection = get_connection(fail_silently=False)
+                        connection.open()
+                    EmailMessage(email.subject, email.body, email.from_email, [email.to], connection=connection).send()
+                except Exception as e:
+                    record_failure(email, e)
+                    # The connection may be what failed, so the next email opens a new one.
+                    if connection is not None:
+                        connection.close()
+                        connection = None
+                else:
+                    email.status = OutboxEmail.SENT
+                    email.sent_at = timezone.now()
+                    email.save(update_fields=['attempts', 'status', 'sent_at'])
+                    sent += 1
+    except Exception:
+        # Emails left claimed are retried once their lease runs out.
+        logger.exception('Email delivery failed')
+    finally:
+        if connection is not None:
+            connection.close()
+
+    schedule_retry()
+    return sent
+
+def record_failure(email, error):
+    email.last_error = f'{type(error).__name__}: {error}'
+    if email.attempts >= settings.EMAIL_OUTBOX_MAX_ATTEMPTS:
+        email.status = OutboxEmail.FAILED
+    else:
+        email.next_attempt_at = timezone.now() + retry_delay(email.attempts)
+    email.save(update_fields=['attempts', 'last_error', 'status', 'next_attempt_at'])
+    logger.warning('Sending email %s to %s failed (attempt %s): %s', email.id, email.to, email.attempts, email.last_error)
+
+_retry_timer = None
+_retry_lock = threading.Lock()
+
+def schedule_retry():
+    """Wakes the worker when the next pending email falls due, if it isn't already going to be."""
+
+    global _retry_timer
+    if settings.BACKGROUND_TASKS_EAGER:
+        return
+
+    next_email = OutboxEmail.objects.filter(status=OutboxEmail.PENDING).order_by('next_attempt_at').first()
+    if next_email is None:
+        return
+
+    delay = max(0, (next_email.next_attempt_at - timezone.now()).total_seconds())
+    with _retry_lock:
+        if _retry_timer is not None and _retry_timer.is_alive():
+            _retry_timer.cancel()
+        _retry_timer = threading.Timer(delay, email_queue.enqueue, args=[deliver_emails])
+        _retry_timer.daemon = True
+        _retry_timer.start()
@@ -0,0 +1,140 @@
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import Enrolment
+
+ENROLMENT_CHANGES_KEY = 'enrolment-changes'
+# The most changes a worker catches up on one by one. Further behind, it rebuilds its matrix instead.
+MAX_ENROLMENT_CHANGES_APPLIED = 1000
+
+def enrolment_change_key(sequence):
+    return f'enrolment-change:{sequence}'
+
+def record_enrolment_changes(changes):
+    """Appends (user id, module id, enrolled) changes to the shared log that every worker's co-enrolment matrix
+    follows, once the transaction commits. Enrolments saved or deleted one at a time are recorded by signals,
+    so this only needs calling after bulk changes."""
+
+    changes = list(changes)
+    if not changes:
+        return
+
+    def record():
+        cache.add(ENROLMENT_CHANGES_KEY, 0, timeout=None)
+        last = cache.incr(ENROLMENT_CHANGES_KEY, len(changes))
+        first = last - len(changes) + 1
+        cache.set_many({enrolment_change_key(first + i): change for i, change in enumerate(changes)}, settings.RECOMMENDATION_INDEX_MAX_AGE)
+    transaction.on_commit(record)
+
+class CoEnrolmentIndex:
+    """An in-memory, sparse user × module co-enrolment matrix.
+
+    Each user's row is a bitset of the modules they are enrolled in, held in a Python int, so the
+    number of modules two users share is the popcount of the AND of their rows.
+
+    Each worker has its own matrix, which follows the shared log of enrolment changes (see
+    record_enrolment_changes()) before each lookup. A worker that has fallen too far behind, or finds changes
+    missing from the cache, rebuilds its matrix from the database instead.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._columns = {}  # module id -> bit
+        self._rows = {}  # user id -> bitset of module bits
+        self._built_at = None
+        self._applied = 0  # the sequence number of the last change in the log applied to the matrix
+
+    def build(self):
+        """(Re)builds the matrix from every enrolment in the database."""
+
+        # Read before the enrolments, so that changes made in between are applied after, if at all twice.
+        applied = cache.get(ENROLMENT_CHANGES_KEY, 0)
+        columns = {}
+        user_bits = defaultdict(list)
+        for user_id, module_id in Enrolment.objects.values_list('user_id', 'module_id').iterator(chunk_size=10000):
+            user_bits[user_id].append(columns.setdefault(module_id, len(columns)))
+
+        rows = {}
+        for user_id, bits in user_bits.items():
+            row = 0
+            for bit in bits:
+                row |= 1 << bit
+            rows[user_id] = row
+
+        with self._lock:
+            self._columns = columns
+            self._rows = rows
+            self._built_at = time.monotonic()
+            self._applied = applied
+
+    def invalidate(self):
+        """Discards the matrix, so that it is rebuilt on the next lookup."""
+
+        with self._lock:
+            self._built_at = None
+
+    def apply(self, user_id, module_id, enrolled):
+        with self._lock:
+            if enrolled:
+                self._rows[user_id] = self._rows.get(user_id, 0) | 1 << self._column(module_id)
+            elif module_id in self._columns:
+                self._rows[user_id] = self._rows.get(user_id, 0) & ~(1 << self._columns[module_id])
+
+    def rank(self, module_ids, candidate_ids, exclude_module_id=None):
+        """Returns (user id, number of modules shared) for each candidate, most shared first.
+
+        module_ids are the modules of the user to recommend partners to, and exclude_module_id is left out
+        of the count, as every candidate shares the module they are recommended for.
+        """
+
+        self._ensure_built()
+        with self._lock:
+            row = 0
+            for module_id in module_ids:
+                if module_id != exclude_module_id:
+                    row |= 1 << self._column(module_id)
+            rows = self._rows
+            scores = [(user_id, (rows.get(user_id, 0) & row).bit_count()) for user_id in candidate_ids]
+
+        scores.sort(key=lambda score: (-score[1], score[0]))
+        return scores
+
+    def _ensure_built(self):
+        built_at = self._built_at
+        if built_at is None or time.monotonic() - built_at > settings.RECOMMENDATION_INDEX_MAX_AGE:
+            self.build()
+        else:
+            self._catch_up()
+
+    def _catch_up(self):
+        """Applies the changes logged since the matrix was built or last caught up."""
+
+        last = cache.get(ENROLMENT_CHANGES_KEY, 0)
+        applied = self._applied
+        if last == applied:
+            return
+        if last < applied or last - applied > MAX_ENROLMENT_CHANGES_APPLIED:
+            # The log was reset, or this worker is too far behind.
+            self.build()
+            return
+
+        keys = [enrolment_change_key(sequence) for sequence in range(applied + 1, last + 1)]
+        changes = cache.get_many(keys)
+        if len(changes) < len(keys):
+            # Expired or evicted, or still being logged. The database has them either way.
+            self.build()
+            return
+        with self._lock:
+            for key in keys:
+                self.apply(*changes[key])
+            self._applied = max(self._applied, last)
+
+    def _column(self, module_id):
+        return self._columns.setdefault(module_id, len(self._columns))
+
+co_enrolment_index = CoEnrolmentIndex()
@@ -0,0 +1,40 @@
+"""Search of users by name, over User.search_name.
+
+search_name is the name normalized with normalize_name(), and kept up to date by User.save(). Every word of a
+query must appear in it, ignoring case and accents. On PostgreSQL, a trigram index on it serves these substring
+matches. Elsewhere they are checked row by row, within the module roster or connections being searched.
+"""
+
+import unicodedata
+
+from django.db.models import Case, IntegerField, Q, Value, When
+
+# Match tiers, best first.
+NAME_PREFIX = 0
+WORD_PREFIX = 1
+SUBSTRING = 2
+
+def normalize_name(name):
+    """Returns name casefolded, without accents, and with words separated by single spaces."""
+
+    decomposed = unicodedata.normalize('NFKD', name.casefold())
+    return ' '.join(''.join(c for c in decomposed if not unicodedata.combining(c)).split())
+
+def name_matches(query, field='search_name'):
+    """Returns a Q matching users, or what field belongs to, with every word of query in their name."""
+
+    condition = Q()
+    for word in normalize_name(query).split():
+        condition &= Q(**{f'{field}__contains': word})
+    return condition
+
+def rank_name_matches(queryset, query, field='search_name'):
+    """Annotates each user in queryset with name_rank, the tier of their name's match with query."""
+
+    query = normalize_name(query)
+    return queryset.annotate(name_rank=Case(
+        When(**{f'{field}__startswith': query}, then=Value(NAME_PREFIX)),
+        When(**{f'{field}__contains': f' {query}'}, then=Value(WORD_PREFIX)),
+        default=Value(SUBSTRING),
+        output_field=IntegerField(),
+    ))
@@ -1,9 +1,12 @@
+from django.db import models
 from django.db.models import Q
 from django.utils.translation import gettext_lazy as _
 from rest_framework import serializers
 
+from modules.models import Module
 from modules.serializers import ModuleSerializer
 
+from .cards import get_profile_cards
 from .models import Connection, Connection_Status, Enrolment, User, User_Status
 
 class RegisterSerializer(serializers.ModelSerializer):
@@ -17,8 +20,21 @@ class RegisterSerializer(serializers.ModelSerializer):
 
         return user
 
+class ProfileCardListSerializer(serializers.ListSerializer):
+    """Serializes a list of users with one cache lookup for all of their cards."""
+
+    def to_representation(self, data):
+        users = list(data.all() if isinstance(data, models.Manager) else data)
+        cards = self.child.get_cards(users)
+        return [self.child.merge_viewer_fields(user, cards[user.id]) for user in users]
+
 class SimpleUserSerializer(serializers.ModelSerializer):
-    """Encapsulates a serializer that can serialize or deserialize a User with limited details."""
+    """Encapsulates a serializer that can serialize or deserialize a User with limited details.
+    Fields other than viewer_fields are cached in profile cards (see cards.py), so they mustn't depend on the
+    context. Without a request in the context, as in every view, thumbnail URLs don't depend on it."""
+    card_name = 'simple'
+    viewer_fields = ('connection_status', 'user_status')
+
     user_status = serializers.SerializerMethodField()  # the user's enrolment status in a module
     connection_status = serializers.SerializerMethodField()  # the user's connection status with request.user
     thumbnail_pic = serializers.ImageField(read_only=True, use_url=True, required=False, allow_empty_file=True)
@@ -34,22 +50,69 @@ class SimpleUserSerializer(serializers.ModelSerializer):
             'major',
             'year',
         ]
+        list_serializer_class = ProfileCardListSerializer
+
+    def to_representation(self, instance):
+        return self.merge_viewer_fields(instance, self.get_cards([instance])[instance.id])
+
+    def get_cards(self, users):
+        # Fetched by async views, as the cache can't be read synchronously on the event loop
+        cards = self.context.get('profile_cards')
+        if cards is not None:
+            return cards
+        return get_profile_cards(self, users)
+
+    def to_card(self, instance):
+        return self.represent(instance, lambda field_name: field_name not in self.viewer_fields)
+
+    def merge_viewer_fields(self, instance, card):
+        """Returns the representation of instance from its card, with the fields for this viewer added."""
+
+        viewer_data = self.represent(instance, lambda field_name: field_name in self.viewer_fields)
+        return {
+            field.field_name: viewer_data[field.field_name] if field.field_name in viewer_data else card[field.field_name]
+            for field in self._readable_fields
+        }
+
+    def represent(self, instance, include):
+        # As ModelSerializer.to_representation(), for the fields whose names include() accepts.
+        data = {}
+        for field in self._readable_fields:
+            if include(field.field_name):
+                attribute = field.get_attribute(instance)
+                data[field.field_name] = None if attribute is None else field.to_representation(attribute)
+        return data
 
     def get_user_status(self, obj):
-        module_code = self.context.get('module_code')
-        enrolment = Enrolment.objects.get(user=obj, module__module_code__iexact=module_code)
-        return User_Status[enrolment.status].value
+        # Annotated by User.objects.enrolled_in()
+        if hasattr(obj, 'module_enrolment_status'):
+            enrolment_status = obj.module_enrolment_status
+        else:
+            module_code = self.context.get('module_code')
+            enrolment = Enrolment.objects.filter(user=obj, module__in=Module.objects.with_code(module_code)).first()
+            enrolment_status = enrolment.status if enrolment else None
+
+        if enrolment_status is None:
+            return User_Status.NL.value
+        return User_Status[enrolment_status].value
         
     def get_connection_status(self, obj):
+        # Annotated by User.objects.with_connection_status()
+        if hasattr(obj, 'viewer_connection_status'):
+            if obj.viewer_connection_status is None:
+                return 0
+            return Connection_Status[obj.viewer_connection_status].value
+
         user = self.context.get('user')
 
         if user is None:
             return 0
 
-        return obj.get_connection_status_with(user)
+        return user.get_connection_status_with(obj)
 
 class PrivateUserSerializer(SimpleUserSerializer):
     """Encapsulates a serializer that can serialize or deserialize a User with contact details."""
+    card_name = 'private'
     profile_pic = serializers.ImageField(read_only=True, use_url=True, required=False, allow_empty_file=True)
 
     class Meta:
@@ -67,9 +130,11 @@ class PrivateUserSerializer(SimpleUserSerializer):
             'phone_number', 
             'bio',
         ]
+        list_serializer_class = ProfileCardListSerializer
 
 class UserSerializer(PrivateUserSerializer):
     """Encapsulates a serializer that can serialize or deserialize a User without contact details."""
+    card_name = 'public'
     nus_email = serializers.SerializerMethodField()
     telegram_id = serializers.SerializerMethodField()
     phone_number = serializers.SerializerMethodField()
@@ -89,6 +154,7 @@ class UserSerializer(PrivateUserSerializer):
             'phone_number', 
             'bio',
         ]
+        list_serializer_class = ProfileCardListSerializer
     
     def get_nus_email(self, obj):
         return ''
@@ -106,16 +172,42 @@ class ProfilePictureSerializer(serializers.ModelSerializer):
         model = User
         fields = ['profile_pic',]
 
+class ConnectionListSerializer(serializers.ListSerializer):
+    """Serializes a list of connections with one cache lookup for the cards of all of the other users."""
+
+    def to_representation(self, data):
+        connections = list(data.all() if isinstance(data, models.Manager) else data)
+        user = self.context.get('user')
+        other_users = [self.child.get_other_user_side(connection, user)[0] for connection in connections]
+        self.profile_cards = SimpleUserSerializer(context={'profile_cards': self.context.get('profile_cards')}).get_cards(other_users)
+        return super().to_representation(connections)
+
 class ConnectionSerializer(serializers.Serializer):
     id = serializers.IntegerField()
     module = ModuleSerializer()
     other_user = serializers.SerializerMethodField()
 
+    class Meta:
+        list_serializer_class = ConnectionListSerializer
+
+    def get_other_user_side(self, obj, user):
+        if obj.requester_id == user.id:
+            return obj.accepter, 'accepter'
+        return obj.requester, 'requester'
+
     def get_other_user(self, obj):
         user = self.context.get('user')
-        if obj.requester == user:
-            other_user = obj.accepter
-        else:
-            other_user = obj.requester
-        return SimpleUserSerializer(other_user, context={'user': user, 'module_code': obj.module.module_code}).data
+        other_user, other_user_side = self.get_other_user_side(obj, user)
+
+        # Annotated by Connection.objects.with_enrolment_statuses()
+        if hasattr(obj, f'{other_user_side}_enrolment_status'):
+            other_user.module_enrolment_status = getattr(obj, f'{other_user_side}_enrolment_status')
+            other_user.viewer_connection_status = obj.status
+
+        serializer = SimpleUserSerializer(context={'user': user, 'module_code': obj.module.module_code})
+        # Fetched by ConnectionListSerializer
+        profile_cards = getattr(self.parent, 'profile_cards', None)
+        if profile_cards is not None:
+            return serializer.merge_viewer_fields(other_user, profile_cards[other_user.id])
+        return serializer.to_representation(other_user)
     
\ No newline at end of file
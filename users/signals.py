@@ -0,0 +1,46 @@
+from collections import Counter
+
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .authentication import forget_authenticated_user
+from .models import (
+    Connection, ConnectionTombstone, Enrolment, User, invalidate_connection_statuses, notify_connection_changes, update_enrolment_counts,
+)
+from .recommendations import record_enrolment_changes
+
+@receiver(post_save, sender=Connection)
+@receiver(post_delete, sender=Connection)
+def connection_changed(sender, instance, **kwargs):
+    invalidate_connection_statuses(instance.requester_id, instance.accepter_id)
+    notify_connection_changes(instance.requester_id, instance.accepter_id)
+
+    # Users loaded along with the connection may be the ones used for the rest of the request.
+    for field in ('requester', 'accepter'):
+        if Connection._meta.get_field(field).is_cached(instance):
+            getattr(instance, field).forget_connection_statuses()
+
+@receiver(post_delete, sender=Connection)
+def connection_deleted(sender, instance, **kwargs):
+    ConnectionTombstone.objects.create(connection_id=instance.id, requester_id=instance.requester_id, accepter_id=instance.accepter_id)
+
+@receiver(post_save, sender=Enrolment)
+def enrolment_saved(sender, instance, created, **kwargs):
+    if created:
+        record_enrolment_changes([(instance.user_id, instance.module_id, True)])
+        update_enrolment_counts(Counter({(instance.module_id, instance.status): 1}))
+    else:
+        loaded_status = getattr(instance, '_loaded_status', None)
+        if loaded_status is not None and loaded_status != instance.status:
+            update_enrolment_counts(Counter({(instance.module_id, loaded_status): -1, (instance.module_id, instance.status): 1}))
+    instance._loaded_status = instance.status
+
+@receiver(post_delete, sender=Enrolment)
+def enrolment_deleted(sender, instance, **kwargs):
+    record_enrolment_changes([(instance.user_id, instance.module_id, False)])
+    update_enrolment_counts(Counter({(instance.module_id, getattr(instance, '_loaded_status', None) or instance.status): -1}))
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def user_changed(sender, instance, **kwargs):
+    forget_authenticated_user(instance.id)
@@ -1,3 +1,619 @@
-from django.test import TestCase
+import asyncio
+import json
+import os
+import shutil
+import tempfile
+from io import BytesIO, StringIO
+from unittest import mock
+from urllib.parse import quote
 
-# Create your tests here.
+from datetime import timedelta
+from smtplib import SMTPException
+
+from django.core import mail
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from PIL import Image
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from modules.models import Module
+from modwithme.events import event_broker
+from modwithme.pagination import encode_sync_token
+
+from .authentication import authenticated_user_cache_key, cache_user, forget_authenticated_user, get_cached_user
+from .models import (
+    Connection, Connection_Status, Enrolment, OutboxEmail, User, User_Status, VerificationCode, connection_events_channel,
+    connection_statuses_cache_key,
+)
+from . import otp
+from .otp import get_otp_store
+from .serializers import SimpleUserSerializer
+from .outbox import deliver_emails, queue_email
+
+class ProfileCardTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.module = Module.objects.create(module_code='CS1010', title='Programming Methodology')
+        self.alice = User.objects.create_user('e0000001@u.nus.edu', name='Alice')
+        self.bob = User.objects.create_user('e0000002@u.nus.edu', name='Bob')
+        self.carol = User.objects.create_user('e0000003@u.nus.edu', name='Carol')
+        for user in (self.alice, self.bob, self.carol):
+            Enrolment.objects.create(user=user, module=self.module)
+        Connection.objects.create(requester=self.alice, accepter=self.bob, module=self.module)
+
+    def get_bob(self, viewer):
+        client = APIClient()
+        client.force_authenticate(viewer)
+        response = client.get('/modules/CS1010/users')
+        return next(user for user in response.data if user['id'] == self.bob.id)
+
+    def test_viewer_fields_merged(self):
+        self.assertEqual(self.get_bob(self.alice)['connection_status'], Connection_Status.PD.value)
+
+        # Alice isn't on her own roster, so only her card isn't cached yet.
+        with mock.patch.object(SimpleUserSerializer, 'to_card', autospec=True, side_effect=SimpleUserSerializer.to_card) as to_card:
+            bob = self.get_bob(self.carol)
+        self.assertEqual([call.args[1].id for call in to_card.call_args_list], [self.alice.id])
+        self.assertEqual(list(bob), ['id', 'name', 'thumbnail_pic', 'connection_status', 'user_status', 'major', 'year'])
+        self.assertEqual(bob['name'], 'Bob')
+        self.assertEqual(bob['connection_status'], 0)
+
+    def test_dropped_on_save(self):
+        self.get_bob(self.alice)
+        self.bob.name = 'Robert'
+        self.bob.save()
+        self.assertEqual(self.get_bob(self.alice)['name'], 'Robert')
+
+        client = APIClient()
+        client.force_authenticate(self.alice)
+        self.assertEqual(client.get('/user/connections').data[0]['other_user']['name'], 'Robert')
+        self.assertEqual(client.get(f'/user/{self.bob.id}').data['name'], 'Robert')
+
+    def test_user_loaded_before_save_does_not_cache_for_after(self):
+        stale_bob = User.objects.get(id=self.bob.id)
+        self.bob.name = 'Robert'
+        self.bob.save(update_fields=['name'])
+        # As a roster request that loaded Bob before the save would, after it
+        self.assertEqual(SimpleUserSerializer([stale_bob], many=True, context={'module_code': 'CS1010'}).data[0]['name'], 'Bob')
+
+        self.assertEqual(self.get_bob(self.alice)['name'], 'Robert')
+
+class UserConnectionViewTest(TestCase):
+    def setUp(self):
+        self.module = Module.objects.create(module_code='CS1010', title='Programming Methodology')
+        self.user = User.objects.create_user('e0000001@u.nus.edu', name='Alice')
+        Enrolment.objects.create(user=self.user, module=self.module)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def create_connections(self, count):
+        start = User.objects.count()
+        for i in range(start, start + count):
+            other_user = User.objects.create_user(f'e{i + 1:07d}@u.nus.edu', name=f'Student {i}')
+            Enrolment.objects.create(user=other_user, module=self.module, status=Enrolment.WILLING)
+            if i % 2 == 0:
+                Connection.objects.create(requester=self.user, accepter=other_user, module=self.module)
+            else:
+                Connection.objects.create(requester=other_user, accepter=self.user, module=self.module, status=Connection.ACCEPTED)
+
+    def test_other_user(self):
+        self.create_connections(2)
+        response = self.client.get('/user/connections')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data), 2)
+        for connection in response.data:
+            self.assertTrue(connection['module']['is_enrolled'])
+            self.assertEqual(connection['other_user']['user_status'], User_Status.WH.value)
+        self.assertCountEqual(
+            [c['other_user']['connection_status'] for c in response.data],
+            [Connection_Status.PD.value, Connection_Status.AC.value],
+        )
+
+    def test_query_count_does_not_grow_with_inbox(self):
+        self.create_connections(2)
+        with self.assertNumQueries(2):
+            self.client.get('/user/connections')
+
+        self.create_connections(20)
+        with self.assertNumQueries(2):
+            response = self.client.get('/user/connections')
+        self.assertEqual(len(response.data), 22)
+
+    def test_cursor_pagination(self):
+        self.create_connections(25)
+        response = self.client.get('/user/connections', {'cursor': ''})
+        self.assertEqual(len(response.data['results']), 20)
+        self.assertIn('sync_token', response.data)
+        response = self.client.get(response.data['next'])
+        self.assertEqual(len(response.data['results']), 5)
+        self.assertIsNone(response.data['next'])
+        self.assertNotIn('sync_token', response.data)
+
+    def test_sync_changes(self):
+        self.create_connections(3)
+        incoming = Connection.objects.filter(accepter=self.user).order_by('id').first()
+        outgoing = Connection.objects.filter(requester=self.user).order_by('id').first()
+        sync_token = self.client.get('/user/connections', {'cursor': ''}).data['sync_token']
+
+        response = self.client.get('/user/connections', {'since': sync_token})
+        self.assertEqual((response.data['changed'], response.data['removed']), ([], []))
+
+        self.client.put('/user/connections', {'id': outgoing.id, 'status': Connection_Status.RJ.value})
+        self.client.put('/user/connections', {'id': incoming.id, 'status': Connection_Status.PD.value})
+        response = self.client.get('/user/connections', {'since': sync_token})
+        self.assertEqual([c['id'] for c in response.data['changed']], [incoming.id])
+        self.assertEqual(response.data['removed'], [outgoing.id])
+
+        response = self.client.get('/user/connections', {'since': response.data['sync_token']})
+        self.assertEqual((response.data['changed'], response.data['removed']), ([], []))
+
+        self.assertEqual(self.client.get('/user/connections', {'since': 'yesterday'}).status_code, 400)
+        self.assertEqual(self.client.get('/user/connections', {'since': '2000-01-01T00:00:00Z'}).status_code, 410)
+
+    def test_bulk_connection_requests(self):
+        self.create_connections(2)
+        connected = [c.requester_id if c.accepter_id == self.user.id else c.accepter_id for c in Connection.objects.all()]
+        new_users = [User.objects.create_user(f'e{i:07d}@u.nus.edu', name=f'New {i}') for i in range(100, 103)]
+        other_users = [new_users[0].id, connected[0], self.user.id, new_users[1].id, 999999, new_users[2].id, new_users[0].id]
+
+        with self.assertNumQueries(8):
+            response = self.client.post('/user/connections/bulk', {'module_code': 'cs1010', 'other_users': other_users}, format='json')
+        self.assertEqual(response.status_code, 200)
+        results = response.data['results']
+        self.assertEqual([r['other_user'] for r in results], other_users[:-1])
+        self.assertEqual([r['result'] for r in results], ['created', 'skipped', 'skipped', 'created', 'skipped', 'created'])
+        self.assertEqual(results[0]['connection']['other_user']['id'], new_users[0].id)
+        self.assertTrue(results[0]['connection']['module']['is_enrolled'])
+
+        self.assertEqual(Connection.objects.filter(requester=self.user, accepter__in=new_users, status='PD').count(), 3)
+        self.assertEqual(self.user.get_connection_status_with(new_users[1]), Connection_Status.PD.value)
+        response = self.client.post('/user/connections/bulk', {'module_code': 'CS1010', 'other_users': [new_users[2].id]}, format='json')
+        self.assertEqual(response.data['results'][0]['result'], 'skipped')
+
+        self.assertEqual(self.client.post('/user/connections/bulk', {'module_code': 'CS9999', 'other_users': [1]}, format='json').status_code, 400)
+        self.assertEqual(self.client.post('/user/connections/bulk', {'module_code': 'CS1010'}, format='json').status_code, 400)
+
+class BatchEnrollViewTest(TestCase):
+    def setUp(self):
+        self.modules = [Module.objects.create(module_code=f'CS10{i}0', title=f'Module {i}') for i in range(5)]
+        self.user = User.objects.create_user('e0000001@u.nus.edu', name='Alice')
+        Enrolment.objects.create(user=self.user, module=self.modules[0])
+        Enrolment.objects.create(user=self.user, module=self.modules[1])
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_batch_enrol_and_unenrol(self):
+        data = {'add': ['cs1020', 'CS1030', 'CS1000', 'CS9999'], 'remove': ['CS1010', 'CS1040']}
+        with self.assertNumQueries(9):
+            response = self.client.post('/user/modules/enroll/batch', data, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([(r['module_code'], r['result']) for r in response.data['results']], [
+            ('CS1020', 'enrolled'), ('CS1030', 'enrolled'), ('CS1000', 'skipped'), ('CS9999', 'skipped'),
+            ('CS1010', 'unenrolled'), ('CS1040', 'skipped'),
+        ])
+        self.assertCountEqual(
+            Enrolment.objects.filter(user=self.user).values_list('module__module_code', flat=True), ['CS1000', 'CS1020', 'CS1030'])
+
+        response = self.client.post('/user/modules/enroll/batch', {'add': ['CS1040'], 'remove': ['cs1040']}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+@override_settings(BACKGROUND_TASKS_EAGER=True)
+class ThumbnailTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.media_root = tempfile.mkdtemp()
+        cls.media_override = override_settings(MEDIA_ROOT=cls.media_root)
+        cls.media_override.enable()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.media_override.disable()
+        shutil.rmtree(cls.media_root, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        self.user = User.objects.create_user('e0000001@u.nus.edu', name='Alice')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def upload_picture(self, name='me.png'):
+        image = BytesIO()
+        Image.new('RGB', (400, 300), 'blue').save(image, 'PNG')
+        picture = SimpleUploadedFile(name, image.getvalue(), content_type='image/png')
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post('/user/picture', {'profile_pic': picture}, format='multipart')
+
+    def test_thumbnail_generated_after_upload(self):
+        response = self.upload_picture()
+        self.assertEqual(response.status_code, 200)
+
+        user = User.objects.get(id=self.user.id)
+        self.assertTrue(user.thumbnail_pic.name.endswith('_thumb.png'))
+        with Image.open(user.thumbnail_pic) as thumbnail:
+            self.assertEqual(thumbnail.size, (100, 75))
+
+    def test_save_without_new_picture_does_no_image_io(self):
+        self.upload_picture()
+        user = User.objects.get(id=self.user.id)
+        thumbnail_name = user.thumbnail_pic.name
+
+        with mock.patch('users.models.Image.open') as image_open, \
+                mock.patch.object(user.profile_pic.storage, 'save') as storage_save, \
+                self.captureOnCommitCallbacks(execute=True) as callbacks:
+            user.is_verified = True
+            user.save()
+            user.name = 'Alice Tan'
+            user.save()
+
+        image_open.assert_not_called()
+        storage_save.assert_not_called()
+        self.assertEqual(callbacks, [])
+        self.assertEqual(User.objects.get(id=self.user.id).thumbnail_pic.name, thumbnail_name)
+
+    def test_profile_edit_through_stale_user_keeps_thumbnail(self):
+        # As authenticated from a copy cached before the picture was uploaded
+        stale_user = User.objects.get(id=self.user.id)
+        self.upload_picture()
+        thumbnail_name = User.objects.get(id=self.user.id).thumbnail_pic.name
+        self.assertTrue(thumbnail_name)
+
+        self.client.force_authenticate(stale_user)
+        profile = {'name': 'Alicia', 'nus_email': 'e0000001@u.nus.edu', 'telegram_id': '', 'phone_number': '', 'major': 'Computer Science', 'year': 1, 'bio': 'Hi'}
+        self.assertEqual(self.client.put('/user', profile).status_code, 200)
+
+        user = User.objects.get(id=self.user.id)
+        self.assertEqual(user.bio, 'Hi')
+        self.assertEqual(user.thumbnail_pic.name, thumbnail_name)
+
+    def test_removing_picture_clears_thumbnail(self):
+        self.upload_picture()
+        self.client.delete('/user/picture')
+        user = User.objects.get(id=self.user.id)
+        self.assertFalse(user.profile_pic)
+        self.assertFalse(user.thumbnail_pic)
+
+    def test_media_served_with_validators_and_ranges(self):
+        self.upload_picture()
+        user = User.objects.get(id=self.user.id)
+        url = user.profile_pic.url
+        size = user.profile_pic.size
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertEqual(int(response['Content-Length']), size)
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        etag = response['ETag']
+
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 304)
+
+        response = self.client.get(url, HTTP_RANGE='bytes=0-9')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 0-9/{size}')
+        self.assertEqual(len(b''.join(response.streaming_content)), 10)
+        response = self.client.get(url, HTTP_RANGE='bytes=-4')
+        self.assertEqual(response['Content-Range'], f'bytes {size - 4}-{size - 1}/{size}')
+        self.assertEqual(self.client.get(url, HTTP_RANGE=f'bytes={size}-').status_code, 416)
+        # A range of a different version of the file gets the whole file
+        self.assertEqual(self.client.get(url, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"stale"').status_code, 200)
+
+        self.assertEqual(self.client.get('/media/user/../../settings.py').status_code, 400)
+        self.assertEqual(self.client.get(f'/media/user/{user.id}/missing.png').status_code, 404)
+
+    @override_settings(MEDIA_SENDFILE_HEADER='X-Accel-Redirect')
+    def test_media_offloaded_to_web_server(self):
+        self.upload_picture()
+        user = User.objects.get(id=self.user.id)
+        response = self.client.get(user.thumbnail_pic.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Accel-Redirect'], f'/protected-media/{user.thumbnail_pic.name}')
+        self.assertEqual(response.content, b'')
+
+        name = f'user/{user.id}/my photo?50% café.png'
+        with open(os.path.join(self.media_root, name), 'wb') as f:
+            f.write(b'picture')
+        response = self.client.get(f'/media/{quote(name)}')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Accel-Redirect'], f'/protected-media/user/{user.id}/my%20photo%3F50%25%20caf%C3%A9.png')
+
+    def test_uploads_get_new_names(self):
+        self.upload_picture()
+        first_name = User.objects.get(id=self.user.id).profile_pic.name
+        self.upload_picture()
+        user = User.objects.get(id=self.user.id)
+        self.assertNotEqual(user.profile_pic.name, first_name)
+        self.assertRegex(user.profile_pic.name, rf'^user/{user.id}/me-[0-9a-f]{{16}}\.png$')
+        self.assertEqual(user.thumbnail_pic.name, user.profile_pic.name[:-len('.png')] + '_thumb.png')
+
+@override_settings(CONNECTION_STATUS_CACHE_TIMEOUT=300)
+class ConnectionStatusCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.module = Module.objects.create(module_code='CS1010', title='Programming Methodology')
+        self.alice = User.objects.create_user('e0000001@u.nus.edu', name='Alice')
+        self.bob = User.objects.create_user('e0000002@u.nus.edu', name='Bob')
+        self.connection = Connection.objects.create(requester=self.alice, accepter=self.bob, module=self.module)
+
+    def test_statuses_loaded_once(self):
+        alice = User.objects.get(id=self.alice.id)
+        with self.assertNumQueries(1):
+            self.assertEqual(alice.get_connection_status_with(self.bob), Connection_Status.PD.value)
+            self.assertFalse(alice.is_connected(self.bob))
+
+        alice = User.objects.get(id=self.alice.id)
+        with self.assertNumQueries(0):
+            self.assertEqual(alice.get_connection_status_with(self.bob), Connection_Status.PD.value)
+
+    def test_invalidated_on_status_update(self):
+        self.assertEqual(User.objects.get(id=self.alice.id).get_connection_status_with(self.bob), Connection_Status.PD.value)
+
+        client = APIClient()
+        client.force_authenticate(self.bob)
+        response = client.put('/user/connections', {'id': self.connection.id, 'status': Connection_Status.AC.value}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(User.objects.get(id=self.alice.id).is_connected(self.bob))
+
+        response = client.get(f'/user/{self.alice.id}')
+        self.assertEqual(response.data['nus_email'], self.alice.nus_email)
+
+    def test_invalidated_on_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                self.connection.status = Connection.ACCEPTED
+                self.connection.save()
+                # As another request would, reading the committed connection before this transaction commits
+                cache.set(connection_statuses_cache_key(self.alice.id), {self.bob.id: Connection_Status.PD.value})
+        self.assertTrue(User.objects.get(id=self.alice.id).is_connected(self.bob))
+
+    def test_invalidated_on_delete(self):
+        self.assertEqual(User.objects.get(id=self.bob.id).get_connection_status_with(self.alice), Connection_Status.PD.value)
+        self.connection.delete()
+        self.assertEqual(User.objects.get(id=self.bob.id).get_connection_status_with(self.alice), 0)
+
+@override_settings(BACKGROUND_TASKS_EAGER=True, EMAIL_OUTBOX_MAX_ATTEMPTS=2)
+class EmailOutboxTest(TestCase):
+    def test_otp_is_sent_after_the_response(self):
+        User.objects.create_user('e0000001@u.nus.edu', name='Alice')
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = APIClient().post('/otp/send', {'nus_email': 'e0000001@u.nus.edu'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(mail.outbox), 0)
+
+        for callback in callbacks:
+            callback()
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['e0000001@u.nus.edu'])
+        self.assertEqual(OutboxEmail.objects.get().status, OutboxEmail.SENT)
+
+    def test_one_connection_for_many_emails(self):
+        for i in range(3):
+            queue_email('Subject', 'Body', 'reply.no@engineer.com', f'e{i:07d}@u.nus.edu')
+        with mock.patch('users.outbox.get_connection', wraps=mail.get_connection) as get_connection:
+            self.assertEqual(deliver_emails(), 3)
+        get_connection.assert_called_once()
+        self.assertEqual(len(mail.outbox), 3)
+
+    def test_retries_with_backoff(self):
+        email = queue_email('Subject', 'Body', 'reply.no@engineer.com', 'e0000001@u.nus.edu')
+        with mock.patch('django.core.mail.EmailMessage.send', side_effect=SMTPException('Unavailable')), \
+                self.assertLogs('users.outbox', 'WARNING'):
+            deliver_emails()
+            email.refresh_from_db()
+            self.assertEqual((email.status, email.attempts, email.last_error), (OutboxEmail.PENDING, 1, 'SMTPException: Unavailable'))
+            self.assertGreater(email.next_attempt_at, email.creation_time + timedelta(seconds=25))
+
+            # Not due again yet
+            self.assertEqual(deliver_emails(), 0)
+            OutboxEmail.objects.update(next_attempt_at=email.creation_time)
+            deliver_emails()
+            email.refresh_from_db()
+            self.assertEqual((email.status, email.attempts), (OutboxEmail.FAILED, 2))
+        self.assertEqual(len(mail.outbox), 0)
+
+@override_settings(BACKGROUND_TASKS_EAGER=True)
+class OtpTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('e0000001@u.nus.edu', name='Alice')
+        self.client = APIClient()
+
+    def send_otp(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/otp/send', {'nus_email': self.user.nus_email})
+        return response, mail.outbox[-1].body.split()[-1] if mail.outbox else None
+
+    def verify_otp(self, code):
+        return self.client.post('/otp/verify', {'nus_email': self.user.nus_email, 'otp': code}).data
+
+    def check_flow(self, expire):
+        response, code = self.send_otp()
+        self.assertIsNone(response.data)
+        response, _ = self.send_otp()
+        self.assertEqual(response.data['error_code'], 1)
+        self.assertEqual(len(mail.outbox), 1)
+
+        wrong_code = '000000' if code != '000000' else '111111'
+        self.assertEqual(self.verify_otp(wrong_code)['error_code'], 1)
+        expire()
+        self.assertEqual(self.verify_otp(code)['error_code'], 2)
+
+        response, code = self.send_otp()
+        self.assertIsNone(response.data)
+        self.assertIn('access', self.verify_otp(code))
+        self.assertTrue(User.objects.get(id=self.user.id).is_verified)
+
+    @override_settings(OTP_STORE='cache')
+    def test_cache_store(self):
+        def expire():
+            cache.delete_many([f'otp:{self.user.id}', f'otp-resend:{self.user.id}'])
+
+        with self.assertNumQueries(0):
+            self.assertIsNotNone(get_otp_store().issue(User(id=999, nus_email='e0000999@u.nus.edu')))
+        self.check_flow(expire)
+        self.assertFalse(VerificationCode.objects.exists())
+
+    @override_settings(OTP_STORE='cache')
+    def test_cache_store_code_used_once(self):
+        store = get_otp_store()
+        code = store.issue(self.user)
+        # Both verifications read the code before either deletes it.
+        with mock.patch.object(cache, 'get', return_value=code):
+            self.assertEqual(store.verify(self.user, code), otp.VERIFIED)
+            self.assertEqual(store.verify(self.user, code), otp.EXPIRED)
+
+    @override_settings(OTP_STORE='database')
+    def test_database_store(self):
+        def expire():
+            VerificationCode.objects.update(creation_time=timezone.now() - timedelta(seconds=600))
+
+        self.check_flow(expire)
+        self.assertFalse(VerificationCode.objects.exists())
+
+@override_settings(AUTHENTICATED_USER_CACHE_TIMEOUT=60)
+class CachedJWTAuthenticationTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('e0000001@u.nus.edu', name='Alice')
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.user).access_token}')
+
+    def test_user_is_cached_until_changed(self):
+        with self.assertNumQueries(1):
+            self.client.get('/user')
+        with self.assertNumQueries(0):
+            response = self.client.get('/user')
+        self.assertEqual(response.data['name'], 'Alice')
+
+        profile = {'name': 'Alicia', 'nus_email': 'e0000001@u.nus.edu', 'telegram_id': '', 'phone_number': '', 'major': 'Computer Science', 'year': 1, 'bio': ''}
+        self.assertEqual(self.client.put('/user', profile).status_code, 200)
+        self.assertEqual(self.client.get('/user').data['name'], 'Alicia')
+
+        self.user.refresh_from_db()
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get('/user').status_code, 401)
+
+    def test_password_is_not_cached(self):
+        self.user.set_password('Secret-password-1')
+        self.user.save()
+        self.client.get('/user')
+
+        entry = cache.get(authenticated_user_cache_key(self.user.id))
+        self.assertIsNotNone(entry)
+        self.assertNotIn(self.user.password, entry[1])
+        cached, _ = get_cached_user(self.user.id)
+        self.assertEqual((cached.id, cached.name, cached.card_version), (self.user.id, self.user.name, self.user.card_version))
+        self.assertIn('password', cached.get_deferred_fields())
+
+    def test_user_loaded_before_change_is_not_cached(self):
+        stale_user = User.objects.get(id=self.user.id)
+        _, generation = get_cached_user(self.user.id)
+        # Saved by another request between this one's loading and caching the user
+        User.objects.filter(id=self.user.id).update(name='Alicia')
+        forget_authenticated_user(self.user.id)
+        cache_user(stale_user, generation)
+
+        with self.assertNumQueries(1):
+            response = self.client.get('/user')
+        self.assertEqual(response.data['name'], 'Alicia')
+
+class ConnectionEventsTest(TestCase):
+    def setUp(self):
+        self.module = Module.objects.create(module_code='CS1010', title='Programming Methodology')
+        self.user = User.objects.create_user('e0000001@u.nus.edu', name='Alice')
+        self.other_user = User.objects.create_user('e0000002@u.nus.edu', name='Bob')
+        self.authorization = f'Bearer {RefreshToken.for_user(self.user).access_token}'
+
+    async def poll(self, since, timeout):
+        response = await self.async_client.get(
+            '/async/user/connections/events', {'since': since, 'timeout': timeout}, authorization=self.authorization)
+        return response.status_code, response.json()
+
+    async def test_long_poll(self):
+        sync_token = encode_sync_token(timezone.now())
+        status_code, data = await self.poll(sync_token, 0.01)
+        self.assertEqual(status_code, 200)
+        self.assertEqual((data['changed'], data['removed']), ([], []))
+
+        # Woken by a new request to the user
+        poll = asyncio.create_task(self.poll(sync_token, 10))
+        await asyncio.sleep(0.1)
+        self.assertFalse(poll.done())
+        connection = await Connection.objects.acreate(requester=self.other_user, accepter=self.user, module=self.module)
+        event_broker.publish(connection_events_channel(self.user.id))
+        status_code, data = await asyncio.wait_for(poll, 5)
+        self.assertEqual([c['id'] for c in data['changed']], [connection.id])
+
+        # Changes already made are returned without waiting
+        status_code, data = await asyncio.wait_for(self.poll(sync_token, 10), 5)
+        self.assertEqual(len(data['changed']), 1)
+
+        status_code, data = await self.poll('yesterday', 1)
+        self.assertEqual(status_code, 400)
+
+    def test_changes_publish_events(self):
+        with mock.patch('users.models.publish_on_commit') as publish_on_commit:
+            connection = Connection.objects.create(requester=self.other_user, accepter=self.user, module=self.module)
+        publish_on_commit.assert_called_with(f'connections:{self.other_user.id}', f'connections:{self.user.id}')
+
+        client = APIClient()
+        client.force_authenticate(self.user)
+        with mock.patch('users.models.publish_on_commit') as publish_on_commit:
+            client.put('/user/connections', {'id': connection.id, 'status': Connection_Status.AC.value})
+        publish_on_commit.assert_called_with(f'connections:{self.other_user.id}', f'connections:{self.user.id}')
+
+class DuplicateTest(TestCase):
+    def setUp(self):
+        self.module = Module.objects.create(module_code='CS1010', title='Programming Methodology')
+        self.alice = User.objects.create_user('e0000001@u.nus.edu', name='Alice')
+        self.bob = User.objects.create_user('e0000002@u.nus.edu', name='Bob')
+
+    def test_enrol_twice(self):
+        client = APIClient()
+        client.force_authenticate(self.alice)
+        response = client.post('/user/modules/enroll', {'module_code': 'cs1010'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        response = client.post('/user/modules/enroll', {'module_code': 'CS1010'}, format='json')
+        self.assertEqual(response.status_code, 405)
+        self.assertEqual(Enrolment.objects.count(), 1)
+
+    def test_connect_twice(self):
+        client = APIClient()
+        client.force_authenticate(self.alice)
+        response = client.post('/user/connections', {'module_code': 'CS1010', 'other_user': self.bob.id}, format='json')
+        self.assertEqual(response.status_code, 200)
+
+        client.force_authenticate(self.bob)
+        response = client.post('/user/connections', {'module_code': 'CS1010', 'other_user': self.alice.id}, format='json')
+        self.assertEqual(response.status_code, 405)
+
+        response = client.post('/user/connections', {'module_code': 'CS1010', 'other_user': self.bob.id}, format='json')
+        self.assertEqual(response.status_code, 405)
+        self.assertEqual(Connection.objects.count(), 1)
+
+class BenchmarkQueriesTest(TransactionTestCase):
+    def test_runs_against_current_schema(self):
+        # In the test database, instead of a throwaway one
+        output = tempfile.NamedTemporaryFile(suffix='.json', delete=False)
+        self.addCleanup(os.remove, output.name)
+        with mock.patch.object(connection.creation, 'create_test_db'), mock.patch.object(connection.creation, 'destroy_test_db'):
+            call_command('benchmark_queries', '--modules=5', '--users=10', '--enrolments=20', '--connections=10', '--repeat=1',
+                         f'--output={output.name}', stdout=StringIO())
+
+        with open(output.name) as f:
+            results = json.load(f)
+        self.assertEqual(results['before'].keys(), results['after'].keys())
+        self.assertIn('module_roster', results['after'])
+        # The indexes and constraints are back afterwards.
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(cursor, Enrolment._meta.db_table)
+        self.assertIn('unique_enrolment', constraints)
+        self.assertIn('enrolment_roster_idx', constraints)
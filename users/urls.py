@@ -15,6 +15,14 @@ urlpatterns = [
     re_path('user/picture/?$', views.ProfilePictureView.as_view(), name='profile_picture'),
     re_path(r'user/(?P<id>\d+)/?$', views.StudentDetailView.as_view(), name='student_detail'),
     re_path('user/modules/enroll/?$', views.StudentEnrollView.as_view(), name='enroll_module'),
+    re_path('user/modules/enroll/batch/?$', views.BatchEnrollView.as_view(), name='batch_enroll_modules'),
     re_path(r'user/modules/status/(?P<module_code>\w+)/?$', views.ModuleStatusView.as_view(), name='update_module_status'),
     re_path('user/connections/?$', views.UserConnectionView.as_view(), name='user_connections'),
-]
\ No newline at end of file
+    re_path('user/connections/bulk/?$', views.BulkConnectionView.as_view(), name='bulk_connections'),
+]
+# Served by ASGI workers under /async/
+async_urlpatterns = [
+    re_path(r'user/(?P<id>\d+)/?$', views.AsyncStudentDetailView.as_view(), name='async-student_detail'),
+    re_path('user/connections/?$', views.AsyncUserConnectionView.as_view(), name='async-user_connections'),
+    re_path('user/connections/events/?$', views.AsyncConnectionEventsView.as_view(), name='async-connection_events'),
+]
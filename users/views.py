@@ -1,7 +1,15 @@
+from asgiref.sync import sync_to_async
+from collections import Counter
+from datetime import timedelta
 from urllib import response
-from django.db.models import Q
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Q, Value
 from django.contrib.auth import authenticate
+from django.utils import timezone
 from rest_framework import permissions, status, generics
+from rest_framework.exceptions import ParseError
+from rest_framework.request import Request
 from rest_framework.response import Response
 from rest_framework.pagination import PageNumberPagination
 from rest_framework.parsers import MultiPartParser, FormParser
@@ -12,12 +20,27 @@ from rest_framework_simplejwt.tokens import RefreshToken
 
 from modules import serializers
 
-from .models import Connection_Status, User, VerificationCode, Enrolment, Connection
-from .serializers import ConnectionSerializer, RegisterSerializer, UserSerializer
+from .models import (
+    Connection_Status, User, Enrolment, Connection, ConnectionTombstone, connection_events_channel,
+    invalidate_connection_statuses, notify_connection_changes, update_enrolment_counts,
+)
+from .cards import aget_profile_cards
+from .serializers import ConnectionSerializer, RegisterSerializer, SimpleUserSerializer, UserSerializer
+from . import otp
+from .authentication import load_request_user
+from .otp import get_otp_store, send_code
 from .permissions import IsSelf
+from .recommendations import record_enrolment_changes
+from .search import name_matches
 from .serializers import RegisterSerializer, UserSerializer, PrivateUserSerializer, ProfilePictureSerializer
 from modules.serializers import ModuleSerializer
 from modules.models import Module
+from modules.search import search_modules
+from modwithme.asyncapi import AsyncAPIView, api_response, get_page, get_page_data
+from modwithme.events import event_broker
+from modwithme.pagination import (
+    ConnectionCursorPagination, ListCursorPagination, ModuleCursorPagination, decode_sync_token, encode_sync_token, is_cursor_request,
+)
 from modules.views import User_Status
 
 class RegisterView(generics.GenericAPIView):
@@ -43,8 +66,9 @@ class RegisterView(generics.GenericAPIView):
         serializer.is_valid(raise_exception=True)
         user = serializer.save()
 
-        verification_code = VerificationCode.objects.create(user=user)
-        verification_code.send()
+        code = get_otp_store().issue(user)
+        if code is not None:
+            send_code(user, code)
 
         return response
 
@@ -54,20 +78,21 @@ class OtpVerifyView(APIView):
         code = request.data.get('otp')
 
         user = User.objects.filter(nus_email=nus_email).first()
-        verification_code = VerificationCode.objects.filter(user__nus_email=nus_email, code=code).first()
 
         if user is None:
             response = Response()
             response['Access-Control-Allow-Origin'] = '*'
             return response
-        elif verification_code is None:
+
+        result = get_otp_store().verify(user, code)
+        if result == otp.WRONG:
             response = Response({
                 'error_code': 1,
                 'error_message': 'Wrong OTP.'
             })
             response['Access-Control-Allow-Origin'] = '*'
             return response
-        elif verification_code.is_expired():
+        elif result == otp.EXPIRED:
             response = Response({
                 'error_code': 2,
                 'error_message': 'OTP has expired.'
@@ -77,7 +102,6 @@ class OtpVerifyView(APIView):
         
         user.is_verified = True
         user.save()
-        verification_code.delete()
 
         refresh = RefreshToken.for_user(user)
         
@@ -92,25 +116,24 @@ class OtpSendView(APIView):
     def post(self, request, *args, **kwargs):
         nus_email = request.data.get('nus_email')
         user = User.objects.filter(nus_email=nus_email).first()
-        verification_code = VerificationCode.objects.filter(user__nus_email=nus_email).first()
         response = Response()
         response['Access-Control-Allow-Origin'] = '*'
 
         if not user or user.is_verified:
             return response
-        elif verification_code and not verification_code.can_resend():
-            remaining_time = round(verification_code.remaining_time_to_resend())
+
+        otp_store = get_otp_store()
+        code = otp_store.issue(user)
+        if code is None:
+            remaining_time = round(otp_store.remaining_time_to_resend(user))
             response = Response({
                 'error_code': 1,
                 'error_message': f'Please wait {remaining_time} seconds before re-sending the OTP.'
             })
             response['Access-Control-Allow-Origin'] = '*'
             return response
-        elif verification_code:
-            verification_code.delete()
-        
-        verification_code = VerificationCode.objects.create(user=user)
-        verification_code.send()
+
+        send_code(user, code)
 
         return response
 
@@ -144,18 +167,22 @@ class StudentModulesView(APIView):
 
     def get(self, request):
         search_query = request.query_params.get('q')
-        paginator = PageNumberPagination()
+        cursor = is_cursor_request(request)
         
-        enrolment = Enrolment.objects.filter(user__exact=request.user).select_related('module')
+        enrolment = Enrolment.objects.filter(user__exact=request.user)
 
-        modules = Module.objects.filter(id__in=enrolment.values('module'))
+        # Every module listed here is one the user is enrolled in.
+        modules = Module.objects.filter(id__in=enrolment.values('module')).annotate(is_enrolled=Value(True)).order_by('module_code')
 
         if search_query:
-            modules = modules.filter(Q(title__icontains=search_query) | Q(module_code__icontains=search_query))
-        
-        queryset = paginator.paginate_queryset(modules, request)
+            paginator = ListCursorPagination() if cursor else PageNumberPagination()
+            enrolled_module_ids = set(enrolment.values_list('module_id', flat=True))
+            queryset = search_modules(modules, search_query, paginator, request, within=enrolled_module_ids)
+        else:
+            paginator = ModuleCursorPagination() if cursor else PageNumberPagination()
+            queryset = paginator.paginate_queryset(modules, request)
         serializer = ModuleSerializer(queryset, many=True, context={'user': request.user})
-        response = Response(serializer.data)
+        response = paginator.get_paginated_response(serializer.data) if cursor else Response(serializer.data)
         response['Access-Control-Allow-Origin'] = '*'
         return response
 
@@ -170,7 +197,7 @@ class StudentSelfView(APIView):
         return response
 
     def put(self, request):
-        user = request.user
+        user = load_request_user(request)
         serializer = PrivateUserSerializer(user, data=request.data)
         if not serializer.is_valid():
             response = Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
@@ -202,6 +229,27 @@ class StudentDetailView(APIView):
         response['Access-Control-Allow-Origin'] = '*'
         return response
 
+class AsyncStudentDetailView(AsyncAPIView):
+    """StudentDetailView for ASGI servers."""
+
+    permission_classes = [permissions.IsAuthenticated]
+
+    async def get(self, request, id):
+        user = request.user
+        target_user = await User.objects.with_connection_status(user).filter(id=id).afirst()
+
+        if target_user is None:
+            return api_response("Invalid user id", status=status.HTTP_404_NOT_FOUND)
+        elif user.id == target_user.id:
+            serializer_class, target_user, context = PrivateUserSerializer, user, {}
+        elif target_user.viewer_connection_status == Connection.ACCEPTED:
+            serializer_class, context = PrivateUserSerializer, {'user': user}
+        else:
+            serializer_class, context = UserSerializer, {'user': user}
+        context['profile_cards'] = await aget_profile_cards(serializer_class(), [target_user])
+        serializer = serializer_class(target_user, context=context)
+        return api_response(serializer.data)
+
 class StudentEnrollView(generics.CreateAPIView):
     permission_classes = [permissions.IsAuthenticated]
 
@@ -213,18 +261,16 @@ class StudentEnrollView(generics.CreateAPIView):
         try:
             obj = data
             module_code = obj["module_code"]
-            module = Module.objects.get(module_code__iexact=module_code)
+            module = Module.objects.with_code(module_code).get()
             user_status = User_Status(0).name
 
-            print(Enrolment.objects.filter(user=user, module=module))
-
-            if Enrolment.objects.filter(user=user, module=module).exists():
+            try:
+                with transaction.atomic():
+                    Enrolment.objects.create(user=user, module=module, status=user_status)
+            except IntegrityError:
                 response = Response('User is already enrolled in this module', status=status.HTTP_405_METHOD_NOT_ALLOWED)
                 response['Access-Control-Allow-Origin'] = '*'
                 return response
-            
-            enrolment = Enrolment(user=user, module=module, status=user_status)
-            enrolment.save()
 
             response = Response("Successfully enrolled")
             response['Access-Control-Allow-Origin'] = '*'
@@ -243,7 +289,7 @@ class StudentEnrollView(generics.CreateAPIView):
         try:
             obj = data
             module_code = obj["module_code"]
-            module = Module.objects.get(module_code__iexact=module_code)
+            module = Module.objects.with_code(module_code).get()
 
             enrolment = Enrolment.objects.filter(user=user, module=module)
 
@@ -263,6 +309,81 @@ class StudentEnrollView(generics.CreateAPIView):
             response['Access-Control-Allow-Origin'] = '*'
             return response
 
+class BatchEnrollView(APIView):
+    """Enrols in the modules of the add list, and unenrols from those of the remove list, at once.
+    Returns whether each module was enrolled in, unenrolled from or skipped, in the order given."""
+
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request, format=None):
+        user = request.user
+        data = request.data
+
+        try:
+            add_codes = list(dict.fromkeys(str(module_code).upper() for module_code in data.get("add", [])))
+            remove_codes = list(dict.fromkeys(str(module_code).upper() for module_code in data.get("remove", [])))
+        except Exception as e:
+            print(e)
+            response = Response("Invalid request", status=status.HTTP_400_BAD_REQUEST)
+            response['Access-Control-Allow-Origin'] = '*'
+            return response
+
+        if len(add_codes) + len(remove_codes) > settings.BATCH_ENROLMENT_MAX_MODULES:
+            response = Response(f'At most {settings.BATCH_ENROLMENT_MAX_MODULES} modules can be changed at once.', status=status.HTTP_400_BAD_REQUEST)
+            response['Access-Control-Allow-Origin'] = '*'
+            return response
+        if set(add_codes) & set(remove_codes):
+            response = Response('A module cannot be both added and removed.', status=status.HTTP_400_BAD_REQUEST)
+            response['Access-Control-Allow-Origin'] = '*'
+            return response
+
+        modules = {module.module_code.upper(): module for module in Module.objects.with_codes(add_codes + remove_codes)}
+        try:
+            with transaction.atomic():
+                results = self.apply(user, modules, add_codes, remove_codes)
+        except IntegrityError:
+            # An enrolment was created concurrently, and is skipped the second time.
+            with transaction.atomic():
+                results = self.apply(user, modules, add_codes, remove_codes)
+
+        response = Response({'results': results})
+        response['Access-Control-Allow-Origin'] = '*'
+        return response
+
+    def apply(self, user, modules, add_codes, remove_codes):
+        enrolled_module_ids = set(Enrolment.objects.filter(user=user, module__in=modules.values()).values_list('module_id', flat=True))
+
+        results = []
+        enrolments = []
+        remove_module_ids = []
+        for module_code in add_codes:
+            module = modules.get(module_code)
+            if module is None:
+                results.append({'module_code': module_code, 'result': 'skipped', 'reason': 'No such module'})
+            elif module.id in enrolled_module_ids:
+                results.append({'module_code': module.module_code, 'result': 'skipped', 'reason': 'User is already enrolled in this module'})
+            else:
+                enrolments.append(Enrolment(user=user, module=module, status=User_Status(0).name))
+                results.append({'module_code': module.module_code, 'result': 'enrolled'})
+        for module_code in remove_codes:
+            module = modules.get(module_code)
+            if module is None:
+                results.append({'module_code': module_code, 'result': 'skipped', 'reason': 'No such module'})
+            elif module.id not in enrolled_module_ids:
+                results.append({'module_code': module.module_code, 'result': 'skipped', 'reason': 'User is not enrolled in this module'})
+            else:
+                remove_module_ids.append(module.id)
+                results.append({'module_code': module.module_code, 'result': 'unenrolled'})
+
+        Enrolment.objects.bulk_create(enrolments)
+        if remove_module_ids:
+            Enrolment.objects.filter(user=user, module_id__in=remove_module_ids).delete()
+        # bulk_create() doesn't send post_save, so the co-enrolment changes and enrolment counters are recorded here.
+        # Deletes send post_delete.
+        record_enrolment_changes((user.id, enrolment.module_id, True) for enrolment in enrolments)
+        update_enrolment_counts(Counter((enrolment.module_id, enrolment.status) for enrolment in enrolments))
+        return results
+
 class ModuleStatusView(APIView):
 
     permission_classes = [permissions.IsAuthenticated]
@@ -283,17 +404,21 @@ class ModuleStatusView(APIView):
 
         try:
             obj = data
-            module = Module.objects.get(module_code__iexact=module_code)
+            module = Module.objects.with_code(module_code).get()
             user_status = obj["status"]
             user_status = User_Status(user_status).name
             
-            enrolment = Enrolment.objects.filter(user=user, module=module)
-            if not enrolment.exists():
-                response = Response('User is not enrolled in this module', status=status.HTTP_405_METHOD_NOT_ALLOWED)
-                response['Access-Control-Allow-Origin'] = '*'
-                return response
-            
-            enrolment.update(status=user_status)
+            with transaction.atomic():
+                # Locked, so that concurrent changes of status are each counted from the status they changed.
+                enrolment = Enrolment.objects.select_for_update().filter(user=user, module=module).first()
+                if enrolment is None:
+                    response = Response('User is not enrolled in this module', status=status.HTTP_405_METHOD_NOT_ALLOWED)
+                    response['Access-Control-Allow-Origin'] = '*'
+                    return response
+
+                # Saved rather than updated, so that the module's enrolment counters follow the change.
+                enrolment.status = user_status
+                enrolment.save(update_fields=['status'])
 
             response = Response("Successfully updated status")
             response['Access-Control-Allow-Origin'] = '*'
@@ -316,7 +441,7 @@ class ProfilePictureView(APIView):
         return response
 
     def post(self, request):
-        user = request.user
+        user = load_request_user(request)
         serializer = ProfilePictureSerializer(user, data=request.data)
         if not serializer.is_valid():
             response = Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
@@ -329,44 +454,106 @@ class ProfilePictureView(APIView):
         return response
 
     def delete(self, request):
-        user = request.user
+        user = load_request_user(request)
         user.profile_pic = None
         user.save()
         response = Response()
         response['Access-Control-Allow-Origin'] = '*'
         return response
 
+def user_connections(user):
+    """Returns user's connections, with everything ConnectionSerializer needs loaded along with them."""
+
+    connections = Connection.objects.filter(Q(accepter=user) | Q(requester=user), ~Q(status=Connection_Status['RJ'].value))
+    return connections.select_related('requester', 'accepter', 'module').with_enrolment_statuses()
+
+def connection_changes(user, connections, since, context):
+    """Returns the connections created or changed, and the ids of those removed, since a time, along with the
+    sync token to get the next changes with. The type and q filters don't apply, as a connection may have changed out of them."""
+
+    sync_token = encode_sync_token(timezone.now())
+    changed = connections.filter(updated_at__gte=since).order_by('updated_at', 'id')
+    removed = ConnectionTombstone.objects.filter(Q(requester_id=user.id) | Q(accepter_id=user.id), deleted_at__gte=since)
+
+    serializer = ConnectionSerializer(changed, many=True, context=context)
+    return {
+        'changed': serializer.data,
+        'removed': list(removed.values_list('connection_id', flat=True)),
+        'sync_token': sync_token,
+    }
+
+def filter_connections(connections, user, params):
+    type = params.get('type')
+    query = params.get('q')
+
+    if type and type == '0':
+        connections = connections.filter(accepter=user, status='PD')
+    elif type and type == '1':
+        connections = connections.filter(requester=user, status='PD')
+    elif type and type == '2':
+        connections = connections.filter(status='AC')
+
+    if query:
+        connections = connections.filter(Q(requester=user) & name_matches(query, 'accepter__search_name') |
+                                         Q(accepter=user) & name_matches(query, 'requester__search_name') |
+                                         Q(module__module_code__icontains=query) |
+                                         Q(module__title__icontains=query))
+    return connections
+
 class UserConnectionView(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def get(self, request):
         user = request.user
 
-        connections = Connection.objects.filter(Q(accepter=user) | Q(requester=user), ~Q(status=Connection_Status['RJ'].value))
-
-        type = request.query_params.get('type')
-        query = request.query_params.get('q')
-
-        if type and type == '0':
-            connections = connections.filter(accepter=user, status='PD')
-        elif type and type == '1':
-            connections = connections.filter(requester=user, status='PD')
-        elif type and type == '2':
-            connections = connections.filter(status='AC')
+        connections = user_connections(user)
+        enrolled_module_ids = set(Enrolment.objects.filter(user=user).values_list('module_id', flat=True))
+        context = {'user': user, 'enrolled_module_ids': enrolled_module_ids}
+
+        since = request.query_params.get('since')
+        if since:
+            return self.get_changes(request, connections, since, context)
+
+        connections = filter_connections(connections, user, request.query_params)
+
+        if is_cursor_request(request):
+            # Taken before the first page is read, so that syncing from it can't miss a change made while paging.
+            sync_token = encode_sync_token(timezone.now())
+            paginator = ConnectionCursorPagination()
+            connections = paginator.paginate_queryset(connections, request)
+            serializer = ConnectionSerializer(connections, many=True, context=context)
+            response = paginator.get_paginated_response(serializer.data)
+            if not request.query_params.get('cursor'):
+                response.data['sync_token'] = sync_token
+            response['Access-Control-Allow-Origin'] = '*'
+            return response
 
-        if query:
-            connections = connections.filter(Q(requester=user, accepter__name__icontains=query) | 
-                                             Q(accepter=user, requester__name__icontains=query) | 
-                                             Q(module__module_code__icontains=query) |
-                                             Q(module__title__icontains=query))
-        
         connections = connections.order_by('creation_time')
-        
-        serializer = ConnectionSerializer(connections, many=True, context={'user': user})
+        serializer = ConnectionSerializer(connections, many=True, context=context)
         response = Response(serializer.data)
         response['Access-Control-Allow-Origin'] = '*'
         return response
 
+    def get_changes(self, request, connections, since, context):
+        """Returns the changes to the user's connections since a ?since= sync token or timestamp."""
+
+        user = request.user
+        try:
+            since = decode_sync_token(since)
+        except ParseError:
+            response = Response('Invalid since', status=status.HTTP_400_BAD_REQUEST)
+            response['Access-Control-Allow-Origin'] = '*'
+            return response
+
+        if since < timezone.now() - timedelta(seconds=settings.CONNECTION_TOMBSTONE_MAX_AGE):
+            response = Response('Changes since then are no longer available.', status=status.HTTP_410_GONE)
+            response['Access-Control-Allow-Origin'] = '*'
+            return response
+
+        response = Response(connection_changes(user, connections, since, context))
+        response['Access-Control-Allow-Origin'] = '*'
+        return response
+
     def post(self, request, format=None):
         user = request.user
         data = request.data
@@ -374,23 +561,23 @@ class UserConnectionView(APIView):
         try:
             obj = data
             module_code = obj["module_code"]
-            module = Module.objects.get(module_code__iexact=module_code)
+            module = Module.objects.with_code(module_code).get()
             other_user_id = obj["other_user"]
             other_user = User.objects.get(id=other_user_id)
 
 
-            connection = Connection.objects.filter(Q(requester=user, accepter=other_user) | Q(requester=other_user, accepter=user))
-            if connection.exists():
-                response = Response('A connection between these 2 users already exists.', status=status.HTTP_405_METHOD_NOT_ALLOWED)
-                response['Access-Control-Allow-Origin'] = '*'
-                return response
-            elif user.id == other_user_id:
+            if user.id == other_user.id:
                 response = Response('Cannot connect user with themselves', status=status.HTTP_405_METHOD_NOT_ALLOWED)
                 response['Access-Control-Allow-Origin'] = '*'
                 return response
 
-            connection = Connection(requester=user, accepter=other_user, module=module, status='PD')
-            connection.save()
+            try:
+                with transaction.atomic():
+                    connection = Connection.objects.create(requester=user, accepter=other_user, module=module, status='PD')
+            except IntegrityError:
+                response = Response('A connection between these 2 users already exists.', status=status.HTTP_405_METHOD_NOT_ALLOWED)
+                response['Access-Control-Allow-Origin'] = '*'
+                return response
             serializer = ConnectionSerializer(connection, context={'user': user})
             response = Response(serializer.data)
             response['Access-Control-Allow-Origin'] = '*'
@@ -429,7 +616,12 @@ class UserConnectionView(APIView):
             if new_status == Connection_Status["RJ"].name:
                 connection.delete()
             else:
-                connection.update(status=new_status)
+                connection.update(status=new_status, updated_at=timezone.now())
+                # update() doesn't send post_save, so cached connection statuses are dropped, and waiting clients woken, here.
+                user_ids = connection.values_list('requester_id', 'accepter_id').get()
+                invalidate_connection_statuses(*user_ids)
+                notify_connection_changes(*user_ids)
+                user.forget_connection_statuses()
 
             response = Response("Successfully updated status")
             response['Access-Control-Allow-Origin'] = '*'
@@ -440,3 +632,143 @@ class UserConnectionView(APIView):
             response = Response("Invalid request", status=status.HTTP_400_BAD_REQUEST)
             response['Access-Control-Allow-Origin'] = '*'
             return response
+
+class BulkConnectionView(APIView):
+    """Sends connection requests in a module to several users at once, with the same rules as UserConnectionView.post.
+    Returns whether a connection was created or skipped for each user, in the order given."""
+
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request, format=None):
+        user = request.user
+        data = request.data
+
+        try:
+            module = Module.objects.with_code(data["module_code"]).get()
+            other_user_ids = list(dict.fromkeys(int(other_user_id) for other_user_id in data["other_users"]))
+        except Exception as e:
+            print(e)
+            response = Response("Invalid request", status=status.HTTP_400_BAD_REQUEST)
+            response['Access-Control-Allow-Origin'] = '*'
+            return response
+
+        if len(other_user_ids) > settings.BULK_CONNECTION_MAX_USERS:
+            response = Response(f'At most {settings.BULK_CONNECTION_MAX_USERS} users can be requested at once.', status=status.HTTP_400_BAD_REQUEST)
+            response['Access-Control-Allow-Origin'] = '*'
+            return response
+
+        try:
+            with transaction.atomic():
+                skipped, created = self.create_connections(user, module, other_user_ids)
+        except IntegrityError:
+            # A connection with one of the users was created concurrently, and is skipped the second time.
+            with transaction.atomic():
+                skipped, created = self.create_connections(user, module, other_user_ids)
+
+        if created:
+            # bulk_create() doesn't send post_save, so cached connection statuses are dropped, and waiting clients woken, here.
+            invalidate_connection_statuses(user.id, *created.keys())
+            notify_connection_changes(user.id, *created.keys())
+            user.forget_connection_statuses()
+
+        enrolled_module_ids = set(Enrolment.objects.filter(user=user, module=module).values_list('module_id', flat=True))
+        connections = user_connections(user).filter(id__in=[connection.id for connection in created.values()])
+        serializer = ConnectionSerializer(connections, many=True, context={'user': user, 'enrolled_module_ids': enrolled_module_ids})
+        serialized = {connection['id']: connection for connection in serializer.data}
+
+        results = []
+        for other_user_id in other_user_ids:
+            if other_user_id in created:
+                results.append({'other_user': other_user_id, 'result': 'created', 'connection': serialized[created[other_user_id].id]})
+            else:
+                results.append({'other_user': other_user_id, 'result': 'skipped', 'reason': skipped[other_user_id]})
+
+        response = Response({'results': results})
+        response['Access-Control-Allow-Origin'] = '*'
+        return response
+
+    def create_connections(self, user, module, other_user_ids):
+        """Creates pending connections from user to those of other_user_ids it can connect with.
+        Returns the reasons the others were skipped, and the created connections, by user id."""
+
+        existing_user_ids = set(User.objects.filter(id__in=other_user_ids).values_list('id', flat=True))
+        connected_user_ids = set()
+        for requester_id, accepter_id in Connection.objects.filter(
+                Q(requester=user, accepter_id__in=other_user_ids) | Q(accepter=user, requester_id__in=other_user_ids),
+        ).values_list('requester_id', 'accepter_id'):
+            connected_user_ids.add(accepter_id if requester_id == user.id else requester_id)
+
+        skipped = {}
+        connections = []
+        for other_user_id in other_user_ids:
+            if other_user_id == user.id:
+                skipped[other_user_id] = 'Cannot connect user with themselves'
+            elif other_user_id not in existing_user_ids:
+                skipped[other_user_id] = 'No such user'
+            elif other_user_id in connected_user_ids:
+                skipped[other_user_id] = 'A connection between these 2 users already exists.'
+            else:
+                connections.append(Connection(requester=user, accepter_id=other_user_id, module=module, status='PD'))
+
+        Connection.objects.bulk_create(connections)
+        return skipped, {connection.accepter_id: connection for connection in connections}
+
+class AsyncUserConnectionView(AsyncAPIView):
+    """UserConnectionView.get for ASGI servers, without ?since= syncing."""
+
+    permission_classes = [permissions.IsAuthenticated]
+
+    async def get(self, request):
+        user = request.user
+        enrolled_module_ids = {module_id async for module_id in Enrolment.objects.filter(user=user).values_list('module_id', flat=True)}
+        connections = filter_connections(user_connections(user), user, request.GET)
+        context = {'user': user, 'enrolled_module_ids': enrolled_module_ids}
+
+        if is_cursor_request(Request(request)):
+            paginator = ConnectionCursorPagination()
+            connections = await get_page(connections, request, paginator)
+            context['profile_cards'] = await self.get_profile_cards(connections, user)
+            serializer = ConnectionSerializer(connections, many=True, context=context)
+            return api_response(get_page_data(serializer.data, request, paginator))
+
+        connections = [connection async for connection in connections.order_by('creation_time')]
+        context['profile_cards'] = await self.get_profile_cards(connections, user)
+        serializer = ConnectionSerializer(connections, many=True, context=context)
+        return api_response(serializer.data)
+
+    async def get_profile_cards(self, connections, user):
+        other_users = [ConnectionSerializer().get_other_user_side(connection, user)[0] for connection in connections]
+        return await aget_profile_cards(SimpleUserSerializer(), other_users)
+
+class AsyncConnectionEventsView(AsyncAPIView):
+    """Long-polls for changes to the user's connections, e.g. new requests to them, or their requests being accepted.
+
+    Takes the sync token of the user's last changes, from user/connections, and responds with the changes since,
+    like user/connections?since=, as soon as there are any, or with no changes after ?timeout= seconds.
+    Waiting clients hold no thread or database connection.
+    """
+
+    permission_classes = [permissions.IsAuthenticated]
+
+    async def get(self, request):
+        user = request.user
+        try:
+            since = decode_sync_token(request.GET.get('since', ''))
+            timeout = min(float(request.GET.get('timeout', settings.CONNECTION_EVENTS_TIMEOUT)), settings.CONNECTION_EVENTS_TIMEOUT)
+        except (ParseError, ValueError):
+            return api_response('Invalid since or timeout', status=status.HTTP_400_BAD_REQUEST)
+
+        if since < timezone.now() - timedelta(seconds=settings.CONNECTION_TOMBSTONE_MAX_AGE):
+            return api_response('Changes since then are no longer available.', status=status.HTTP_410_GONE)
+
+        # Listening before reading, so that a change made in between still wakes the client.
+        with event_broker.listen(connection_events_channel(user.id)) as listener:
+            changes = await sync_to_async(self.get_changes)(user, since)
+            if not changes['changed'] and not changes['removed'] and await listener.wait(timeout):
+                changes = await sync_to_async(self.get_changes)(user, since)
+        return api_response(changes)
+
+    def get_changes(self, user, since):
+        enrolled_module_ids = set(Enrolment.objects.filter(user=user).values_list('module_id', flat=True))
+        context = {'user': user, 'enrolled_module_ids': enrolled_module_ids}
+        return connection_changes(user, user_connections(user), since, context)